@@ -1,3 +1,37 @@
 """ Wrapper to include the main library modules """
-from .core import ULog
-from . import px4
+import importlib
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .core import ULog
+    from .writer import ULogWriter
+    from . import px4
+
+# The modules are loaded on first access, so that importing a single module
+# (e.g. for a command line script) does not load numpy and everything else.
+_LAZY_ATTRIBUTES = {
+    'ULog': ('.core', 'ULog'),
+    'ULogWriter': ('.writer', 'ULogWriter'),
+}
+# submodules, e.g. pyulog.core or pyulog.px4_events (the package used to
+# import them eagerly)
+_LAZY_ATTRIBUTES.update((module_name, ('.' + module_name, None)) for module_name in [
+    'align', 'batch', 'cdr', 'core', 'crop', 'db', 'decimate', 'extract_gps_dump',
+    'extract_message', 'info', 'libevents_parse', 'merge', 'messages', 'migrate_db',
+    'parameters', 'params', 'px4', 'px4_events', 'replay', 'scanner', 'ulog2csv',
+    'ulog2kml', 'ulog2parquet', 'ulog2ros2bag', 'validate', 'writer'])
+
+
+def __getattr__(name):
+    if name not in _LAZY_ATTRIBUTES:
+        raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+    module_name, attribute_name = _LAZY_ATTRIBUTES[name]
+    value = importlib.import_module(module_name, __name__)
+    if attribute_name is not None:
+        value = getattr(value, attribute_name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_ATTRIBUTES))
@@ -0,0 +1,300 @@
+"""
+Align the data of multiple topics onto a common timeline (wide table)
+"""
+
+import collections
+
+import numpy as np
+
+from .core import ULog
+
+#pylint: disable=invalid-name
+
+ALIGN_METHODS = ('previous', 'nearest', 'linear')
+
+# default number of timestamps that are aligned at once
+ALIGN_CHUNK_SIZE = 1 << 16
+
+AlignIndex = collections.namedtuple('AlignIndex', [
+    'valid', # np.array of bool: True where a value is defined
+    'indexes', # np.array of the source sample for each valid timestamp (for
+               # 'linear' the sample before)
+    'next_indexes', # np.array of the sample after ('linear' only, else None)
+    'weights', # np.array of the interpolation weights ('linear' only, else None)
+    ])
+
+
+def _sorted_timestamps(data: ULog.Data):
+    """ get the timestamps of a topic and the sort order (None if already
+    sorted, which is the normal case) """
+    t = data.data['timestamp']
+    if len(t) > 1 and np.any(t[1:] < t[:-1]):
+        order = np.argsort(t, kind='stable')
+        return t[order], order
+    return t, None
+
+
+def get_data_fields(data: ULog.Data):
+    """ get the field names of a topic that get aligned: all fields in log
+    order, except the timestamp and padding """
+    return [f.field_name for f in data.field_data
+            if f.field_name != 'timestamp' and not f.field_name.startswith('_padding')]
+
+
+def get_align_index(t, timestamps, method='previous', tolerance=None):
+    """
+    Find the source samples for a timeline, so that several columns of the
+    same topic can be aligned with a single search (see apply_align_index()).
+
+    :param t: sorted timestamps of the source data
+    :param timestamps: timeline to align to
+    :param method: 'previous': last sample at or before each timestamp
+                   (as-of join), 'nearest': closest sample (the previous one
+                   on ties), 'linear': linear interpolation between
+                   neighboring samples
+    :param tolerance: maximum distance [us] between a timestamp and the
+                      closest sample that is used, or None for no limit
+
+    :return: AlignIndex
+    """
+    if method not in ALIGN_METHODS:
+        raise ValueError('invalid align method \'{}\''.format(method))
+    if len(t) == 0:
+        valid = np.zeros(len(timestamps), dtype=np.bool_)
+        if method == 'linear':
+            no_samples = np.zeros(0, dtype=np.int64)
+            return AlignIndex(valid, no_samples, no_samples, np.zeros(0))
+        return AlignIndex(valid, np.zeros(len(timestamps), dtype=np.int64), None, None)
+    idx = np.searchsorted(t, timestamps, side='right')
+
+    if method == 'linear':
+        # exact match with the last sample is valid as well
+        valid = (idx > 0) & ((idx < len(t)) | (timestamps == t[-1]))
+        i1 = np.minimum(idx[valid], len(t) - 1)
+        i0 = np.maximum(i1 - 1, 0)
+        t0 = t[i0].astype(np.float64)
+        dt = t[i1].astype(np.float64) - t0
+        with np.errstate(divide='ignore', invalid='ignore'):
+            w = np.where(dt > 0, (timestamps[valid].astype(np.float64) - t0) / dt, 1.)
+        if tolerance is not None:
+            within = np.minimum(w, 1. - w) * dt <= tolerance
+            valid[valid] = within
+            i0, i1, w = i0[within], i1[within], w[within]
+        return AlignIndex(valid, i0, i1, w)
+
+    previous = idx - 1
+    if method == 'previous':
+        valid = previous >= 0
+        idx = np.maximum(previous, 0)
+    else:
+        # the previous sample, unless the next one is closer
+        following = np.minimum(idx, len(t) - 1)
+        use_next = (previous < 0) | ((idx < len(t)) & (
+            t[following] - timestamps < timestamps - t[np.maximum(previous, 0)]))
+        idx = np.where(use_next, following, np.maximum(previous, 0))
+        valid = np.ones(len(timestamps), dtype=np.bool_)
+    if tolerance is not None:
+        distance = np.abs(timestamps.astype(np.float64) - t[idx].astype(np.float64))
+        valid &= distance <= tolerance
+    return AlignIndex(valid, idx, None, None)
+
+
+def apply_align_index(x, align_index):
+    """
+    Align a single column with an AlignIndex.
+
+    :param x: source values (in the order of the sorted timestamps)
+    :param align_index: AlignIndex from get_align_index()
+
+    :return: np.array with a value per timestamp. Timestamps without a value
+             are set to NaN, which converts the result to float64 ('linear'
+             always returns float64).
+    """
+    valid, indexes, next_indexes, weights = align_index
+    if weights is None:
+        values = x[indexes] if len(x) > 0 else np.zeros(len(valid))
+        if not np.all(valid):
+            values = values.astype(np.float64)
+            values[~valid] = np.nan
+        return values
+
+    values = np.full(len(valid), np.nan)
+    x0 = x[indexes].astype(np.float64)
+    x1 = x[next_indexes].astype(np.float64)
+    values[valid] = x0 + weights * (x1 - x0)
+    return values
+
+
+def align_values(t, x, timestamps, method='previous', tolerance=None):
+    """
+    Align a single column onto a timeline.
+
+    :param t: sorted timestamps of the source data
+    :param x: source values (same length as t)
+    :param timestamps: timeline to align to
+    :param method: 'previous', 'nearest' or 'linear', see get_align_index()
+    :param tolerance: see get_align_index()
+
+    :return: np.array with len(timestamps) values. Timestamps before the first
+             sample (and after the last one for 'linear') or outside of the
+             tolerance are set to NaN, which converts the result to float64.
+    """
+    return apply_align_index(x, get_align_index(t, timestamps, method, tolerance))
+
+
+def iter_align_data(data_list, timestamps, method='previous', tolerance=None,
+                    chunk_size=ALIGN_CHUNK_SIZE):
+    """
+    Align the fields of several topics onto a timeline, in chunks of the
+    timeline, so that memory use is bounded for long logs.
+
+    :param data_list: list of ULog.Data objects, or of (ULog.Data, list of
+                      field names) tuples to align only some fields
+    :param timestamps: np.array of timestamps [us] to align to
+    :param method: see get_align_index()
+    :param tolerance: see get_align_index()
+    :param chunk_size: number of timestamps per chunk
+
+    :return: generator of (timestamps, columns) tuples for consecutive parts
+             of the timeline, where columns is a dict with key =
+             '<topic name>_<multi_id>.<field name>', value = np.array of
+             aligned values
+    """
+    topics = []
+    for d in data_list:
+        d, field_names = d if isinstance(d, tuple) else (d, get_data_fields(d))
+        t, order = _sorted_timestamps(d)
+        topics.append((d, field_names, t, order))
+
+    for start in range(0, max(len(timestamps), 1), chunk_size):
+        chunk_timestamps = timestamps[start:start + chunk_size]
+        columns = {}
+        for d, field_names, t, order in topics:
+            align_index = get_align_index(t, chunk_timestamps, method, tolerance)
+            if order is not None:
+                # index the unsorted data directly
+                indexes = order[align_index.indexes]
+                next_indexes = None if align_index.next_indexes is None else \
+                    order[align_index.next_indexes]
+                align_index = align_index._replace(indexes=indexes, next_indexes=next_indexes)
+            for field_name in field_names:
+                column_name = '{}_{}.{}'.format(d.name, d.multi_id, field_name)
+                columns[column_name] = apply_align_index(d.data[field_name], align_index)
+        yield chunk_timestamps, columns
+
+
+def align_data(data_list, timestamps, method='previous', tolerance=None):
+    """
+    Align the fields of several topics onto a given timeline.
+
+    :param data_list: list of ULog.Data objects, or of (ULog.Data, list of
+                      field names) tuples to align only some fields
+    :param timestamps: np.array of timestamps [us] to align to
+    :param method: see get_align_index()
+    :param tolerance: see get_align_index()
+
+    :return: dict with key = '<topic name>_<multi_id>.<field name>', value =
+             np.array of aligned values
+    """
+    _, columns = next(iter_align_data(data_list, timestamps, method, tolerance,
+                                      max(len(timestamps), 1)))
+    return columns
+
+
+def select_data(ulog: ULog, topic_names=None):
+    """
+    Get the topics (all instances) and fields to align.
+
+    :param topic_names: list of topic names (all fields) or of (topic name,
+                        list of field names) tuples, or None for all topics
+
+    :return: list of (ULog.Data, list of field names) tuples
+    """
+    if topic_names is None:
+        return [(d, get_data_fields(d)) for d in ulog.data_list]
+    selected_fields = {}
+    for selection in topic_names:
+        if isinstance(selection, str):
+            selected_fields[selection] = None
+        else:
+            selected_fields[selection[0]] = list(selection[1])
+    data_list = []
+    for d in ulog.data_list:
+        if d.name in selected_fields:
+            field_names = selected_fields[d.name]
+            data_list.append((d, get_data_fields(d) if field_names is None else field_names))
+    return data_list
+
+
+def get_reference_timestamps(ulog: ULog, reference, data_list=None):
+    """
+    Get the timeline for aligning.
+
+    :param reference: name of the reference topic (first instance) or a rate in
+                      [Hz] as number (int or float)
+    :param data_list: topics spanning the timeline for a fixed rate (default:
+                      all topics)
+
+    :return: np.array of timestamps [us]
+    """
+    if isinstance(reference, str):
+        t, _ = _sorted_timestamps(ulog.get_dataset(reference))
+        return t
+
+    rate = float(reference)
+    if rate <= 0:
+        raise ValueError('rate must be positive')
+    if data_list is None:
+        data_list = ulog.data_list
+    t_first = [d.data['timestamp'].min() for d in data_list if len(d.data['timestamp']) > 0]
+    t_last = [d.data['timestamp'].max() for d in data_list if len(d.data['timestamp']) > 0]
+    if len(t_first) == 0:
+        return np.zeros(0, dtype=np.uint64)
+    t_start = int(min(t_first))
+    num_samples = int((int(max(t_last)) - t_start) * rate / 1e6) + 1
+    return (t_start + np.arange(num_samples) * (1e6 / rate)).astype(np.uint64)
+
+
+def get_align_timeline(ulog: ULog, reference, topic_names=None, time_s=None, time_e=None):
+    """
+    Get the timeline and the topics for aligning (see align_topics()).
+
+    :return: (timestamps, data_list) tuple: timestamps is an np.array of the
+             timeline [us], data_list a list of (ULog.Data, list of field
+             names) tuples as returned by select_data()
+    """
+    data_list = select_data(ulog, topic_names)
+
+    timestamps = get_reference_timestamps(ulog, reference, [d for d, _ in data_list])
+    if time_s:
+        timestamps = timestamps[timestamps >= time_s * 1e6]
+    if time_e:
+        timestamps = timestamps[timestamps < time_e * 1e6]
+    return timestamps, data_list
+
+
+def align_topics(ulog: ULog, reference, topic_names=None, method='previous',
+                 time_s=None, time_e=None, tolerance=None):
+    """
+    Align the data of multiple topics onto the timeline of a reference topic
+    or onto a fixed rate, producing a single wide table. With method
+    'previous' and a tolerance, this is an as-of join onto the reference.
+    For long logs, use get_align_timeline() and iter_align_data() to align
+    in chunks.
+
+    :param ulog: ULog object
+    :param reference: name of the reference topic or a rate in [Hz]
+    :param topic_names: list of topic names to include (all instances and
+                        fields) or of (topic name, list of field names)
+                        tuples, or None for all topics
+    :param method: 'previous', 'nearest' or 'linear', see get_align_index()
+    :param time_s: only include timestamps after this time (in seconds)
+    :param time_e: only include timestamps before this time (in seconds)
+    :param tolerance: see get_align_index()
+
+    :return: (timestamps, columns) tuple: timestamps is an np.array of the
+             timeline [us], columns a dict of np.array's as returned by
+             align_data()
+    """
+    timestamps, data_list = get_align_timeline(ulog, reference, topic_names, time_s, time_e)
+    return timestamps, align_data(data_list, timestamps, method, tolerance)
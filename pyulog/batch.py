@@ -0,0 +1,279 @@
+#! /usr/bin/env python
+"""
+Run a pyulog command line tool over a directory tree of ULog files, using a
+pool of worker processes.
+"""
+
+import argparse
+import contextlib
+import fnmatch
+import importlib
+import io
+import json
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+
+#pylint: disable=too-many-arguments
+
+# command name -> module with a main(argv) function
+COMMANDS = {
+    'info': 'pyulog.info',
+    'messages': 'pyulog.messages',
+    'params': 'pyulog.params',
+    'csv': 'pyulog.ulog2csv',
+    'parquet': 'pyulog.ulog2parquet',
+    'kml': 'pyulog.ulog2kml',
+    'extract_gps_dump': 'pyulog.extract_gps_dump',
+    'validate': 'pyulog.validate',
+}
+
+# commands with an output directory option: in a batch, each file writes to
+# the subdirectory of its relative path, so that files with the same name in
+# different directories do not overwrite each other
+OUTPUT_DIRECTORY_COMMANDS = {'csv', 'parquet', 'extract_gps_dump'}
+
+# commands that write a single output file: in a batch, the output file
+# argument names a directory instead, and each file writes to
+# <output directory>/<relative path><extension>. The value is the extension
+# and the output options (empty for the positional argument after the file
+# name, which is only replaced if given).
+OUTPUT_FILE_COMMANDS = {
+    'kml': ('.kml', ('-o', '--output')),
+    'params': ('.txt', ()),
+}
+
+
+def main(argv=None):
+    """Command line interface"""
+    parser = argparse.ArgumentParser(
+        description='Run a pyulog command on all ULog files in a directory tree',
+        epilog='Any additional arguments are passed to the command, e.g.:'
+        ' ulog_batch params logs/ -o out -- -i')
+    parser.add_argument('command', choices=sorted(COMMANDS),
+                        help='Command to run for each file')
+    parser.add_argument('directory', help='Directory to search for log files (recursively),'
+                        ' or a single file')
+    parser.add_argument('-j', '--jobs', dest='jobs', type=int, default=None,
+                        help='Number of worker processes (default is the number of CPUs)')
+    parser.add_argument('-p', '--pattern', dest='pattern', default='*.ulg',
+                        help="File name pattern (default is '*.ulg')")
+    parser.add_argument('-o', '--output', dest='output', metavar='DIR', default=None,
+                        help='Write the output of each file to DIR/<relative path>.txt'
+                        ' instead of one JSON lines record per file')
+    parser.add_argument('--jsonl', dest='jsonl', metavar='FILE', default=None,
+                        help='Write the JSON lines records to FILE (default is stdout)')
+    parser.add_argument('-q', '--quiet', dest='quiet', action='store_true', default=False,
+                        help='Do not report the progress on stderr')
+
+    args, command_args = parser.parse_known_args(argv)
+    if command_args and command_args[0] == '--':
+        command_args = command_args[1:]
+
+    file_names = find_log_files(args.directory, args.pattern)
+    if args.output is None:
+        if args.jsonl is None:
+            summary = run_batch(args.command, file_names, command_args, sys.stdout,
+                                jobs=args.jobs, progress=not args.quiet,
+                                base_directory=args.directory)
+        else:
+            with open(args.jsonl, 'w', encoding='utf-8') as jsonl_file:
+                summary = run_batch(args.command, file_names, command_args, jsonl_file,
+                                    jobs=args.jobs, progress=not args.quiet,
+                                    base_directory=args.directory)
+    else:
+        summary = run_batch(args.command, file_names, command_args, None,
+                            jobs=args.jobs, progress=not args.quiet,
+                            base_directory=args.directory, output_directory=args.output)
+
+    print('Processed {} files: {} ok, {} failed'.format(
+        summary['total'], summary['ok'], len(summary['failed'])), file=sys.stderr)
+    for file_name in summary['failed']:
+        print(' failed: {}'.format(file_name), file=sys.stderr)
+    if summary['failed']:
+        sys.exit(1)
+
+
+def find_log_files(directory, pattern='*.ulg'):
+    """ get a sorted list of all files matching pattern in a directory tree """
+    if os.path.isfile(directory):
+        return [directory]
+    file_names = []
+    for root, dir_names, files in os.walk(directory):
+        dir_names.sort()
+        for file_name in sorted(files):
+            if fnmatch.fnmatch(file_name, pattern):
+                file_names.append(os.path.join(root, file_name))
+    return file_names
+
+
+def run_command(command, file_name, command_args=None):
+    """
+    Run a command on a single file, capturing its output.
+
+    :param command: key in COMMANDS
+    :param file_name: ULog file name
+    :param command_args: list of additional command line arguments
+
+    :return: dict with the keys 'file', 'command', 'ok', 'exit_code',
+             'output', 'error' and 'duration_s'
+    """
+    module = importlib.import_module(COMMANDS[command])
+    argv = [file_name] + list(command_args or [])
+    output = io.StringIO()
+    exit_code = 0
+    error = None
+    start_time = time.monotonic()
+    with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+        try:
+            module.main(argv)
+        except SystemExit as exit_exception:
+            if isinstance(exit_exception.code, int):
+                exit_code = exit_exception.code
+            elif exit_exception.code is not None:
+                exit_code = 1
+                error = str(exit_exception.code)
+        except Exception: # pylint: disable=broad-exception-caught
+            exit_code = 1
+            error = traceback.format_exc()
+    return {'file': file_name,
+            'command': command,
+            'ok': exit_code == 0,
+            'exit_code': exit_code,
+            'output': output.getvalue(),
+            'error': error,
+            'duration_s': round(time.monotonic() - start_time, 6)}
+
+
+def _run_command_args(args):
+    return run_command(*args)
+
+
+def run_batch(command, file_names, command_args=None, jsonl_file=None, jobs=None,
+              progress=False, base_directory=None, output_directory=None):
+    """
+    Run a command on many files, reusing a pool of worker processes.
+
+    :param command: key in COMMANDS
+    :param file_names: list of ULog file names
+    :param command_args: list of additional command line arguments
+    :param jsonl_file: text file object to write one JSON record per file to
+                       (see run_command() for the format), or None
+    :param jobs: number of worker processes (default is the number of CPUs)
+    :param progress: report the progress on stderr
+    :param base_directory: file names are made relative to this directory
+                           for the output files (default is the common
+                           directory of all files)
+    :param output_directory: if set, write the output of each file to
+                             <output_directory>/<relative file name>.txt
+
+    :return: dict with the keys 'total', 'ok' (counts) and 'failed' (list of
+             file names)
+    """
+    summary = {'total': len(file_names), 'ok': 0, 'failed': []}
+    base_directory = _get_base_directory(file_names, base_directory)
+    tasks = []
+    for file_name in file_names:
+        relative_file_name = os.path.relpath(os.path.abspath(file_name), base_directory)
+        tasks.append((command, file_name,
+                      _get_command_args(command, command_args, relative_file_name)))
+    # a small chunksize keeps the workers balanced for logs of varying size
+    chunksize = max(1, min(16, len(tasks) // (4 * (jobs or os.cpu_count() or 1))))
+    with multiprocessing.Pool(jobs) as pool:
+        for i, result in enumerate(pool.imap_unordered(_run_command_args, tasks, chunksize)):
+            if result['ok']:
+                summary['ok'] += 1
+            else:
+                summary['failed'].append(result['file'])
+
+            if output_directory is not None:
+                _write_output_file(result, base_directory, output_directory)
+            if jsonl_file is not None:
+                jsonl_file.write(json.dumps(result) + '\n')
+
+            if progress:
+                print('\r[{}/{}] {} failed'.format(i + 1, len(tasks), len(summary['failed'])),
+                      end='', file=sys.stderr, flush=True)
+    if progress and len(tasks) > 0:
+        print('', file=sys.stderr)
+    summary['failed'].sort()
+    return summary
+
+
+def _get_base_directory(file_names, base_directory):
+    """ get the directory the output paths are relative to """
+    if base_directory is not None and os.path.isdir(base_directory):
+        return os.path.abspath(base_directory)
+    if not file_names:
+        return os.getcwd()
+    return os.path.commonpath([os.path.dirname(os.path.abspath(file_name))
+                               for file_name in file_names])
+
+
+def _get_command_args(command, command_args, relative_file_name):
+    """ make the output of a command unique for a file (see
+    OUTPUT_DIRECTORY_COMMANDS and OUTPUT_FILE_COMMANDS), creating the
+    output directory """
+    command_args = list(command_args or [])
+    if command in OUTPUT_FILE_COMMANDS:
+        return _get_output_file_args(command, command_args, relative_file_name)
+    if command not in OUTPUT_DIRECTORY_COMMANDS:
+        return command_args
+    relative_directory = os.path.dirname(relative_file_name)
+    for i, arg in enumerate(command_args):
+        if arg in ('-o', '--output') and i + 1 < len(command_args):
+            output_directory = os.path.normpath(
+                os.path.join(command_args[i + 1], relative_directory))
+            os.makedirs(output_directory, exist_ok=True)
+            command_args[i + 1] = output_directory
+            break
+        if arg.startswith('--output='):
+            output_directory = os.path.normpath(
+                os.path.join(arg[len('--output='):], relative_directory))
+            os.makedirs(output_directory, exist_ok=True)
+            command_args[i] = '--output=' + output_directory
+            break
+    return command_args
+
+
+def _get_output_file_args(command, command_args, relative_file_name):
+    """ replace the output file argument of a command in OUTPUT_FILE_COMMANDS
+    with <output directory>/<relative path><extension> """
+    extension, output_options = OUTPUT_FILE_COMMANDS[command]
+    output_index = None
+    if not output_options:
+        if command_args and not command_args[0].startswith('-'):
+            output_index = 0
+    else:
+        for i, arg in enumerate(command_args):
+            if arg in output_options and i + 1 < len(command_args):
+                output_index = i + 1
+                break
+            if arg.split('=')[0] in output_options: # --output=FILE
+                command_args[i:i + 1] = arg.split('=', 1)
+                output_index = i + 1
+                break
+
+    if output_index is None:
+        if not output_options:
+            return command_args # writes to stdout
+        command_args += [output_options[0], '.']
+        output_index = len(command_args) - 1
+    output_file_name = os.path.normpath(os.path.join(
+        command_args[output_index], os.path.splitext(relative_file_name)[0] + extension))
+    os.makedirs(os.path.dirname(output_file_name) or '.', exist_ok=True)
+    command_args[output_index] = output_file_name
+    return command_args
+
+
+def _write_output_file(result, base_directory, output_directory):
+    """ write the captured output of a single file """
+    file_name = os.path.relpath(os.path.abspath(result['file']), base_directory)
+    output_file_name = os.path.join(output_directory, file_name + '.txt')
+    os.makedirs(os.path.dirname(output_file_name), exist_ok=True)
+    with open(output_file_name, 'w', encoding='utf-8') as output_file:
+        output_file.write(result['output'])
+        if result['error'] is not None:
+            output_file.write(result['error'])
@@ -0,0 +1,153 @@
+"""
+Serialize messages with a fixed-size layout into CDR (the ROS2 wire format)
+with numpy, without creating ROS2 message objects.
+"""
+
+import re
+
+import numpy as np
+
+# ROS2 (IDL) type name -> numpy type
+CDR_TYPES = {
+    'boolean': np.uint8,
+    'octet': np.uint8,
+    'char': np.uint8,
+    'int8': np.int8,
+    'uint8': np.uint8,
+    'int16': np.int16,
+    'uint16': np.uint16,
+    'int32': np.int32,
+    'uint32': np.uint32,
+    'int64': np.int64,
+    'uint64': np.uint64,
+    'float': np.float32,
+    'double': np.float64,
+}
+
+# .msg type name -> ROS2 (IDL) type name, for the types that differ
+_MSG_TYPES = {
+    'bool': 'boolean',
+    'byte': 'octet',
+    'char': 'uint8',
+    'float32': 'float',
+    'float64': 'double',
+}
+
+# .msg constant: TYPE NAME=VALUE
+_MSG_CONSTANT_PATTERN = re.compile(r'\w+\s+\w+\s*=.*')
+# .msg field: TYPE NAME, optionally followed by a default value
+_MSG_FIELD_PATTERN = re.compile(r'(\S+)\s+(\w+)(?:\s+.*)?')
+
+# little-endian plain CDR
+ENCAPSULATION_HEADER = b'\x00\x01\x00\x00'
+
+
+def fields_from_msg_definition(msg_definition):
+    """
+    Get the fields of a .msg definition (e.g. px4_msgs/msg/VehicleAttitude.msg)
+    in the same format as MsgType.get_fields_and_field_types(). Only the
+    types that CdrEncoder supports are accepted (basic types and fixed-size
+    arrays of them).
+
+    :param msg_definition: contents of the .msg file (str)
+    :return: dict of field name to type string, in declaration order
+
+    :raises ValueError: for strings, bounded types, sequences, nested types
+                        or lines that cannot be parsed
+    """
+    fields = {}
+    for line in msg_definition.splitlines():
+        line = line.split('#', 1)[0].strip()
+        if not line or _MSG_CONSTANT_PATTERN.fullmatch(line): # empty, comment or constant
+            continue
+        field_match = _MSG_FIELD_PATTERN.fullmatch(line)
+        if field_match is None:
+            raise ValueError('invalid field definition \'{}\''.format(line))
+        type_str, name = field_match.groups()
+        type_match = re.fullmatch(r'(\w+)(\[\d+\])?', type_str)
+        base_type = _MSG_TYPES.get(type_match.group(1), type_match.group(1)) \
+            if type_match is not None else None
+        if base_type not in CDR_TYPES:
+            raise ValueError('unsupported type {} of field {}'.format(type_str, name))
+        fields[name] = base_type + (type_match.group(2) or '')
+    return fields
+
+
+class CdrEncoder(object):
+    """
+    CDR serializer for a message type with a fixed-size layout (only basic
+    types and fixed-size arrays, no strings, sequences or nested types). The
+    layout is a numpy structured dtype that includes the encapsulation
+    header and the CDR alignment of each field, so that a whole array of
+    messages is serialized at once.
+    """
+
+    def __init__(self, field_types):
+        """
+        :param field_types: dict of field name to type string in declaration
+               order, as returned by MsgType.get_fields_and_field_types()
+               or fields_from_msg_definition()
+
+        :raises ValueError: if a field type is not supported
+        """
+        names = ['_encapsulation']
+        formats = [np.dtype('V4')]
+        offsets = [0]
+        offset = 0 # alignment is relative to the end of the header
+        for name, type_str in field_types.items():
+            type_match = re.fullmatch(r'(\w+)(?:\[(\d+)\])?', type_str)
+            if type_match is None or type_match.group(1) not in CDR_TYPES:
+                raise ValueError('unsupported type {} of field {}'.format(type_str, name))
+            base_type = np.dtype(CDR_TYPES[type_match.group(1)]).newbyteorder('<')
+            offset += -offset % base_type.itemsize
+            names.append(name)
+            offsets.append(len(ENCAPSULATION_HEADER) + offset)
+            if type_match.group(2) is None:
+                formats.append(base_type)
+                offset += base_type.itemsize
+            else:
+                array_size = int(type_match.group(2))
+                formats.append(np.dtype((base_type, (array_size,))))
+                offset += base_type.itemsize * array_size
+        self.field_types = dict(field_types)
+        self.dtype = np.dtype({'names': names, 'formats': formats, 'offsets': offsets,
+                               'itemsize': len(ENCAPSULATION_HEADER) + offset})
+
+    def encode_array(self, columns, num_messages):
+        """
+        Serialize messages into a structured array, one record per message.
+
+        :param columns: dict of field name to np.array with num_messages
+               values (or rows for array fields). Missing fields are 0, and
+               for boolean fields any non-zero value is True.
+        :param num_messages: number of messages
+        :return: np.array with dtype self.dtype
+        """
+        records = np.zeros(num_messages, dtype=self.dtype)
+        records['_encapsulation'] = np.frombuffer(ENCAPSULATION_HEADER, dtype='V4')[0]
+        for name, values in columns.items():
+            if self.field_types[name].startswith('boolean'):
+                values = np.asarray(values) != 0
+            records[name] = values
+        return records
+
+    def encode(self, columns, num_messages):
+        """
+        Serialize messages.
+
+        :param columns: see encode_array()
+        :param num_messages: number of messages
+        :return: list of bytes, one per message
+        """
+        return self.to_bytes(self.encode_array(columns, num_messages))
+
+    def to_bytes(self, records):
+        """
+        Split serialized messages into one bytes object per message.
+
+        :param records: np.array with dtype self.dtype (see encode_array())
+        :return: list of bytes
+        """
+        buffer = records.tobytes()
+        size = self.dtype.itemsize
+        return [buffer[i:i+size] for i in range(0, len(buffer), size)]
@@ -4,9 +4,10 @@ import struct
 import copy
 import sys
 import contextlib
+import re
 import numpy as np
 #pylint: disable=too-many-instance-attributes, unused-argument, missing-docstring
-#pylint: disable=protected-access, too-many-branches
+#pylint: disable=protected-access, too-many-branches, too-many-lines
 
 __author__ = "Beat Kueng"
 
@@ -46,6 +47,18 @@ class ULog(object):
     MSG_TYPE_LOGGING_TAGGED = ord('C')
     MSG_TYPE_FLAG_BITS = ord('B')
 
+    # known message types that can appear in the data section
+    _DATA_SECTION_MSG_TYPES = frozenset(ord(msg_type) for msg_type in 'DIMPQARSOLC')
+
+    # message types that can be larger than the corruption size limit (see
+    # _check_packet_corruption), as they contain long strings (e.g. the boot
+    # console output)
+    _LONG_MSG_TYPES = frozenset((MSG_TYPE_INFO, MSG_TYPE_INFO_MULTIPLE))
+
+    # data section messages that are parsed when only loading the parameters
+    _INFO_AND_PARAMETER_MSG_TYPES = (MSG_TYPE_INFO, MSG_TYPE_INFO_MULTIPLE,
+                                     MSG_TYPE_PARAMETER, MSG_TYPE_PARAMETER_DEFAULT)
+
     _UNPACK_TYPES = {
         'int8_t':   ['b', 1, np.int8],
         'uint8_t':  ['B', 1, np.uint8],
@@ -76,6 +89,15 @@ class ULog(object):
     _unpack_ushort = struct.Struct('<H').unpack
     _unpack_uint64 = struct.Struct('<Q').unpack
 
+    # number of bytes read at once when only parsing parameters
+    _PARAMETERS_READ_CHUNK_SIZE = 1 << 22
+
+    # number of bytes searched at once for sync sequences
+    _SYNC_SEARCH_CHUNK_SIZE = 1 << 24
+
+    # number of messages that are written at once by write_ulog()
+    _WRITE_CHUNK_SIZE = 1 << 16
+
     # when set to True disables string parsing exceptions
     _disable_str_exceptions = False
 
@@ -93,7 +115,7 @@ class ULog(object):
         return ret
 
     def __init__(self, log_file, message_name_filter_list=None, disable_str_exceptions=True,
-                 parse_header_only=False):
+                 parse_header_only=False, parameters_only=False):
         """
         Initialize the object & load the file.
 
@@ -101,6 +123,11 @@ class ULog(object):
         :param message_name_filter_list: list of strings, to only load messages
                with the given names. If None, load everything.
         :param disable_str_parser_exceptions: If True, ignore string parsing errors
+        :param parse_header_only: If True, only load the definitions section
+        :param parameters_only: If True, only load the definitions section and
+               the info messages and (changed and default) parameters of the
+               data section. Data messages are skipped without being parsed,
+               so data_list and the logged messages stay empty.
         """
 
         self._debug = False
@@ -131,11 +158,13 @@ class ULog(object):
         self._appended_offsets = [] # file offsets for appended data
         self._has_sync = True # set to false when first file search for sync fails
         self._sync_seq_cnt = 0 # number of sync packets found in file
+        self._corrupt_ranges = [] # list of (start, end) file offsets of skipped bytes
 
         ULog._disable_str_exceptions = disable_str_exceptions
 
         if log_file is not None:
-            self._load_file(log_file, message_name_filter_list, parse_header_only)
+            self._load_file(log_file, message_name_filter_list, parse_header_only,
+                            parameters_only)
 
     ## parsed data
 
@@ -216,6 +245,17 @@ class ULog(object):
         """ True if a file corruption got detected """
         return self._file_corrupt
 
+    @property
+    def corrupt_ranges(self):
+        """ list of (start, end) file offsets of the byte ranges that were
+        skipped to recover from corruptions (adjacent ranges are joined). A
+        range ends where the parsing is aligned again (at the next sync
+        sequence or data message that matches its subscription), so it also
+        contains the bogus messages read after a corrupt header. With
+        parameters_only, these are the ranges of ULogScanner, which skips
+        differently. """
+        return self._corrupt_ranges
+
     @property
     def has_default_parameters(self):
         """ True if compat flag DEFAULT_PARAMETERS is set """
@@ -237,262 +277,157 @@ class ULog(object):
         return [elem for elem in self._data_list
                 if elem.name == name and elem.multi_id == multi_instance][0]
 
+    def slice(self, t_start=None, t_end=None):
+        """ get a ULog object with the data, logged messages, dropouts and
+        parameter changes with t_start <= timestamp < t_end. The topic data are
+        views into the arrays of this object (see Data.slice()), nothing is
+        copied. The parameter changes before t_start are applied to the initial
+        parameters, so that they contain the values at t_start.
+
+        :param t_start: start timestamp [us], or None for the start of the log
+        :param t_end: end timestamp [us] (exclusive), or None for the end of the log
+        """
+        def in_range(timestamp):
+            return (t_start is None or timestamp >= t_start) and \
+                (t_end is None or timestamp < t_end)
+
+        sliced = copy.copy(self)
+        sliced._data_list = [d.slice(t_start, t_end) for d in self._data_list]
+        sliced._logged_messages = [m for m in self._logged_messages if in_range(m.timestamp)]
+        sliced._logged_messages_tagged = {
+            tag: [m for m in messages if in_range(m.timestamp)]
+            for tag, messages in self._logged_messages_tagged.items()}
+        sliced._dropouts = [d for d in self._dropouts if in_range(d.timestamp)]
+        sliced._changed_parameters = [p for p in self._changed_parameters if in_range(p[0])]
+        if t_start is not None:
+            sliced._initial_parameters = dict(self._initial_parameters)
+            sliced._initial_parameters.update(
+                (name, value) for timestamp, name, value in self._changed_parameters
+                if timestamp < t_start)
+        if t_end is not None:
+            sliced._last_timestamp = min(self._last_timestamp, int(t_end))
+        return sliced
+
+    def to_arrow(self, message_names=None):
+        """ convert the topic data into pyarrow Tables (requires pyarrow), see
+        Data.to_arrow().
+
+        :param message_names: list of topic names to convert, None for all
+
+        :return: dict with key = (name, multi_id), value = pyarrow.Table
+        """
+        return {(d.name, d.multi_id): d.to_arrow() for d in self._data_list
+                if message_names is None or d.name in message_names}
+
+    def to_pandas(self, message_names=None, combine_multi_ids=False, **kwargs):
+        """ convert the topic data into pandas DataFrames (requires pandas),
+        see Data.to_pandas() for the arguments.
+
+        :param message_names: list of topic names to convert, None for all
+        :param combine_multi_ids: combine all instances of a topic into a
+               single DataFrame with a (multi_id, timestamp) MultiIndex. This
+               requires a copy of the data.
+
+        :return: dict with key = (name, multi_id), value = pandas.DataFrame,
+                 or key = name if combine_multi_ids is set
+        """
+        data_frames = {(d.name, d.multi_id): d.to_pandas(**kwargs) for d in self._data_list
+                       if message_names is None or d.name in message_names}
+        if not combine_multi_ids:
+            return data_frames
+
+        import pandas as pd # pylint: disable=import-outside-toplevel, import-error
+        combined = {}
+        for (name, multi_id), data_frame in data_frames.items():
+            combined.setdefault(name, {})[multi_id] = data_frame
+        return {name: pd.concat(instances, names=['multi_id'])
+                for name, instances in combined.items()}
+
     def write_ulog(self, log_file):
         """ write current data back into a ulog file """
+        from .writer import ULogWriter # pylint: disable=import-outside-toplevel, cyclic-import
+
         if isinstance(log_file, str):
             handle = open(log_file, "wb")
         else:
             handle = contextlib.nullcontext(log_file)
 
         with handle as ulog_file:
+            # When writing the log back to a .ulg file, don't mark data as appended
+            incompat_flags = copy.deepcopy(self._incompat_flags)
+            incompat_flags[0] = incompat_flags[0] & 0xFE
+            writer = ULogWriter(ulog_file, self._start_timestamp, self._file_version,
+                                self._compat_flags, incompat_flags, sync_interval=None)
+
             # Definition section
-            self._write_file_header(ulog_file)
-            self._write_flags(ulog_file)
-            self._write_format_messages(ulog_file)
-            self._write_info_messages(ulog_file)
-            self._write_info_multiple_message(ulog_file)
-            self._write_initial_parameters(ulog_file)
-            self._write_default_parameters(ulog_file)
+            for message_format in self._message_formats.values():
+                writer.write_format(message_format.name, message_format.fields)
+            for key, value in self._msg_info_dict.items():
+                writer.write_info(key, value, self._msg_info_dict_types[key])
+            for key, value_sets in self._msg_info_multiple_dict.items():
+                for value_set in value_sets:
+                    writer.write_info_multiple(key, value_set,
+                                               self._msg_info_multiple_dict_types[key])
+            for parameter_name, value in self._initial_parameters.items():
+                writer.write_parameter(parameter_name, value)
+            for bit, bit_dict in self._default_parameters.items():
+                for name, value in bit_dict.items():
+                    writer.write_default_parameter(name, value, 1 << bit)
 
             # Data section
-            self._write_logged_message_subscriptions(ulog_file)
-            self._write_data_section(ulog_file)
-
-    def _write_file_header(self, file):
-        header_data = bytearray()
-        header_data.extend(self.HEADER_BYTES)
-        header_data.extend(struct.pack('B', self._file_version))
-        header_data.extend(struct.pack('<Q', self._start_timestamp))
-        if len(header_data) != 16:
-            raise TypeError("Written header is too short")
-
-        file.write(header_data)
-
-    def _write_flags(self, file):
-        data = bytearray()
-        data.extend(struct.pack('<' + 'B' * 8, *self._compat_flags))
-
-        # When writing the log back to a .ulg file, don't mark data as appended
-        imcompat_flags = copy.deepcopy(self._incompat_flags)
-        imcompat_flags[0] = imcompat_flags[0] & 0xFE
-        data.extend(struct.pack('<' + 'B' * 8, *imcompat_flags))
-
-        offsets = [0, 0, 0]
-        data.extend(struct.pack('<' + 'Q' * 3, *offsets))
-
-        header = struct.pack('<HB', len(data), self.MSG_TYPE_FLAG_BITS)
-
-        file.write(header)
-        file.write(data)
-
-    def _write_info_messages(self, file):
-        for message in self._msg_info_dict.items():
-            value_type: str = self._msg_info_dict_types[message[0]]
-            key: str = value_type + ' ' + message[0]
-            value: str = message[1]
-
-            data = self._make_info_message_data(key, value, value_type)
-            header = struct.pack('<HB', len(data), self.MSG_TYPE_INFO)
-
-            file.write(header)
-            file.write(data)
-
-    def _write_info_multiple_message(self, file):
-        for base_key, value_sets in self._msg_info_multiple_dict.items():
-            value_type: str = self._msg_info_multiple_dict_types[base_key]
-            key: str = value_type + ' ' + base_key
-
-            for value_set in value_sets:
-                continued = False
-                for value in value_set:
-                    data = self._make_info_message_data(key, value, value_type, continued)
-                    header = struct.pack('<HB', len(data), self.MSG_TYPE_INFO_MULTIPLE)
-
-                    file.write(header)
-                    file.write(data)
-
-                    continued = True
-
-    def _write_initial_parameters(self, file):
-        for parameter_name, value in self._initial_parameters.items():
-            data = self._make_parameter_data(parameter_name, value)
-            header = struct.pack('<HB', len(data), self.MSG_TYPE_PARAMETER)
-
-            file.write(header)
-            file.write(data)
+            data_sets = sorted(self._data_list, key=lambda x: x.msg_id)
+            for data_set in data_sets:
+                writer.add_subscription(data_set.name, data_set.multi_id, data_set.msg_id)
+            self._write_data_section(writer, data_sets)
 
-    def _write_default_parameters(self, file):
-        for bit, bit_dict in self._default_parameters.items():
-            bitfield = 1 << bit
-
-            for name, value in bit_dict.items():
-                data = bytearray()
-                data.extend(struct.pack('<B', bitfield))
-                data.extend(self._make_parameter_data(name, value))
-                header = struct.pack('<HB', len(data), self.MSG_TYPE_PARAMETER_DEFAULT)
-
-                file.write(header)
-                file.write(data)
-
-    def _make_parameter_data(self, name: str, value) -> bytes:
-        if isinstance(value, int):
-            value_type = "int32_t"
-        elif isinstance(value, float):
-            value_type = "float"
-        else:
-            raise TypeError("Found unknown parameter value type")
-
-        key: str = value_type + ' ' + name
-
-        return self._make_info_message_data(key, value, value_type)
-
-    def _make_info_message_data(self, key: str, value, value_type: str, continued=None) -> bytes:
-        key_bytes = bytes(key, 'utf-8')
-        data = bytearray()
-
-        if continued is not None:
-            data.extend(struct.pack('<B', continued))
-
-        data.extend(struct.pack('<B', len(key_bytes)))
-        data.extend(key_bytes)
-
-        if value_type.startswith('char['):
-            value_bytes = bytes(value, 'utf-8')
-            data.extend(value_bytes)
-        elif value_type.startswith('uint8_t['):
-            data.extend(value)
-        else:
-            code = self._UNPACK_TYPES[value_type][0]
-            data.extend(struct.pack('<' + code, value))
-
-        return data
-
-    def _write_format_messages(self, file):
-        for message_format in self._message_formats.values():
-            data = bytearray()
-
-            data.extend(bytes(message_format.name + ':', 'utf-8'))
-            for field in message_format.fields:
-                # Determine the field type (e.g. int16_t or float[8])
-                field_type: str = field[0]
-                array_size: int = field[1]
-                field_name: str = field[2]
-
-                if array_size > 0:
-                    encoded_field = '%s[%d] %s;' % (field_type, array_size, field_name)
-                else:
-                    encoded_field = '%s %s;' % (field_type, field_name)
-                data.extend(bytes(encoded_field, 'utf-8'))
-
-            header = struct.pack('<HB', len(data), self.MSG_TYPE_FORMAT)
-
-            file.write(header)
-            file.write(data)
-
-    def _write_logged_message_subscriptions(self, file):
-        data_sets = sorted(self._data_list, key=lambda x: x.msg_id)
-
-        for data_set in data_sets:
-            data = bytearray()
-            data.extend(struct.pack('<BH', data_set.multi_id, data_set.msg_id))
-            data.extend(bytes(data_set.name, 'utf-8'))
-
-            header = struct.pack('<HB', len(data), self.MSG_TYPE_ADD_LOGGED_MSG)
-
-            file.write(header)
-            file.write(data)
-
-    def _write_data_section(self, file):
+    def _write_data_section(self, writer, data_sets):
         # Reconstruct all messages in the data section except for those with the type A, S, I, M, Q.
-        items = self._make_data_items()
-        items = items + self._make_logged_message_items()
-        items = items + self._make_tagged_logged_message_items()
-        items = items + self._make_dropout_items()
-        items = items + self._make_changed_param_items()
-
-        # Sort items by timestamp
-        items.sort(key=lambda x: x[0])
-
-        for _, buffer in items:
-            file.write(buffer)
-
-    def _make_data_items(self):
-        data_sets = sorted(self._data_list, key=lambda x: x.msg_id)
-        data_items = []
-
+        items = [(message.timestamp, writer.make_logging_message(
+            message.log_level, message.message, message.timestamp))
+                 for message in self._logged_messages]
+        items.extend((message.timestamp, writer.make_logging_message(
+            message.log_level, message.message, message.timestamp, message.tag))
+                     for message_list in self._logged_messages_tagged.values()
+                     for message in message_list)
+        items.extend((dropout.timestamp, writer.make_dropout_message(dropout.duration))
+                     for dropout in self._dropouts)
+        items.extend((timestamp, writer.make_parameter_message(name, value))
+                     for timestamp, name, value in self._changed_parameters)
+
+        # (timestamps, buffer, message offsets into buffer) for each topic and
+        # the other messages
+        item_groups = []
         for data_set in data_sets:
-            data_set_length = len(data_set.data[data_set.field_data[0].field_name])
-            for i_sample in range(data_set_length):
-                timestamp = data_set.data['timestamp'][i_sample]
-                msg_id = struct.pack('<H', data_set.msg_id)
-                data = bytearray()
-                data.extend(msg_id)
-                for field in data_set.field_data:
-                    field_name = field.field_name
-                    field_type = field.type_str
-                    field_encoding = self._UNPACK_TYPES[field_type][0]
-                    field_data = data_set.data[field_name][i_sample]
-
-                    # For char type, convert np.int8 into single bytes() object
-                    # so that struct.pack can handle it
-                    if field_encoding == 'c':
-                        field_data = bytes(chr(field_data), 'utf-8')
-
-                    data.extend(struct.pack('<' + field_encoding, field_data))
-
-                header = struct.pack('<HB', len(data), self.MSG_TYPE_DATA)
-                data_items.append((timestamp, header + data))
-
-        return data_items
-
-    def _make_logged_message_items(self):
-        message_items = []
-
-        for message in self._logged_messages:
-            data = bytearray()
-            data.extend(struct.pack('<BQ', message.log_level, message.timestamp))
-            data.extend(bytes(message.message, 'utf-8'))
-
-            header = struct.pack('<HB', len(data), self.MSG_TYPE_LOGGING)
-            message_items.append((message.timestamp, header + data))
-
-        return message_items
-
-    def _make_tagged_logged_message_items(self):
-        message_items = []
-
-        for message_list in self._logged_messages_tagged.values():
-            for message in message_list:
-                data = bytearray()
-                data.extend(struct.pack('<BHQ', message.log_level, message.tag, message.timestamp))
-                data.extend(bytes(message.message, 'utf-8'))
-
-                header = struct.pack('<HB', len(data), self.MSG_TYPE_LOGGING_TAGGED)
-                message_items.append((message.timestamp, header + data))
-
-        return message_items
-
-    def _make_dropout_items(self):
-        dropout_items = []
-
-        for dropout in self._dropouts:
-            data = bytearray()
-            data.extend(struct.pack('<H', dropout.duration))
-
-            header = struct.pack('<HB', len(data), self.MSG_TYPE_DROPOUT)
-            dropout_items.append((dropout.timestamp, header + data))
-
-        return dropout_items
-
-    def _make_changed_param_items(self):
-        changed_param_items = []
-
-        for timestamp, name, value in self._changed_parameters:
-            data = self._make_parameter_data(name, value)
-            header = struct.pack('<HB', len(data), self.MSG_TYPE_PARAMETER)
-            changed_param_items.append((timestamp, header + data))
-
-        return changed_param_items
+            records = writer.make_data_records(data_set.msg_id, data_set.data)
+            offsets = np.arange(len(records) + 1, dtype=np.int64) * records.dtype.itemsize
+            item_groups.append((data_set.data['timestamp'][:len(records)].astype(np.uint64),
+                                records.view(np.uint8), offsets))
+        offsets = np.zeros(len(items) + 1, dtype=np.int64)
+        np.cumsum([len(data) for _, data in items], out=offsets[1:])
+        item_groups.append((np.array([timestamp for timestamp, _ in items], dtype=np.uint64),
+                            np.frombuffer(b''.join(data for _, data in items), dtype=np.uint8),
+                            offsets))
+
+        timestamps = np.concatenate([timestamps for timestamps, _, _ in item_groups])
+        buffer = np.concatenate([buffer for _, buffer, _ in item_groups])
+        starts = []
+        buffer_offset = 0
+        for _, group_buffer, offsets in item_groups:
+            starts.append(offsets[:-1] + buffer_offset)
+            buffer_offset += len(group_buffer)
+        starts = np.concatenate(starts)
+        lengths = np.concatenate([np.diff(offsets) for _, _, offsets in item_groups])
+
+        # Sort messages by timestamp (stable, so that messages with the same
+        # timestamp keep their order) and write them in chunks
+        order = np.argsort(timestamps, kind='stable')
+        for chunk_start in range(0, len(order), self._WRITE_CHUNK_SIZE):
+            chunk = order[chunk_start:chunk_start + self._WRITE_CHUNK_SIZE]
+            chunk_lengths = lengths[chunk]
+            chunk_offsets = np.cumsum(chunk_lengths) - chunk_lengths
+            index = np.arange(chunk_offsets[-1] + chunk_lengths[-1]) + \
+                np.repeat(starts[chunk] - chunk_offsets, chunk_lengths)
+            writer.write_serialized(buffer[index].tobytes())
 
     def __eq__(self, other):
         """
@@ -542,6 +477,30 @@ class ULog(object):
                     self.timestamp_idx == other.timestamp_idx and
                     arrays_equal)
 
+        def get_index_range(self, t_start=None, t_end=None):
+            """ get the (start, end) index range of the samples with
+            t_start <= timestamp < t_end, using a binary search (the timestamps
+            need to be sorted, which is the normal case)
+
+            :param t_start: start timestamp [us], or None to start at the first sample
+            :param t_end: end timestamp [us] (exclusive), or None to include the
+                          last sample
+            """
+            timestamps = self.data['timestamp']
+            start = int(np.searchsorted(timestamps, t_start)) if t_start is not None else 0
+            end = int(np.searchsorted(timestamps, t_end)) if t_end is not None \
+                else len(timestamps)
+            return start, max(start, end)
+
+        def slice(self, t_start=None, t_end=None):
+            """ get the samples with t_start <= timestamp < t_end (see
+            get_index_range()) as ULog.Data object, whose arrays are views
+            into the arrays of this object (no copy) """
+            start, end = self.get_index_range(t_start, t_end)
+            sliced = copy.copy(self)
+            sliced.data = {name: values[start:end] for name, values in self.data.items()}
+            return sliced
+
         def list_value_changes(self, field_name):
             """ get a list of (timestamp, value) tuples, whenever the value
             changes. The first data point with non-zero timestamp is always
@@ -558,6 +517,161 @@ class ULog(object):
             ret.extend(zip(t[indices], x[indices]))
             return ret
 
+        _array_field_pattern = re.compile(r'(.*)\[(\d+)\]')
+
+        def get_field_groups(self):
+            """ get the fields with array fields grouped together, as list of
+            (name, type_str, array_size) tuples in the order of the log.
+            E.g. the fields 'q[0]' ... 'q[3]' are returned as ('q', 'float', 4).
+            array_size is 0 for non-array fields. Padding fields are skipped. """
+            groups = []
+            array_sizes = {}
+            for field in self.field_data:
+                if field.field_name.startswith('_padding'):
+                    continue
+                result = self._array_field_pattern.fullmatch(field.field_name)
+                if result:
+                    name, array_index = result.groups()
+                    if name not in array_sizes:
+                        groups.append([name, field.type_str, 0])
+                        array_sizes[name] = groups[-1]
+                    array_sizes[name][2] = max(array_sizes[name][2], int(array_index) + 1)
+                else:
+                    groups.append([field.field_name, field.type_str, 0])
+            return [tuple(group) for group in groups]
+
+        def get_array(self, field_name, array_size=None):
+            """ get an array field (e.g. 'q' for the fields 'q[0]' ... 'q[3]')
+            as 2D np.array with shape (number of samples, array size).
+            This is a read-only view into the data if the array elements are
+            adjacent in the log (the normal case), otherwise a copy.
+
+            :param array_size: number of array elements (determined from the
+                               data if None)
+            """
+            if array_size is None:
+                array_size = 0
+                while '{}[{}]'.format(field_name, array_size) in self.data:
+                    array_size += 1
+                if array_size == 0:
+                    raise KeyError(field_name)
+            columns = [self.data['{}[{}]'.format(field_name, i)] for i in range(array_size)]
+            first = columns[0]
+            item_size = first.dtype.itemsize
+            address = first.__array_interface__['data'][0]
+            if all(column.dtype == first.dtype and column.strides == first.strides and
+                   column.__array_interface__['data'][0] == address + i * item_size
+                   for i, column in enumerate(columns)):
+                return np.lib.stride_tricks.as_strided(
+                    first, shape=(len(first), array_size),
+                    strides=(first.strides[0], item_size), writeable=False)
+            return np.column_stack(columns)
+
+        def get_string(self, field_name, array_size=None, errors='strict'):
+            """ get a char array field as np.array of strings (the string
+            ends at the first null character)
+
+            :param errors: error handling when decoding as utf-8
+            """
+            chars = self.get_array(field_name, array_size).view(np.uint8)
+            # clear everything after the first null, numpy strips trailing nulls
+            is_null = chars == 0
+            lengths = np.where(is_null.any(axis=1), is_null.argmax(axis=1), chars.shape[1])
+            chars = np.where(np.arange(chars.shape[1]) < lengths[:, np.newaxis], chars, 0)
+            strings = chars.astype(np.uint8).view('S{}'.format(chars.shape[1]))[:, 0]
+            return np.char.decode(strings, 'utf-8', errors)
+
+        def to_arrow(self):
+            """ convert into a pyarrow.Table (requires pyarrow).
+
+            Non-array fields become numeric columns, array fields fixed-size
+            list columns and char arrays dictionary-encoded string columns.
+            Contiguous numpy columns (e.g. added ones) are passed without copy,
+            whereas the fields read from the log are strided views into the
+            message records, which are copied into arrow's columnar layout.
+            Additional columns in data (not part of the message format) are
+            appended at the end. """
+            import pyarrow as pa # pylint: disable=import-outside-toplevel, import-error
+
+            names = []
+            arrays = []
+            covered_fields = set()
+            for name, type_str, array_size in self.get_field_groups():
+                if array_size == 0:
+                    values = self.data[name]
+                    if type_str == 'bool':
+                        values = values.astype(np.bool_)
+                    array = pa.array(values)
+                    covered_fields.add(name)
+                elif type_str == 'char':
+                    errors = 'ignore' if ULog._disable_str_exceptions else 'strict'
+                    array = pa.array(self.get_string(name, array_size, errors)) \
+                        .dictionary_encode()
+                else:
+                    values = np.ascontiguousarray(self.get_array(name, array_size))
+                    if type_str == 'bool':
+                        values = values.astype(np.bool_)
+                    array = pa.FixedSizeListArray.from_arrays(
+                        pa.array(values.reshape(-1)), array_size)
+                if array_size > 0:
+                    covered_fields.update('{}[{}]'.format(name, i) for i in range(array_size))
+                names.append(name)
+                arrays.append(array)
+
+            for name, values in self.data.items():
+                if name not in covered_fields and not name.startswith('_padding'):
+                    names.append(name)
+                    arrays.append(pa.array(values))
+
+            metadata = {'name': self.name, 'multi_id': str(self.multi_id),
+                        'msg_id': str(self.msg_id)}
+            return pa.Table.from_arrays(arrays, names=names, metadata=metadata)
+
+        def to_pandas(self, index=True, strings=True, arrays='columns'):
+            """ convert into a pandas.DataFrame (requires pandas).
+
+            The columns reference the existing numpy arrays without copying
+            (except for reconstructed strings).
+
+            :param index: use the timestamp as index (named 'timestamp')
+            :param strings: convert char arrays into a single string column
+            :param arrays: 'columns': one column per array element (e.g.
+                           'q[0]' ... 'q[3]'), 'lists': a single column
+                           per array field, holding a row view of get_array()
+                           for each sample
+            """
+            import pandas as pd # pylint: disable=import-outside-toplevel, import-error
+
+            if arrays not in ('columns', 'lists'):
+                raise ValueError('invalid value \'{}\' for arrays'.format(arrays))
+
+            columns = {}
+            covered_fields = set()
+            for name, type_str, array_size in self.get_field_groups():
+                if array_size == 0:
+                    columns[name] = self.data[name]
+                    covered_fields.add(name)
+                    continue
+                element_names = ['{}[{}]'.format(name, i) for i in range(array_size)]
+                if type_str == 'char' and strings:
+                    errors = 'ignore' if ULog._disable_str_exceptions else 'strict'
+                    columns[name] = self.get_string(name, array_size, errors)
+                elif arrays == 'lists':
+                    columns[name] = list(self.get_array(name, array_size))
+                else:
+                    for element_name in element_names:
+                        columns[element_name] = self.data[element_name]
+                covered_fields.update(element_names)
+
+            for name, values in self.data.items():
+                if name not in covered_fields and not name.startswith('_padding'):
+                    columns[name] = values
+
+            data_index = None
+            if index:
+                data_index = pd.Index(columns.pop('timestamp'), name='timestamp', copy=False)
+            return pd.DataFrame(columns, index=data_index, copy=False)
+
 
 
     ## Representations of the messages from the log file ##
@@ -826,6 +940,25 @@ class ULog(object):
                 self.timestamp = 0
             return has_corruption
 
+    def _read_info_or_parameter(self, header, data):
+        """ parse an info or parameter message of the data section (see
+        _INFO_AND_PARAMETER_MSG_TYPES). Changed parameters get the current
+        _last_timestamp. """
+        if header.msg_type == self.MSG_TYPE_INFO:
+            msg_info = self._MessageInfo(data, header)
+            self._msg_info_dict[msg_info.key] = msg_info.value
+            self._msg_info_dict_types[msg_info.key] = msg_info.type
+        elif header.msg_type == self.MSG_TYPE_INFO_MULTIPLE:
+            msg_info = self._MessageInfo(data, header, is_info_multiple=True)
+            self._add_message_info_multiple(msg_info)
+        elif header.msg_type == self.MSG_TYPE_PARAMETER:
+            msg_info = self._MessageInfo(data, header)
+            self._changed_parameters.append((self._last_timestamp,
+                                             msg_info.key, msg_info.value))
+        else:
+            msg_param = self._MessageParameterDefault(data, header)
+            self._add_parameter_default(msg_param)
+
     def _add_parameter_default(self, msg_param):
         """ add a _MessageParameterDefault object """
         default_types = msg_param.default_types
@@ -848,12 +981,14 @@ class ULog(object):
             self._msg_info_multiple_dict[msg_info.key] = [[msg_info.value]]
             self._msg_info_multiple_dict_types[msg_info.key] = msg_info.type
 
-    def _load_file(self, log_file, message_name_filter_list, parse_header_only=False):
+    def _load_file(self, log_file, message_name_filter_list, parse_header_only=False,
+                   parameters_only=False):
         """ load and parse an ULog file into memory """
         if isinstance(log_file, str):
             self._file_handle = open(log_file, "rb") #pylint: disable=consider-using-with
         else:
             self._file_handle = log_file
+        self._sync_positions = None # file offsets of the sync sequences, see _find_sync()
 
         # parse the whole file
         self._read_file_header()
@@ -866,20 +1001,26 @@ class ULog(object):
         if parse_header_only:
             self._file_handle.close()
             del self._file_handle
+            del self._sync_positions
             return
 
-        if self.has_data_appended and len(self._appended_offsets) > 0:
-            if self._debug:
-                print('This file has data appended')
-            for offset in self._appended_offsets:
-                self._read_file_data(message_name_filter_list, read_until=offset)
-                self._file_handle.seek(offset)
+        if parameters_only:
+            # all parts of the data section, including appended data
+            self._read_file_parameters()
+        else:
+            if self.has_data_appended and len(self._appended_offsets) > 0:
+                if self._debug:
+                    print('This file has data appended')
+                for offset in self._appended_offsets:
+                    self._read_file_data(message_name_filter_list, read_until=offset)
+                    self._file_handle.seek(offset)
 
-        # read the whole file, or the rest if data appended
-        self._read_file_data(message_name_filter_list)
+            # read the whole file, or the rest if data appended
+            self._read_file_data(message_name_filter_list)
 
         self._file_handle.close()
         del self._file_handle
+        del self._sync_positions
 
     def _read_file_header(self):
         header_data = self._file_handle.read(16)
@@ -956,7 +1097,8 @@ class ULog(object):
                     if self._check_packet_corruption(header):
                         # seek back to advance only by a single byte instead of
                         # skipping the message
-                        self._file_handle.seek(-2-header.msg_size, 1)
+                        file_position = self._file_handle.seek(-2-header.msg_size, 1)
+                        self._add_corrupt_range(file_position - 1, file_position)
 
             except IndexError:
                 if not self._file_corrupt:
@@ -965,48 +1107,27 @@ class ULog(object):
 
     def _find_sync(self, last_n_bytes=-1):
         """
-        read the file from a given location until the end of sync_byte sequence is found
-            or an end condition is met(reached EOF or searched all last_n_bytes).
+        seek to the end of the next sync_byte sequence from the current location,
+            unless an end condition is met (no sync sequence until EOF or in the
+            last_n_bytes).
         :param last_n_bytes: optional arg to search only last_n_bytes for sync_bytes.
             when provided, _find_sync searches for sync_byte sequence in the last_n_bytes
             from current location, else, from current location till end of file.
-        return true if successful, else return false and seek back to initial position and
+        return true if successful, else return false and stay at the initial position and
             set _has_sync to false if searched till end of file
         """
-        sync_seq_found = False
         initial_file_position = self._file_handle.tell()
-        current_file_position = initial_file_position
-
-        search_chunk_size = 512 # number of bytes that are searched at once
-
+        search_start = initial_file_position
         if last_n_bytes != -1:
-            current_file_position = self._file_handle.seek(-last_n_bytes, 1)
-            search_chunk_size = last_n_bytes
-
-        chunk = self._file_handle.read(search_chunk_size)
-        while len(chunk) >= len(ULog.SYNC_BYTES):
-            current_file_position += len(chunk)
-            chunk_index = chunk.find(ULog.SYNC_BYTES)
-            if chunk_index >= 0:
-                if self._debug:
-                    print("Found sync at %i" % (current_file_position - len(chunk) + chunk_index))
-                # seek to end of sync sequence and break
-                current_file_position = self._file_handle.seek(current_file_position - len(chunk)\
-                         + chunk_index + len(ULog.SYNC_BYTES), 0)
-                sync_seq_found = True
-                break
+            search_start -= last_n_bytes
 
-            if last_n_bytes != -1:
-                # we read the whole last_n_bytes and did not find sync
-                break
-
-            # seek back 7 bytes to handle boundary condition and read next chunk
-            current_file_position = self._file_handle.seek(-(len(ULog.SYNC_BYTES)-1), 1)
-            chunk = self._file_handle.read(search_chunk_size)
+        sync_positions = self._get_sync_positions()
+        index = np.searchsorted(sync_positions, search_start)
+        sync_seq_found = index < len(sync_positions)
+        if sync_seq_found and last_n_bytes != -1:
+            sync_seq_found = sync_positions[index] + len(ULog.SYNC_BYTES) <= initial_file_position
 
         if not sync_seq_found:
-            current_file_position = self._file_handle.seek(initial_file_position, 0)
-
             if last_n_bytes == -1:
                 self._has_sync = False
                 if self._debug:
@@ -1014,13 +1135,62 @@ class ULog(object):
             else:
                 if self._debug:
                     print("Failed to find sync in (%i, %i)" %\
-                        (initial_file_position - last_n_bytes, initial_file_position))
+                        (search_start, initial_file_position))
         else:
-            # declare file corrupt if we skipped bytes to sync sequence
+            sync_end = int(sync_positions[index]) + len(ULog.SYNC_BYTES)
+            if self._debug:
+                print("Found sync at %i" % (sync_end - len(ULog.SYNC_BYTES)))
+            # seek to end of sync sequence and declare file corrupt as we
+            # skipped bytes to the sync sequence
+            self._file_handle.seek(sync_end, 0)
+            self._add_corrupt_range(search_start, sync_end)
             self._file_corrupt = True
 
         return sync_seq_found
 
+    def _get_sync_positions(self):
+        """
+        get the file offsets of all sync sequences as sorted np.array. The
+        whole file is searched on the first call (i.e. the first corruption),
+        in large chunks and vectorized.
+        """
+        if self._sync_positions is not None:
+            return self._sync_positions
+
+        initial_file_position = self._file_handle.tell()
+        self._file_handle.seek(0)
+        sync_bytes = np.frombuffer(ULog.SYNC_BYTES, dtype=np.uint8)
+        positions = []
+        file_position = 0 # file offset of the chunk
+        tail = b'' # end of the previous chunk that can contain the start of a sequence
+        while True:
+            chunk = self._file_handle.read(self._SYNC_SEARCH_CHUNK_SIZE)
+            if not chunk:
+                break
+            buffer = np.frombuffer(tail + chunk, dtype=np.uint8)
+            candidates = np.flatnonzero(
+                buffer[:len(buffer) - len(sync_bytes) + 1] == sync_bytes[0])
+            for i in range(1, len(sync_bytes)):
+                candidates = candidates[buffer[candidates + i] == sync_bytes[i]]
+            positions.append(candidates + (file_position - len(tail)))
+            tail = (tail + chunk)[-(len(sync_bytes) - 1):]
+            file_position += len(chunk)
+        self._file_handle.seek(initial_file_position)
+
+        self._sync_positions = np.concatenate(positions) if positions else \
+            np.zeros(0, dtype=np.int64)
+        return self._sync_positions
+
+    def _add_corrupt_range(self, start, end):
+        """ add a range of skipped bytes to the corruption map """
+        # join with the ranges it overlaps or touches (a range up to the
+        # realignment can contain earlier ranges)
+        while self._corrupt_ranges and start <= self._corrupt_ranges[-1][1] and \
+                end >= self._corrupt_ranges[-1][0]:
+            last_start, last_end = self._corrupt_ranges.pop()
+            start, end = min(start, last_start), max(end, last_end)
+        self._corrupt_ranges.append((start, end))
+
     def _read_file_data(self, message_name_filter_list, read_until=None):
         """
         read the file data section
@@ -1037,6 +1207,9 @@ class ULog(object):
             msg_data = self._MessageData()
 
             curr_file_pos = self._file_handle.tell()
+            # file offset of the first message since the last corruption,
+            # or None if the parsing is aligned
+            corrupt_start = None
 
             while True:
                 data = self._file_handle.read(3)
@@ -1053,21 +1226,23 @@ class ULog(object):
                               (read_until, curr_file_pos))
                     break
 
+                msg_start = curr_file_pos - 3 - header.msg_size
+                is_corrupt = False
+                # file offset from which the parsing is known to be aligned:
+                # a valid data message or the end of a sync sequence
+                aligned_at = None
                 try:
-                    if header.msg_type == self.MSG_TYPE_INFO:
-                        msg_info = self._MessageInfo(data, header)
-                        self._msg_info_dict[msg_info.key] = msg_info.value
-                        self._msg_info_dict_types[msg_info.key] = msg_info.type
-                    elif header.msg_type == self.MSG_TYPE_INFO_MULTIPLE:
-                        msg_info = self._MessageInfo(data, header, is_info_multiple=True)
-                        self._add_message_info_multiple(msg_info)
-                    elif header.msg_type == self.MSG_TYPE_PARAMETER:
-                        msg_info = self._MessageInfo(data, header)
-                        self._changed_parameters.append((self._last_timestamp,
-                                                         msg_info.key, msg_info.value))
-                    elif header.msg_type == self.MSG_TYPE_PARAMETER_DEFAULT:
-                        msg_param = self._MessageParameterDefault(data, header)
-                        self._add_parameter_default(msg_param)
+                    if self._check_packet_corruption(header):
+                        is_corrupt = True
+                        # seek back to advance only by a single byte instead of
+                        # skipping the message
+                        curr_file_pos = self._file_handle.seek(-2-header.msg_size, 1)
+
+                        # try recovery with sync sequence
+                        if self._has_sync and self._find_sync():
+                            curr_file_pos = aligned_at = self._file_handle.tell()
+                    elif header.msg_type in self._INFO_AND_PARAMETER_MSG_TYPES:
+                        self._read_info_or_parameter(header, data)
                     elif header.msg_type == self.MSG_TYPE_ADD_LOGGED_MSG:
                         msg_add_logged = self._MessageAddLogged(data, header,
                                                                 self._message_formats)
@@ -1090,8 +1265,10 @@ class ULog(object):
                                                              self)
                         if has_corruption:
                             self._file_corrupt = True
-                        elif msg_data.timestamp > self._last_timestamp:
-                            self._last_timestamp = msg_data.timestamp
+                            is_corrupt = True
+                        else:
+                            aligned_at = msg_start
+                            self._last_timestamp = max(self._last_timestamp, msg_data.timestamp)
                     elif header.msg_type == self.MSG_TYPE_DROPOUT:
                         msg_dropout = self.MessageDropout(data, header,
                                                           self._last_timestamp)
@@ -1105,27 +1282,30 @@ class ULog(object):
                             print('file position: %i msg size: %i' % (
                                 curr_file_pos, header.msg_size))
 
-                        if self._check_packet_corruption(header):
-                            # seek back to advance only by a single byte instead of
-                            # skipping the message
-                            curr_file_pos = self._file_handle.seek(-2-header.msg_size, 1)
-
-                            # try recovery with sync sequence in case of unknown msg_type
-                            if self._has_sync:
-                                self._find_sync()
-                        else:
-                            # seek back msg_size to look for sync sequence in payload
-                            if self._has_sync:
-                                self._find_sync(header.msg_size)
+                        # seek back msg_size to look for sync sequence in payload
+                        if self._has_sync and self._find_sync(header.msg_size):
+                            curr_file_pos = aligned_at = self._file_handle.tell()
 
-                except IndexError:
+                except (IndexError, KeyError, UnicodeDecodeError, struct.error):
                     if not self._file_corrupt:
                         print("File corruption detected while reading file data!")
                         self._file_corrupt = True
+                    is_corrupt = True
+
+                # the messages after a corruption are counted as corrupt
+                # until the parsing is aligned again
+                if is_corrupt and corrupt_start is None:
+                    corrupt_start = msg_start
+                if aligned_at is not None and corrupt_start is not None:
+                    self._add_corrupt_range(corrupt_start, aligned_at)
+                    corrupt_start = None
 
         except struct.error:
             pass #we read past the end of the file
 
+        if corrupt_start is not None:
+            self._add_corrupt_range(corrupt_start, min(curr_file_pos, read_until))
+
         # convert into final representation
         while self._subscriptions:
             _, value = self._subscriptions.popitem()
@@ -1135,9 +1315,48 @@ class ULog(object):
         # Sorting is necessary to be able to compare two ULogs correctly
         self.data_list.sort(key=lambda ds: (ds.name, ds.multi_id))
 
+    def _read_file_parameters(self):
+        """
+        read the info and parameter messages of the data section (including
+        appended data), without parsing any logged data. The messages are
+        found with ULogScanner, which only looks at data messages for their
+        timestamp (needed to timestamp the changed parameters) and handles
+        corrupt headers. The messages are parsed with the same handler as
+        in _read_file_data().
+        """
+        # pylint: disable=import-outside-toplevel, cyclic-import
+        from .scanner import ULogScanner
+
+        scanner = ULogScanner(self._file_handle, self._PARAMETERS_READ_CHUNK_SIZE)
+        header = self._MessageHeader()
+        last_timestamp = self._last_timestamp
+        for chunk in scanner.iter_chunks():
+            is_data = chunk.msg_types == self.MSG_TYPE_DATA
+            if np.any(is_data):
+                last_timestamp = max(last_timestamp, int(chunk.timestamps[is_data].max()))
+            for i in np.flatnonzero(np.isin(chunk.msg_types,
+                                            self._INFO_AND_PARAMETER_MSG_TYPES)).tolist():
+                offset = int(chunk.offsets[i])
+                header.msg_size = int(chunk.msg_sizes[i])
+                header.msg_type = int(chunk.msg_types[i])
+                # the largest data timestamp before the message
+                self._last_timestamp = int(chunk.timestamps[i])
+                try:
+                    self._read_info_or_parameter(
+                        header, chunk.buffer[offset+3:offset+3+header.msg_size])
+                except (IndexError, KeyError, UnicodeDecodeError, struct.error):
+                    if not self._file_corrupt:
+                        print("File corruption detected while reading file data!")
+                        self._file_corrupt = True
+
+        for start, end in scanner.corrupt_ranges:
+            self._add_corrupt_range(start, end)
+            self._file_corrupt = True
+        self._last_timestamp = last_timestamp
+
     def _check_packet_corruption(self, header):
         """
-        check for data corruption based on an unknown message type in the header
+        check for data corruption based on the message type and size in the header
         set _file_corrupt flag to true if a corrupt packet is found
         We need to handle 2 cases:
         - corrupt file (we do our best to read the rest of the file)
@@ -1145,7 +1364,8 @@ class ULog(object):
         return true if packet associated with header is corrupt, else return false
         """
         data_corrupt = False
-        if header.msg_type == 0 or header.msg_size == 0 or header.msg_size > 10000:
+        if header.msg_type == 0 or header.msg_size == 0 or \
+                (header.msg_size > 10000 and header.msg_type not in self._LONG_MSG_TYPES):
             if not self._file_corrupt and self._debug:
                 print('File corruption detected')
             data_corrupt = True
@@ -0,0 +1,122 @@
+#! /usr/bin/env python
+
+"""
+Crop a ULog file to a time window and/or a subset of the topics
+"""
+
+import argparse
+import os
+
+import numpy as np
+
+from .core import ULog
+from .scanner import ULogScanner
+
+#pylint: disable=too-many-arguments, too-many-positional-arguments, too-many-locals
+
+def main(argv=None):
+    """Command line interface"""
+
+    parser = argparse.ArgumentParser(
+        description='Crop a ULog file to a time window and/or a subset of the topics',
+        epilog=('The window includes TIME_S and excludes TIME_E, same as ULog.slice().'
+                ' Messages of unknown type are copied as is.'))
+    parser.add_argument('filename', metavar='file.ulg', help='ULog input file')
+
+    parser.add_argument('-o', '--output', dest='output', action='store',
+                        help='Output file (default is <file>_cropped.ulg)',
+                        metavar='FILE')
+    parser.add_argument(
+        '-m', '--messages', dest='messages',
+        help=("Only keep given messages. Must be a comma-separated list of"
+              " names, like 'sensor_combined,vehicle_gps_position'"))
+    parser.add_argument(
+        '-ts', '--time_s', dest='time_s', type=float,
+        help="Only keep data at or after this timestamp (in seconds)")
+    parser.add_argument(
+        '-te', '--time_e', dest='time_e', type=float,
+        help="Only keep data before this timestamp (in seconds)")
+
+    args = parser.parse_args(argv)
+
+    output_file_name = args.output
+    if output_file_name is None:
+        output_file_name = os.path.splitext(args.filename)[0] + '_cropped.ulg'
+    messages = args.messages.split(',') if args.messages else None
+
+    crop_ulog(args.filename, output_file_name, args.time_s, args.time_e, messages)
+
+
+def crop_ulog(ulog_file_name, output_file_name, time_s=None, time_e=None, messages=None):
+    """
+    Write a copy of a ULog file with only the data in a time window and/or
+    of the given topics. The messages are copied as raw bytes, without parsing
+    the logged data.
+
+    The window is time_s <= timestamp < time_e, same as for ULog.slice().
+    The definitions section is copied as is (except for the appended data
+    flag). Parameter changes before the end of the window are kept (so that
+    the parameter values at the start of the window are correct), as well as
+    the info messages, the default parameters and messages of unknown type.
+    Logging messages, dropouts and sync messages are kept if they are inside
+    the window.
+
+    :param ulog_file_name: (str) The ULog filename to read
+    :param output_file_name: (str) The ULog filename to write
+    :param time_s: Only keep data at or after this timestamp (in seconds)
+    :param time_e: Only keep data before this timestamp (in seconds)
+    :param messages: list of topic names to keep (all if None)
+
+    :return: ULogScanner of the input file (e.g. for its corrupt_ranges)
+    """
+    start = int(round(time_s * 1e6)) if time_s is not None else 0
+    end = int(round(time_e * 1e6)) if time_e is not None else 1 << 64
+
+    scanner = ULogScanner(ulog_file_name)
+    selected_msg_ids = np.zeros(1 << 16, dtype=np.bool_)
+
+    with open(output_file_name, 'wb') as output_file:
+        output_file.write(scanner.read_definitions_bytes())
+
+        for chunk in scanner.iter_chunks():
+            for msg_id, subscription in scanner.subscriptions.items():
+                selected_msg_ids[msg_id] = (messages is None or
+                                            subscription.message_name in messages)
+
+            before_end = chunk.timestamps < end
+            in_window = (chunk.timestamps >= start) & before_end
+            msg_types = chunk.msg_types
+            is_selected = selected_msg_ids[chunk.msg_ids]
+            # all other types (info, default parameters, unknown) are kept
+            keep = np.ones(len(msg_types), dtype=np.bool_)
+            for msg_type, mask in (
+                    (ULog.MSG_TYPE_DATA, is_selected & in_window),
+                    (ULog.MSG_TYPE_ADD_LOGGED_MSG, is_selected),
+                    (ULog.MSG_TYPE_REMOVE_LOGGED_MSG, is_selected),
+                    (ULog.MSG_TYPE_PARAMETER, before_end),
+                    (ULog.MSG_TYPE_LOGGING, in_window),
+                    (ULog.MSG_TYPE_LOGGING_TAGGED, in_window),
+                    (ULog.MSG_TYPE_DROPOUT, in_window),
+                    (ULog.MSG_TYPE_SYNC, in_window)):
+                keep &= (msg_types != msg_type) | mask
+
+            _write_ranges(output_file, chunk.buffer, chunk.offsets[keep],
+                          chunk.offsets[keep] + 3 + chunk.msg_sizes[keep])
+
+    return scanner
+
+
+def _write_ranges(output_file, buffer, starts, ends):
+    """ write the byte ranges of buffer, joining adjacent ranges """
+    if len(starts) == 0:
+        return
+    breaks = np.flatnonzero(starts[1:] != ends[:-1]) + 1
+    range_starts = starts[np.concatenate(([0], breaks))]
+    range_ends = ends[np.concatenate((breaks - 1, [len(ends) - 1]))]
+    view = memoryview(buffer)
+    for range_start, range_end in zip(range_starts.tolist(), range_ends.tolist()):
+        output_file.write(view[range_start:range_end])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,301 @@
+"""
+Decimate the data of topics for plotting: min/max/mean pyramids at
+power-of-two resolutions, so that the points of any time window can be
+queried with a bounded number of points, independent of the log length
+"""
+
+import collections
+import hashlib
+import json
+
+import numpy as np
+
+from .core import ULog
+
+#pylint: disable=invalid-name
+
+DECIMATION_METHODS = ('minmax', 'mean', 'lttb')
+
+# default maximum number of points returned by a query
+DEFAULT_MAX_POINTS = 2000
+
+# the 'lttb' method selects the points from a level with up to this many
+# buckets per returned point
+LTTB_OVERSAMPLING = 4
+
+DecimationLevel = collections.namedtuple('DecimationLevel', [
+    'bucket_size', # number of samples per bucket (2**level)
+    'timestamps', # np.array of the timestamp of the first sample of each bucket [us]
+    'min', # np.array of the minimum per bucket
+    'max', # np.array of the maximum per bucket
+    'mean', # np.array of the mean per bucket (float64, except for the raw samples)
+    ])
+
+
+def _reduce_level(level, num_samples, timestamps):
+    """ combine pairs of buckets of a level into the next level """
+    bucket_size = level.bucket_size * 2
+    num_pairs = len(level.min) // 2
+    v_min = np.fmin(level.min[0:2 * num_pairs:2], level.min[1:2 * num_pairs:2])
+    v_max = np.fmax(level.max[0:2 * num_pairs:2], level.max[1:2 * num_pairs:2])
+    mean = (level.mean[0:2 * num_pairs:2].astype(np.float64) +
+            level.mean[1:2 * num_pairs:2]) / 2
+    if len(level.min) % 2 == 1:
+        # the last bucket has no pair (and can be partial)
+        v_min = np.append(v_min, level.min[-1])
+        v_max = np.append(v_max, level.max[-1])
+        mean = np.append(mean, level.mean[-1])
+    elif num_samples % level.bucket_size != 0:
+        # partial last bucket: weight the means by the number of samples
+        last_size = num_samples % level.bucket_size
+        mean[-1] = (level.mean[-2] * level.bucket_size + level.mean[-1] * last_size) / \
+            (level.bucket_size + last_size)
+    return DecimationLevel(bucket_size, timestamps[::bucket_size], v_min, v_max, mean)
+
+
+def lttb(timestamps, values, num_points):
+    """
+    Select points with the Largest-Triangle-Three-Buckets algorithm, which
+    keeps the visual shape of a series.
+
+    :param timestamps: np.array of sorted timestamps
+    :param values: np.array of values (same length as timestamps)
+    :param num_points: number of points to select (at least 3)
+
+    :return: (timestamps, values) tuple of the selected points (all points if
+             there are no more than num_points)
+    """
+    if num_points < 3:
+        raise ValueError('lttb needs at least 3 points')
+    n = len(values)
+    if num_points >= n:
+        return timestamps, values
+    x = timestamps.astype(np.float64)
+    y = values.astype(np.float64)
+    # the first and the last point are always selected, the others are
+    # split into num_points - 2 buckets
+    num_buckets = num_points - 2
+    edges = (np.arange(num_buckets + 1) * ((n - 2) / num_buckets)).astype(np.int64) + 1
+    edges[-1] = n - 1
+    counts = np.diff(edges)
+    x_avg = np.append(np.add.reduceat(x[:n - 1], edges[:-1]) / counts, x[-1])
+    y_avg = np.append(np.add.reduceat(y[:n - 1], edges[:-1]) / counts, y[-1])
+
+    selected = np.empty(num_points, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    a = 0
+    for i in range(num_buckets):
+        s, e = edges[i], edges[i + 1]
+        # triangle between the previous selected point and the average of
+        # the next bucket (the factor 1/2 is omitted)
+        area = np.abs((x[a] - x_avg[i + 1]) * (y[s:e] - y[a]) -
+                      (x[a] - x[s:e]) * (y_avg[i + 1] - y[a]))
+        a = s + int(np.argmax(area))
+        selected[i + 1] = a
+    return timestamps[selected], values[selected]
+
+
+class DecimationPyramid(object):
+    """
+    Min/max/mean pyramid of a single field: level k combines 2**k samples
+    per bucket, and each level is computed from the previous one with
+    vectorized reductions. Level 0 references the raw samples (no copy).
+    The memory use of all other levels is about 3 times the raw samples.
+
+    A query finds the window with a binary search and reads the finest
+    level with no more buckets than requested, so its cost only depends on
+    the number of returned points.
+    """
+
+    def __init__(self, timestamps, values, levels=None):
+        """
+        :param timestamps: np.array of timestamps [us]
+        :param values: np.array of values (same length as timestamps)
+        :param levels: precomputed (min, max, mean) tuples for levels 1 and
+                       up, as returned by get_levels() (e.g. from a cache
+                       file), or None to compute them
+        """
+        if len(timestamps) > 1 and np.any(timestamps[1:] < timestamps[:-1]):
+            order = np.argsort(timestamps, kind='stable')
+            timestamps = timestamps[order]
+            values = values[order]
+        self.timestamps = timestamps
+        self.levels = [DecimationLevel(1, timestamps, values, values, values)]
+        num_samples = len(timestamps)
+        if levels is not None:
+            for k, (v_min, v_max, mean) in enumerate(levels, 1):
+                bucket_size = 1 << k
+                if not len(v_min) == len(v_max) == len(mean) == \
+                        -(-num_samples // bucket_size):
+                    raise ValueError('the levels do not match the number of samples')
+                self.levels.append(DecimationLevel(
+                    bucket_size, timestamps[::bucket_size], v_min, v_max, mean))
+        else:
+            while len(self.levels[-1].min) > 1:
+                self.levels.append(_reduce_level(self.levels[-1], num_samples, timestamps))
+
+    def get_levels(self):
+        """ get the computed levels as list of (min, max, mean) tuples (for
+        levels 1 and up, see __init__()) """
+        return [(level.min, level.max, level.mean) for level in self.levels[1:]]
+
+    def get_fingerprint(self):
+        """ get a fingerprint of the raw samples, to check that cached levels
+        belong to the same samples (see ULogDecimation.load()) """
+        values = self.levels[0].mean
+        sample_hash = hashlib.sha256(self.timestamps.tobytes())
+        sample_hash.update(values.dtype.str.encode())
+        sample_hash.update(values.tobytes())
+        first, last = (int(self.timestamps[0]), int(self.timestamps[-1])) \
+            if len(self.timestamps) > 0 else (0, 0)
+        return [len(self.timestamps), first, last, sample_hash.hexdigest()]
+
+    def query(self, t_start=None, t_end=None, max_buckets=DEFAULT_MAX_POINTS):
+        """
+        Get the buckets of the finest level with at most max_buckets buckets in
+        a time window. The buckets at the window edges can contain samples
+        outside of the window.
+
+        :param t_start: start timestamp [us], or None for the first sample
+        :param t_end: end timestamp [us] (exclusive), or None for the last sample
+
+        :return: DecimationLevel with views into the level of the window
+        """
+        if max_buckets < 1:
+            raise ValueError('max_buckets must be positive')
+        start = int(np.searchsorted(self.timestamps, t_start)) if t_start is not None else 0
+        end = int(np.searchsorted(self.timestamps, t_end)) if t_end is not None \
+            else len(self.timestamps)
+        end = max(start, end)
+        k = 0
+        if end - start > max_buckets:
+            k = max(0, int(np.ceil(np.log2((end - start) / max_buckets))))
+            while k < len(self.levels) - 1 and \
+                    ((end - 1) >> k) + 1 - (start >> k) > max_buckets:
+                k += 1
+            k = min(k, len(self.levels) - 1)
+        level = self.levels[k]
+        b_start = start >> k
+        b_end = (((end - 1) >> k) + 1) if end > start else b_start
+        return DecimationLevel(level.bucket_size, *(a[b_start:b_end] for a in level[1:]))
+
+    def get_points(self, t_start=None, t_end=None, max_points=DEFAULT_MAX_POINTS,
+                   method='minmax'):
+        """
+        Get at most max_points points of a time window for plotting.
+
+        :param t_start: start timestamp [us], or None for the first sample
+        :param t_end: end timestamp [us] (exclusive), or None for the last sample
+        :param max_points: maximum number of returned points
+        :param method: 'minmax': the minimum and the maximum of each bucket
+                       (both at the bucket timestamp), which keeps the
+                       envelope including all spikes, 'mean': the mean of
+                       each bucket, 'lttb': points selected with lttb() from
+                       a level with up to LTTB_OVERSAMPLING * max_points buckets
+
+        :return: (timestamps, values) tuple of np.array's
+        """
+        if method not in DECIMATION_METHODS:
+            raise ValueError('invalid decimation method \'{}\''.format(method))
+        if method == 'minmax':
+            if max_points < 2:
+                raise ValueError('max_points must be at least 2')
+            level = self.query(t_start, t_end, max_points)
+            if level.bucket_size == 1:
+                return level.timestamps, level.mean
+            level = self.query(t_start, t_end, max_points // 2)
+            return (np.repeat(level.timestamps, 2),
+                    np.column_stack((level.min, level.max)).ravel())
+        if method == 'mean':
+            level = self.query(t_start, t_end, max_points)
+            return level.timestamps, level.mean
+        level = self.query(t_start, t_end, max_points * LTTB_OVERSAMPLING)
+        return lttb(level.timestamps, level.mean, max_points)
+
+
+class ULogDecimation(object):
+    """
+    Decimation pyramids of the fields of a ULog, built on first use and
+    cached. The pyramids can be stored in a cache file next to the log, so
+    that they are only built once.
+
+    Usage:
+        decimation = ULogDecimation(ulog)
+        decimation.load('log.ulg.lod.npz') # if it exists
+        timestamps, values = decimation.get_pyramid(
+            'sensor_combined', 'gyro_rad[0]').get_points(t_start, t_end, 1000)
+        decimation.save('log.ulg.lod.npz')
+    """
+
+    def __init__(self, ulog: ULog):
+        """
+        :param ulog: ULog object
+        """
+        self._ulog = ulog
+        self._pyramids = {} # key: (name, multi_id, field name)
+
+    def get_pyramid(self, name, field_name, multi_id=0):
+        """
+        Get the pyramid of a field (built if it is not cached yet).
+
+        :param name: topic name
+        :param field_name: field name, e.g. 'gyro_rad[0]'
+        :param multi_id: topic instance
+
+        :return: DecimationPyramid
+        """
+        key = (name, multi_id, field_name)
+        if key not in self._pyramids:
+            data = self._ulog.get_dataset(name, multi_id)
+            self._pyramids[key] = DecimationPyramid(data.data['timestamp'],
+                                                    data.data[field_name])
+        return self._pyramids[key]
+
+    def save(self, file_name):
+        """
+        Store the pyramids that are built so far (without the raw samples,
+        which are in the log), together with a fingerprint of the samples of
+        each pyramid.
+
+        :param file_name: output file name or file handle (numpy .npz format)
+        """
+        arrays = {}
+        index = []
+        for i, (key, pyramid) in enumerate(self._pyramids.items()):
+            levels = pyramid.get_levels()
+            index.append(list(key) + [len(levels), pyramid.get_fingerprint()])
+            for k, level in enumerate(levels):
+                for stat, values in zip(('min', 'max', 'mean'), level):
+                    arrays['{}_{}_{}'.format(i, k, stat)] = values
+        np.savez(file_name, index=np.array(json.dumps(index)), **arrays)
+
+    def load(self, file_name):
+        """
+        Load pyramids from a file written with save(). Pyramids of topics or
+        fields that do not exist, or whose samples do not match the log (by
+        the number of samples, the first and the last timestamp and a hash
+        of the timestamps and the values), are skipped.
+
+        :param file_name: input file name or file handle
+
+        :return: number of loaded pyramids
+        """
+        num_loaded = 0
+        with np.load(file_name) as cache:
+            for i, entry in enumerate(json.loads(str(cache['index']))):
+                try:
+                    name, multi_id, field_name, num_levels, fingerprint = entry
+                    data = self._ulog.get_dataset(name, multi_id)
+                    levels = [tuple(cache['{}_{}_{}'.format(i, k, stat)]
+                                    for stat in ('min', 'max', 'mean'))
+                              for k in range(num_levels)]
+                    pyramid = DecimationPyramid(data.data['timestamp'],
+                                                data.data[field_name], levels)
+                except (IndexError, KeyError, ValueError):
+                    continue
+                if pyramid.get_fingerprint() != fingerprint:
+                    continue
+                self._pyramids[(name, multi_id, field_name)] = pyramid
+                num_loaded += 1
+        return num_loaded
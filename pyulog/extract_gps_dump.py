@@ -12,7 +12,7 @@ from .core import ULog
 
 #pylint: disable=too-many-locals, unused-wildcard-import, wildcard-import
 
-def main():
+def main(argv=None):
     """
     Command line interface
     """
@@ -36,7 +36,7 @@ def main():
                         + 'for main GPS, 1 for secondary GPS reciever.',
                         default=0)
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
     ulog_file_name = args.filename
     disable_str_exceptions = args.ignore
     required_instance = int(args.required_instance)
@@ -75,18 +75,37 @@ def main():
 
     print("Creating files {0} and {1}".format(to_dev_filename, from_dev_filename))
 
+    to_dev_data, from_dev_data = get_gps_dump_streams(gps_dump_data, required_instance)
     with open(to_dev_filename, 'wb') as to_dev_file:
-        with open(from_dev_filename, 'wb') as from_dev_file:
-            msg_lens = gps_dump_data.data['len']
-            instances = gps_dump_data.data.get('instance', [0]*len(msg_lens))
-            for i in range(len(gps_dump_data.data['timestamp'])):
-                instance = instances[i]
-                msg_len = msg_lens[i]
-                if instance == required_instance:
-                    if msg_len & (1<<7):
-                        msg_len = msg_len & ~(np.uint8(1) << 7)
-                        file_handle = to_dev_file
-                    else:
-                        file_handle = from_dev_file
-                    for k in range(msg_len):
-                        file_handle.write(gps_dump_data.data['data['+str(k)+']'][i])
+        to_dev_file.write(to_dev_data)
+    with open(from_dev_filename, 'wb') as from_dev_file:
+        from_dev_file.write(from_dev_data)
+
+
+def get_gps_dump_streams(gps_dump_data, instance=0):
+    """
+    Get the raw gps communication of a gps_dump topic.
+
+    :param gps_dump_data: ULog.Data object of the gps_dump topic
+    :param instance: GPS instance (0 for the main GPS, 1 for the secondary)
+
+    :return: tuple of (to_device, from_device) bytes
+    """
+    msg_lens = gps_dump_data.data['len']
+    raw_data = gps_dump_data.get_array('data')
+
+    rows = np.ones(len(msg_lens), dtype=bool)
+    if 'instance' in gps_dump_data.data:
+        rows = gps_dump_data.data['instance'] == instance
+    elif instance != 0:
+        rows[:] = False
+    # the upper bit of len is set for data sent to the device
+    to_device = (msg_lens & (1 << 7)) != 0
+    lengths = np.minimum(msg_lens & ~np.uint8(1 << 7), raw_data.shape[1])
+    # mask of the valid bytes in each row
+    valid_bytes = np.arange(raw_data.shape[1]) < lengths[:, np.newaxis]
+
+    def get_stream(row_mask):
+        return raw_data[row_mask][valid_bytes[row_mask]].tobytes()
+
+    return get_stream(rows & to_device), get_stream(rows & ~to_device)
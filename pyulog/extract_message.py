@@ -2,13 +2,14 @@
 Extract values from a ULog file message to use in scripting
 """
 
-from typing import List
+from typing import Dict, Iterator, List, Union
 import numpy as np
 from .core import ULog
 
 def extract_message(ulog_file_name: str, message: str,
                     time_s: "int | None" = None, time_e: "int | None" = None,
-                    disable_str_exceptions: bool = False) -> List[dict]:
+                    disable_str_exceptions: bool = False,
+                    columnar: bool = False) -> Union[List[dict], Dict[str, np.ndarray]]:
     """
     Extract values from a ULog file
 
@@ -16,39 +17,76 @@ def extract_message(ulog_file_name: str, message: str,
     :param message: (str) A ULog message to return values from
     :param time_s: (int) Offset time for conversion in seconds
     :param time_e: (int) Limit until time for conversion in seconds
+    :param columnar: (bool) Return the columns instead of the records
 
-    :return: (List[dict]) A list of each record from the ULog as key-value pairs
+    :return: (List[dict]) A list of each record from the ULog as key-value pairs,
+             or if columnar is set, (Dict[str, np.ndarray]) a dict of field name
+             to values, which are views into the parsed data (no copy)
     """
 
+    data = _get_message_data(ulog_file_name, message, disable_str_exceptions)
+    data = _slice_time_range(data, time_s, time_e)
+    if columnar:
+        return {key: data.data[key] for key in _get_data_keys(data)}
+    return list(_iter_rows(data))
+
+
+def iter_rows(ulog_file_name: str, message: str,
+              time_s: "int | None" = None, time_e: "int | None" = None,
+              disable_str_exceptions: bool = False) -> Iterator[dict]:
+    """
+    Extract values from a ULog file as generator: the records are created
+    while iterating, instead of creating a list of all records. The message
+    is still parsed completely before the first record is yielded, so this
+    saves the memory of the records, but not of the parsed data, and does
+    not reduce the time to the first record.
+
+    :param ulog_file_name: (str) The ULog filename to open and read
+    :param message: (str) A ULog message to return values from
+    :param time_s: (int) Offset time for conversion in seconds
+    :param time_e: (int) Limit until time for conversion in seconds
+
+    :return: (Iterator[dict]) each record from the ULog as key-value pairs
+    """
+
+    data = _get_message_data(ulog_file_name, message, disable_str_exceptions)
+    yield from _iter_rows(_slice_time_range(data, time_s, time_e))
+
+
+def _get_message_data(ulog_file_name: str, message: str,
+                      disable_str_exceptions: bool) -> ULog.Data:
+    """ load a single message from a ULog file """
+
     if not isinstance(message, str):
         raise AttributeError("Must provide a message to pull from ULog file")
 
-    ulog = ULog(ulog_file_name, message, disable_str_exceptions)
+    ulog = ULog(ulog_file_name, [message], disable_str_exceptions)
 
     try:
-        data = ulog.get_dataset(message)
+        return ulog.get_dataset(message)
     except Exception as exc:
         raise AttributeError("Provided message is not in the ULog file") from exc
 
-    values = []
 
-    # use same field order as in the log, except for the timestamp
+def _get_data_keys(data: ULog.Data) -> List[str]:
+    """ use same field order as in the log, except for the timestamp """
     data_keys = [f.field_name for f in data.field_data]
     data_keys.remove('timestamp')
     data_keys.insert(0, 'timestamp')  # we want timestamp at first position
+    return data_keys
+
+
+def _slice_time_range(data: ULog.Data, time_s, time_e) -> ULog.Data:
+    """ get the rows of a time range in seconds (as views, see ULog.Data.slice()) """
+    return data.slice(time_s * 1e6 if time_s else None, time_e * 1e6 if time_e else None)
+
 
-    #get the index for row where timestamp exceeds or equals the required value
-    time_s_i = np.where(data.data['timestamp'] >= time_s * 1e6)[0][0] \
-            if time_s else 0
-    #get the index for row upto the timestamp of the required value
-    time_e_i = np.where(data.data['timestamp'] >= time_e * 1e6)[0][0] \
-            if time_e else len(data.data['timestamp'])
-
-    # write the data
-    for i in range(time_s_i, time_e_i):
-        row = {}
-        for key in data_keys:
-            row[key] = data.data[key][i]
-        values.append(row)
-
-    return values
+def _iter_rows(data: ULog.Data, chunk_size: int = 4096) -> Iterator[dict]:
+    """ create the records of all rows """
+    data_keys = _get_data_keys(data)
+    num_rows = len(data.data['timestamp'])
+    for chunk_start in range(0, num_rows, chunk_size):
+        chunk_end = min(chunk_start + chunk_size, num_rows)
+        columns = [data.data[key][chunk_start:chunk_end] for key in data_keys]
+        for i in range(chunk_end - chunk_start):
+            yield {key: column[i] for key, column in zip(data_keys, columns)}
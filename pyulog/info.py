@@ -15,6 +15,10 @@ def show_info(ulog, verbose):
 
     if ulog.file_corruption:
         print("Warning: file has data corruption(s)")
+        if ulog.corrupt_ranges:
+            print("Skipped {:} corrupt range(s), {:} bytes in total".format(
+                len(ulog.corrupt_ranges),
+                sum(end - start for start, end in ulog.corrupt_ranges)))
 
     m1, s1 = divmod(int(ulog.start_timestamp/1e6), 60)
     h1, m1 = divmod(m1, 60)
@@ -67,7 +71,7 @@ def show_info(ulog, verbose):
                                             message_size * num_data_points))
 
 
-def main():
+def main(argv=None):
     """Commande line interface"""
     parser = argparse.ArgumentParser(description='Display information from an ULog file')
     parser.add_argument('filename', metavar='file.ulg', help='ULog input file')
@@ -81,7 +85,7 @@ def main():
                         help='Ignore string parsing exceptions', default=False)
 
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
     ulog_file_name = args.filename
     disable_str_exceptions = args.ignore
     ulog = ULog(ulog_file_name, None, disable_str_exceptions)
@@ -0,0 +1,243 @@
+#! /usr/bin/env python
+
+"""
+Merge ULog files that were split (e.g. by logger restarts) into a single file
+"""
+
+import argparse
+import heapq
+
+import numpy as np
+
+from .core import ULog
+from .scanner import ULogScanner, gather_ranges
+from .writer import ULogWriter
+
+#pylint: disable=too-many-instance-attributes, protected-access, too-many-locals
+
+def main(argv=None):
+    """Command line interface"""
+
+    parser = argparse.ArgumentParser(description='Merge split ULog files into a single file')
+    parser.add_argument('filenames', metavar='file.ulg', nargs='+', help='ULog input files')
+    parser.add_argument('-o', '--output', dest='output', action='store', required=True,
+                        help='Output file', metavar='FILE')
+
+    args = parser.parse_args(argv)
+
+    for file_name, corrupt_ranges in zip(args.filenames,
+                                         merge_ulogs(args.filenames, args.output)):
+        if corrupt_ranges:
+            print("Warning: skipped {:} corrupt range(s), {:} bytes in total in {:}".format(
+                len(corrupt_ranges), sum(end - start for start, end in corrupt_ranges),
+                file_name))
+
+
+def merge_ulogs(ulog_file_names, output_file_name):
+    """
+    Merge ULog files into a single file. The messages are copied as raw bytes
+    (with remapped msg_ids) and merged in timestamp order, reading all files
+    in parallel in chunks, so memory use does not depend on the file sizes.
+
+    The header, info messages and initial parameters are taken from the first
+    file. The formats of all files need to be compatible (a format with the
+    same name must have the same fields). The topics are identified by their
+    name and multi_id across the files. For each following file, the initial
+    parameters that differ from the current values are added as parameter
+    changes when the file starts.
+
+    :param ulog_file_names: list of ULog file names (the first one is the
+                            reference for the definitions)
+    :param output_file_name: (str) The ULog filename to write
+
+    :return: list of the skipped corrupt byte ranges of each input file (see
+             ULogScanner.corrupt_ranges)
+
+    :raises ValueError: if the formats are not compatible
+    """
+    streams = [_MergeStream(file_name, index) for index, file_name in enumerate(ulog_file_names)]
+    definitions = [ULog(file_name, parse_header_only=True) for file_name in ulog_file_names]
+
+    message_formats = _merge_formats(ulog_file_names, definitions)
+    subscriptions = {} # key=(message name, multi_id), value=output msg_id
+    parameters = dict(definitions[0].initial_parameters) # current parameter values
+
+    with open(output_file_name, 'wb') as output_file:
+        output_file.write(streams[0].scanner.read_definitions_bytes())
+        # formats that only exist in the other files
+        for name, message_format in message_formats.items():
+            if name not in definitions[0].message_formats:
+                output_file.write(ULogWriter.make_format_message(name, message_format.fields))
+
+        # k-way merge: all pending messages up to the smallest last pending
+        # timestamp of the streams can be written
+        heap = []
+        for stream in streams:
+            if stream.load_next(subscriptions):
+                heapq.heappush(heap, (stream.last_key, stream.index))
+        while heap:
+            horizon = heap[0][0]
+            groups = []
+            for stream in streams:
+                if stream.pending is None:
+                    continue
+                group = stream.take(horizon)
+                if group is None:
+                    continue
+                if not stream.started and stream.index > 0:
+                    groups.append(_make_parameter_group(
+                        definitions[stream.index].initial_parameters, parameters,
+                        group[0][0]))
+                stream.started = True
+                groups.append(group)
+            _write_groups(output_file, groups, parameters)
+
+            while heap and heap[0][0] == horizon:
+                _, index = heapq.heappop(heap)
+                if streams[index].load_next(subscriptions):
+                    heapq.heappush(heap, (streams[index].last_key, index))
+
+    return [stream.scanner.corrupt_ranges for stream in streams]
+
+
+def _merge_formats(ulog_file_names, definitions):
+    """ get the formats of all files, and check that they are compatible """
+    message_formats = dict(definitions[0].message_formats)
+    for file_name, definition in zip(ulog_file_names[1:], definitions[1:]):
+        for name, message_format in definition.message_formats.items():
+            if name not in message_formats:
+                message_formats[name] = message_format
+            elif message_formats[name] != message_format:
+                raise ValueError('format {} of {} is not compatible'.format(name, file_name))
+    return message_formats
+
+
+def _make_parameter_group(initial_parameters, parameters, key):
+    """ get the parameter changes to the initial parameters of a file as
+    (keys, buffer, starts, lengths) group """
+    messages = [ULogWriter.make_parameter_message(name, value)
+                for name, value in initial_parameters.items()
+                if parameters.get(name) != value]
+    lengths = np.array([len(message) for message in messages], dtype=np.int64)
+    return (np.full(len(messages), key, dtype=np.uint64),
+            np.frombuffer(b''.join(messages), dtype=np.uint8),
+            np.cumsum(lengths) - lengths, lengths)
+
+
+def _write_groups(output_file, groups, parameters):
+    """ write the messages of (keys, buffer, starts, lengths) groups sorted
+    by key (stable, i.e. the group order is kept for equal keys), and update
+    the current parameter values """
+    if not groups:
+        return
+    keys = np.concatenate([group[0] for group in groups])
+    buffer = np.concatenate([group[1] for group in groups])
+    starts = []
+    buffer_offset = 0
+    for group in groups:
+        starts.append(group[2] + buffer_offset)
+        buffer_offset += len(group[1])
+    starts = np.concatenate(starts)
+    lengths = np.concatenate([group[3] for group in groups])
+
+    order = np.argsort(keys, kind='stable')
+    starts = starts[order]
+    lengths = lengths[order]
+    data = gather_ranges(buffer, starts, lengths)
+
+    header = ULog._MessageHeader()
+    is_parameter = buffer[starts + 2] == ULog.MSG_TYPE_PARAMETER
+    for start, length in zip(starts[is_parameter].tolist(), lengths[is_parameter].tolist()):
+        header.msg_size, header.msg_type = length - 3, ULog.MSG_TYPE_PARAMETER
+        msg_info = ULog._MessageInfo(buffer[start+3:start+length].tobytes(), header)
+        parameters[msg_info.key] = msg_info.value
+    output_file.write(data.tobytes())
+
+
+class _MergeStream(object):
+    """ messages of an input file, read in chunks, with the msg_ids remapped
+    to the output msg_ids """
+
+    def __init__(self, file_name, index):
+        self.scanner = ULogScanner(file_name)
+        self.index = index
+        self.started = False # True if messages have been written
+        self.has_data = False # True if a data message has been converted
+        self.pending = None # (keys, buffer, starts, lengths) of the messages to write
+        self.last_key = 0
+        self._chunks = self.scanner.iter_chunks()
+        # key=input msg_id, value=output msg_id (-1 if not subscribed)
+        self._msg_id_map = np.full(1 << 16, -1, dtype=np.int64)
+
+    def load_next(self, subscriptions):
+        """
+        Load the next chunk into pending.
+
+        :param subscriptions: dict of (message name, multi_id) to output msg_id
+        :return: False if the file is finished
+        """
+        self.pending = None
+        for chunk in self._chunks:
+            self.pending = self._convert_chunk(chunk, subscriptions)
+            if self.pending is not None:
+                self.last_key = int(self.pending[0][-1])
+                return True
+        return False
+
+    def take(self, horizon):
+        """ remove the pending messages up to a key and return them as
+        (keys, buffer, starts, lengths) group, or None if there are none """
+        keys, buffer, starts, lengths = self.pending
+        count = np.searchsorted(keys, horizon, side='right')
+        if count == 0:
+            return None
+        self.pending = (keys[count:], buffer, starts[count:], lengths[count:])
+        return keys[:count], buffer, starts[:count], lengths[:count]
+
+    def _convert_chunk(self, chunk, subscriptions):
+        msg_types = chunk.msg_types
+        is_add = msg_types == ULog.MSG_TYPE_ADD_LOGGED_MSG
+        keep_add = np.zeros(len(msg_types), dtype=np.bool_)
+        for index in np.flatnonzero(is_add).tolist():
+            msg_id = int(chunk.msg_ids[index])
+            subscription = self.scanner.subscriptions.get(msg_id)
+            if subscription is None:
+                continue
+            key = (subscription.message_name, subscription.multi_id)
+            if key not in subscriptions:
+                subscriptions[key] = len(subscriptions)
+                keep_add[index] = True
+            self._msg_id_map[msg_id] = subscriptions[key]
+
+        output_msg_ids = self._msg_id_map[chunk.msg_ids]
+        is_data = (msg_types == ULog.MSG_TYPE_DATA) & (output_msg_ids >= 0)
+        keep = is_data | keep_add | ((msg_types != ULog.MSG_TYPE_DATA) & ~is_add &
+                                     (msg_types != ULog.MSG_TYPE_REMOVE_LOGGED_MSG))
+        if not keep.any():
+            return None
+
+        # the timestamps of the data messages are not sorted, but their
+        # running maximum is, and it keeps the order of the messages
+        keys = np.maximum.accumulate(chunk.timestamps)
+        np.maximum(keys, np.uint64(self.last_key), out=keys)
+        if not self.has_data and is_data.any():
+            # the messages before the first data (subscriptions, parameter
+            # changes) belong to the start of the data, not to the header
+            # timestamp, which can be long before
+            keys[:np.argmax(is_data)] = keys[np.argmax(is_data)]
+            self.has_data = True
+
+        lengths = chunk.msg_sizes[keep] + 3
+        data = gather_ranges(np.frombuffer(chunk.buffer, dtype=np.uint8),
+                             chunk.offsets[keep], lengths)
+        starts = np.cumsum(lengths) - lengths
+        # write the output msg_ids (little-endian uint16)
+        for mask, msg_id_offset in ((is_data[keep], 3), (keep_add[keep], 4)):
+            msg_ids = output_msg_ids[keep][mask]
+            data[starts[mask] + msg_id_offset] = msg_ids & 0xff
+            data[starts[mask] + msg_id_offset + 1] = msg_ids >> 8
+        return keys[keep], data, starts, lengths
+
+
+if __name__ == "__main__":
+    main()
@@ -4,20 +4,23 @@ Display logged messages from an ULog file
 """
 
 import argparse
+import os
 
 from .core import ULog
-from .px4_events import PX4Events
 #pylint: disable=invalid-name
 
-def main():
+def main(argv=None):
     """Commande line interface"""
 
     parser = argparse.ArgumentParser(description='Display logged messages from an ULog file')
     parser.add_argument('filename', metavar='file.ulg', help='ULog input file')
     parser.add_argument('-i', '--ignore', dest='ignore', action='store_true',
                         help='Ignore string parsing exceptions', default=False)
+    parser.add_argument('-c', '--cache', dest='cache', action='store_true', default=False,
+                        help='Cache the PX4 event definitions in $PYULOG_CACHE_DIR or'
+                        ' ~/.cache/pyulog/events (also enabled if $PYULOG_CACHE_DIR is set)')
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
     ulog_file_name = args.filename
     disable_str_exceptions = args.ignore
 
@@ -28,7 +31,12 @@ def main():
 
     # If this is a PX4 log, try to get the events too
     if ulog.msg_info_dict.get('sys_name', '') == 'PX4':
-        px4_events = PX4Events()
+        # imported here, as it is only needed for PX4 logs
+        from .px4_events import PX4Events # pylint: disable=import-outside-toplevel
+        cache_dir = None
+        if args.cache or 'PYULOG_CACHE_DIR' in os.environ:
+            cache_dir = PX4Events.get_default_cache_dir()
+        px4_events = PX4Events(cache_dir=cache_dir)
         events = px4_events.get_logged_events(ulog)
 
         for t, log_level, message in logged_messages:
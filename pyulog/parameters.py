@@ -0,0 +1,118 @@
+"""
+Values of the parameters of a ULog over time
+"""
+
+import numpy as np
+
+from .core import ULog
+
+
+def group_changed_parameters(changed_parameters):
+    """
+    group the changed parameters by name.
+
+    :param changed_parameters: list of (timestamp, name, value) tuples, as in
+                               ULog.changed_parameters
+    :return: dict with key=name, value=list of (timestamp, value) tuples in log
+             order
+    """
+    changes = {}
+    for timestamp, name, value in changed_parameters:
+        if name in changes:
+            changes[name].append((timestamp, value))
+        else:
+            changes[name] = [(timestamp, value)]
+    return changes
+
+
+class ParameterTimeline(object):
+    """
+    Values of all parameters over time, built once per log. Each parameter
+    has a sorted array of timestamps [us] and an array of values: the first
+    entry is the initial value at timestamp 0, followed by the changes logged
+    in the data section, sorted by timestamp (changes with the same timestamp
+    keep their log order).
+    """
+
+    def __init__(self, ulog: ULog):
+        """
+        :param ulog: ULog object (can be loaded with parameters_only=True)
+        """
+        self._system_defaults = ulog.get_default_parameters(0)
+        self._current_setup_defaults = ulog.get_default_parameters(1)
+        changes = group_changed_parameters(ulog.changed_parameters)
+
+        # parameters without initial value start with their default
+        initial_parameters = {**self._system_defaults, **self._current_setup_defaults,
+                              **ulog.initial_parameters}
+
+        self._timestamps = {} # key=name, value=np.array of uint64 timestamps
+        self._values = {} # key=name, value=np.array of values
+        for name in sorted(set(initial_parameters) | set(changes)):
+            timestamps = [timestamp for timestamp, _ in changes.get(name, [])]
+            values = [value for _, value in changes.get(name, [])]
+            if name in initial_parameters:
+                timestamps.insert(0, 0)
+                values.insert(0, initial_parameters[name])
+            timestamps = np.array(timestamps, dtype=np.uint64)
+            values = np.array(values)
+            # value_at() needs sorted timestamps, which the log does not
+            # guarantee
+            order = np.argsort(timestamps, kind='stable')
+            self._timestamps[name] = timestamps[order]
+            self._values[name] = values[order]
+        self._initial_parameters = initial_parameters
+
+    @property
+    def names(self):
+        """ sorted list of all parameter names """
+        return list(self._timestamps)
+
+    def timestamps(self, name):
+        """ np.array of timestamps [us] at which the parameter was set """
+        return self._timestamps[name]
+
+    def values(self, name):
+        """ np.array of the parameter values, one per timestamp """
+        return self._values[name]
+
+    def value_at(self, name, timestamps):
+        """
+        Get the active value of a parameter at given times.
+
+        :param name: parameter name
+        :param timestamps: scalar or np.array of timestamps [us]
+
+        :return: the value active at each timestamp (the last one set at or
+                 before the timestamp), as np.array if timestamps is an array.
+                 Timestamps before the first entry get the first value.
+        """
+        idx = np.searchsorted(self._timestamps[name], timestamps, side='right') - 1
+        return self._values[name][np.maximum(idx, 0)]
+
+    def at(self, timestamp): #pylint: disable=invalid-name
+        """
+        Get a snapshot of all parameters at a given time.
+
+        :param timestamp: timestamp [us]
+        :return: dict with key=name, value=active value
+        """
+        return {name: self.value_at(name, timestamp).item() for name in self._timestamps}
+
+    def default(self, name, default_type):
+        """
+        Get the default value of a parameter. Defaults are only logged if they
+        differ from the configured value, otherwise the initial value is
+        returned.
+
+        :param default_type: 0: system, 1: current_setup
+
+        Raises a KeyError if the parameter has neither a default nor an
+        initial value.
+        """
+        defaults = self._current_setup_defaults if default_type == 1 else self._system_defaults
+        if name in defaults:
+            return defaults[name]
+        if name not in self._initial_parameters:
+            raise KeyError('unknown parameter \'{}\''.format(name))
+        return self._initial_parameters[name]
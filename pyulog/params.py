@@ -7,6 +7,7 @@ import argparse
 import sys
 
 from .core import ULog
+from .parameters import group_changed_parameters
 #pylint: disable=unused-variable, too-many-branches, consider-using-with
 
 def get_defaults(ulog, default):
@@ -17,7 +18,7 @@ def get_defaults(ulog, default):
     if default == 'current_setup': return ulog.get_default_parameters(1)
     raise ValueError('invalid value \'{}\' for --default'.format(default))
 
-def main():
+def main(argv=None):
     """Commande line interface"""
     parser = argparse.ArgumentParser(description='Extract parameters from an ULog file')
     parser.add_argument('filename', metavar='file.ulg', help='ULog input file')
@@ -46,14 +47,13 @@ def main():
                         'values (implies --initial). Valid values: system|current_setup',
                         default=None)
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
     ulog_file_name = args.filename
     disable_str_exceptions = args.ignore
 
-    message_filter = []
-    if not args.initial: message_filter = None
-
-    ulog = ULog(ulog_file_name, message_filter, disable_str_exceptions)
+    # the logged data is not needed, only the parameter messages
+    ulog = ULog(ulog_file_name, [], disable_str_exceptions, parameters_only=True)
+    changed_parameters = group_changed_parameters(ulog.changed_parameters)
 
     params = ulog.initial_parameters
     if args.default is not None:
@@ -67,33 +67,31 @@ def main():
 
     if args.format == "csv":
         for param_key in param_keys:
+            changes = changed_parameters.get(param_key, [])
             output_file.write(param_key)
             if args.timestamps:
                 output_file.write(delimiter)
                 output_file.write(str(params[param_key]))
-                for t, name, value in ulog.changed_parameters:
-                    if name == param_key:
-                        output_file.write(delimiter)
-                        output_file.write(str(value))
+                for t, value in changes:
+                    output_file.write(delimiter)
+                    output_file.write(str(value))
 
                 output_file.write('\n')
                 output_file.write("timestamp")
                 output_file.write(delimiter)
                 output_file.write('0')
-                for t, name, value in ulog.changed_parameters:
-                    if name == param_key:
-                        output_file.write(delimiter)
-                        output_file.write(str(t))
+                for t, value in changes:
+                    output_file.write(delimiter)
+                    output_file.write(str(t))
 
                 output_file.write('\n')
             else:
                 output_file.write(delimiter)
                 output_file.write(str(params[param_key]))
                 if not args.initial:
-                    for t, name, value in ulog.changed_parameters:
-                        if name == param_key:
-                            output_file.write(delimiter)
-                            output_file.write(str(value))
+                    for t, value in changes:
+                        output_file.write(delimiter)
+                        output_file.write(str(value))
                 output_file.write('\n')
 
     elif args.format == "octave":
@@ -104,9 +102,7 @@ def main():
             values = [params[param_key]]
 
             if not args.initial:
-                for t, name, value in ulog.changed_parameters:
-                    if name == param_key:
-                        values += [value]
+                values += [value for t, value in changed_parameters.get(param_key, [])]
 
             if len(values) > 1:
                 output_file.write('\n# type: matrix\n')
@@ -1,9 +1,14 @@
 """ Event parsing """
 import json
 import lzma
-import urllib.request
+import os
+import sys
+import time
+from collections import OrderedDict
 from typing import Optional, Callable, Any, List, Tuple
 
+import numpy as np
+
 from .libevents_parse.parser import Parser
 from .core import ULog
 
@@ -14,28 +19,147 @@ class PX4Events:
     DEFAULT_EVENTS_URL = \
         'https://px4-travis.s3.amazonaws.com/Firmware/master/_general/all_events.json.xz'
 
-    def __init__(self):
+    # maximum number of event parsers kept in memory (shared by all instances)
+    PARSER_CACHE_SIZE = 16
+    # maximum total size of the definitions in the cache directory [bytes]
+    DISK_CACHE_SIZE_LIMIT = 64 * 1024 * 1024
+    # the downloaded default definitions are updated after this time [s]
+    DEFAULT_EVENTS_MAX_AGE = 24 * 3600
+
+    # key=(definitions key, profile), value=Parser, in least recently used order
+    _parser_cache: 'OrderedDict[Tuple[str, str], Parser]' = OrderedDict()
+
+    def __init__(self, cache_dir: Optional[str] = None):
+        """
+        :param cache_dir: directory to store the decompressed event definitions
+                          in, so that they are reused across processes (e.g.
+                          get_default_cache_dir()). None (default) to disable.
+        """
         self._events_profile = 'dev'
         self._default_parser: Optional[Parser] = None
         self._get_default_json_def_cb = self._get_default_json_definitions
+        self._has_custom_default_json_def_cb = False
+        self._cache_dir = cache_dir
 
     @staticmethod
-    def _get_default_json_definitions(already_has_default_parser: bool) -> Optional[Any]:
+    def get_default_cache_dir() -> str:
+        """ get the default cache directory: $PYULOG_CACHE_DIR, or
+        $XDG_CACHE_HOME/pyulog/events (~/.cache/pyulog/events) """
+        if 'PYULOG_CACHE_DIR' in os.environ:
+            return os.environ['PYULOG_CACHE_DIR']
+        cache_home = os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'),
+                                                                   '.cache'))
+        return os.path.join(cache_home, 'pyulog', 'events')
+
+    def _get_default_json_definitions(self, already_has_default_parser: bool) -> Optional[Any]:
         """ Default implementation for retrieving the default json event definitions """
 
         # If it already exists, return it to avoid re-downloading
         if already_has_default_parser:
             return None
 
-        with urllib.request.urlopen(PX4Events.DEFAULT_EVENTS_URL, timeout=4) as response:
-            data = response.read()
-            return json.loads(lzma.decompress(data))
+        def download():
+            # only imported when needed, as it takes a considerable amount of time
+            import urllib.request # pylint: disable=import-outside-toplevel
+
+            with urllib.request.urlopen(PX4Events.DEFAULT_EVENTS_URL, timeout=4) as response:
+                return lzma.decompress(response.read())
+        return self._get_json_definitions('default_events.json', download,
+                                          self.DEFAULT_EVENTS_MAX_AGE)
 
     def set_default_json_definitions_cb(self,
         default_json_definitions_cb: Callable[[bool], Optional[Any]]):
         """ Set the callback to retrieve the default event definitions json
          data (can be used for caching) """
         self._get_default_json_def_cb = default_json_definitions_cb
+        self._has_custom_default_json_def_cb = True
+
+    def _get_json_definitions(self, cache_file_name: str, get_data: Callable[[], bytes],
+                              max_age: Optional[float] = None) -> Any:
+        """ get json definitions from the cache directory, or from get_data()
+        (and store them in the cache). A cache file that cannot be decoded
+        (e.g. truncated) is removed and replaced. """
+        data = self._read_cache_file(cache_file_name, max_age)
+        if data is not None:
+            try:
+                return json.loads(data)
+            except ValueError:
+                self._remove_cache_file(cache_file_name)
+        data = get_data()
+        json_definitions = json.loads(data)
+        self._write_cache_file(cache_file_name, data)
+        return json_definitions
+
+    def _read_cache_file(self, file_name: str, max_age: Optional[float] = None) -> Optional[bytes]:
+        """ read a file from the cache directory, or None if not cached """
+        if self._cache_dir is None:
+            return None
+        path = os.path.join(self._cache_dir, file_name)
+        try:
+            if max_age is not None and time.time() - os.path.getmtime(path) > max_age:
+                return None
+            with open(path, 'rb') as cache_file:
+                data = cache_file.read()
+            if max_age is None:
+                # mark as recently used
+                os.utime(path)
+            return data
+        except OSError:
+            return None
+
+    def _write_cache_file(self, file_name: str, data: bytes):
+        """ atomically write a file to the cache directory and remove the least
+        recently used files above DISK_CACHE_SIZE_LIMIT. Errors are ignored,
+        as the cache is optional """
+        if self._cache_dir is None:
+            return
+        try:
+            os.makedirs(self._cache_dir, exist_ok=True)
+            path = os.path.join(self._cache_dir, file_name)
+            temp_path = '{}.{}.tmp'.format(path, os.getpid())
+            with open(temp_path, 'wb') as cache_file:
+                cache_file.write(data)
+            os.replace(temp_path, path)
+
+            cache_files = []
+            for entry in os.scandir(self._cache_dir):
+                if entry.is_file() and entry.name.endswith('.json'):
+                    stat = entry.stat()
+                    cache_files.append((stat.st_mtime, stat.st_size, entry.path))
+            cache_files.sort()
+            total_size = sum(size for _, size, _ in cache_files)
+            for _, size, cache_file_path in cache_files:
+                if total_size <= self.DISK_CACHE_SIZE_LIMIT or cache_file_path == path:
+                    break
+                os.remove(cache_file_path)
+                total_size -= size
+        except OSError as exception:
+            print('Failed to write event definitions cache: {}'.format(exception),
+                  file=sys.stderr)
+
+    def _remove_cache_file(self, file_name: str):
+        """ remove a file from the cache directory (errors are ignored) """
+        try:
+            os.remove(os.path.join(self._cache_dir, file_name))
+        except OSError:
+            pass
+
+    def _get_cached_parser(self, key: str, get_json_definitions: Callable[[], Any]) -> Parser:
+        """ get a parser from the in-process cache, or create it from the json
+        definitions returned by get_json_definitions() """
+        cache_key = (key, self._events_profile)
+        parser = self._parser_cache.get(cache_key)
+        if parser is not None:
+            self._parser_cache.move_to_end(cache_key)
+            return parser
+
+        parser = Parser()
+        parser.load_definitions(get_json_definitions())
+        parser.set_profile(self._events_profile)
+        self._parser_cache[cache_key] = parser
+        while len(self._parser_cache) > self.PARSER_CACHE_SIZE:
+            self._parser_cache.popitem(last=False)
+        return parser
 
     def _get_event_parser(self, ulog: ULog) -> Optional[Parser]:
         """ get event parser instance or None on error """
@@ -44,14 +168,19 @@ class PX4Events:
                 'metadata_events_sha256' in ulog.msg_info_dict:
             file_hash = ulog.msg_info_dict['metadata_events_sha256']
             if len(file_hash) <= 64 and file_hash.isalnum():
-                events_metadata = ulog.msg_info_multiple_dict['metadata_events'][0]
-                event_definitions_json = json.loads(lzma.decompress(b''.join(events_metadata)))
-                parser = Parser()
-                parser.load_definitions(event_definitions_json)
-                parser.set_profile(self._events_profile)
-                return parser
+                def decompress():
+                    events_metadata = ulog.msg_info_multiple_dict['metadata_events'][0]
+                    return lzma.decompress(b''.join(events_metadata))
+                return self._get_cached_parser(file_hash, lambda: self._get_json_definitions(
+                    file_hash + '.json', decompress))
 
         # No json definitions in the log -> use default definitions
+        if not self._has_custom_default_json_def_cb:
+            # the downloaded definitions are the same for all instances
+            self._default_parser = self._get_cached_parser(
+                self.DEFAULT_EVENTS_URL, lambda: self._get_default_json_definitions(False))
+            return self._default_parser
+
         json_definitions = self._get_default_json_def_cb(
             self._default_parser is not None)
         if json_definitions is not None:
@@ -61,24 +190,16 @@ class PX4Events:
 
         return self._default_parser
 
+    # log level strings, indexed by the external log level
+    _LOG_LEVEL_STRINGS = ['EMERGENCY', 'ALERT', 'CRITICAL', 'ERROR', 'WARNING',
+                          'NOTICE', 'INFO', 'DEBUG', 'PROTOCOL', 'DISABLED']
+
     def get_logged_events(self, ulog: ULog) -> List[Tuple[int, str, str]]:
         """
         Get the events as list of messages
         :return: list of (timestamp, log level str, message) tuples
         """
 
-        def event_log_level_str(log_level: int):
-            return {0: 'EMERGENCY',
-                    1: 'ALERT',
-                    2: 'CRITICAL',
-                    3: 'ERROR',
-                    4: 'WARNING',
-                    5: 'NOTICE',
-                    6: 'INFO',
-                    7: 'DEBUG',
-                    8: 'PROTOCOL',
-                    9: 'DISABLED'}.get(log_level, 'UNKNOWN')
-
         # Parse events
         messages = []
         try:
@@ -95,36 +216,49 @@ class PX4Events:
                 print('Failed to get event parser: {}'.format(exception))
                 return []
 
-            for event_idx, event_id in enumerate(all_ids):
-                log_level = (events.data['log_levels'][event_idx] >> 4) & 0xf
-                if log_level >= 8:
-                    continue
-                args = []
-                i = 0
-                while True:
-                    arg_str = 'arguments[{}]'.format(i)
-                    if arg_str not in events.data:
-                        break
-                    arg = events.data[arg_str][event_idx]
-                    args.append(arg)
-                    i += 1
-                log_level_str = event_log_level_str(log_level)
-                t = events.data['timestamp'][event_idx]
-                event = None
-                if event_parser is not None:
-                    event = event_parser.parse(event_id, bytes(args))
-                if event is None:
-                    messages.append((t, log_level_str,
-                                     '[Unknown event with ID {:}]'.format(event_id)))
+            # external log level (upper 4 bits), skip protocol & disabled events
+            log_levels = (events.data['log_levels'] >> 4) & 0xf
+            indices = np.flatnonzero(log_levels < 8)
+            # arguments as (N, k) uint8 matrix, converted to one bytes object per event
+            if 'arguments[0]' in events.data:
+                arguments = np.ascontiguousarray(events.get_array('arguments')[indices])
+                arguments_bytes = arguments.view('V{}'.format(arguments.shape[1])).ravel().tolist()
+            else:
+                arguments_bytes = [b''] * len(indices)
+
+            # the same events (e.g. with the same arguments) are often logged
+            # many times, so only parse each (id, arguments) combination once
+            parsed_messages = {} # key=(id, arguments), value=message or None
+            for event_id, args, t, log_level in zip(all_ids[indices].tolist(), arguments_bytes,
+                                                    events.data['timestamp'][indices].tolist(),
+                                                    log_levels[indices].tolist()):
+                key = (event_id, args)
+                if key in parsed_messages:
+                    message = parsed_messages[key]
                 else:
-                    # only show default group
-                    if event.group() == "default":
-                        messages.append((t, log_level_str, event.message()))
-                # we could expand this a bit for events:
-                # - show the description too
-                # - handle url's as link (currently it's shown as text, and all tags are escaped)
+                    message = self._parse_event(event_parser, event_id, args)
+                    parsed_messages[key] = message
+                if message is not None:
+                    messages.append((t, self._LOG_LEVEL_STRINGS[log_level], message))
         except (KeyError, IndexError, ValueError):
             # no events in log
             pass
 
         return messages
+
+    @staticmethod
+    def _parse_event(event_parser: Optional[Parser], event_id: int, args: bytes) -> Optional[str]:
+        """ get the message of an event, or None if it is not in the default
+        group """
+        event = None
+        if event_parser is not None:
+            event = event_parser.parse(event_id, args)
+        if event is None:
+            return '[Unknown event with ID {:}]'.format(event_id)
+        # only show default group
+        if event.group() == "default":
+            return event.message()
+        # we could expand this a bit for events:
+        # - show the description too
+        # - handle url's as link (currently it's shown as text, and all tags are escaped)
+        return None
@@ -0,0 +1,223 @@
+"""
+Replay the data of a ULog in timestamp order across all topics
+"""
+
+import collections
+import time
+
+import numpy as np
+
+from .core import ULog
+
+#pylint: disable=too-many-arguments, too-many-positional-arguments
+
+ReplayRecord = collections.namedtuple('ReplayRecord', [
+    'timestamp', # timestamp [us]
+    'kind', # 'data', 'logging' or 'parameter'
+    'source', # ULog.Data for 'data', the parameter name for 'parameter', else None
+    'value', # sample index into source.data for 'data', ULog.MessageLogging(Tagged)
+             # for 'logging', the parameter value for 'parameter'
+    ])
+
+ReplayBatch = collections.namedtuple('ReplayBatch', [
+    'timestamps', # np.array of the timestamps [us] (sorted)
+    'source_ids', # np.array of indexes into ULogReplay.sources
+    'indexes', # np.array of indexes into the source (e.g. the samples of a ULog.Data)
+    ])
+
+ReplaySource = collections.namedtuple('ReplaySource', [
+    'kind', # 'data', 'logging' or 'parameter'
+    'items', # ULog.Data for 'data', list of ULog.MessageLogging(Tagged) for
+             # 'logging', list of (timestamp, name, value) for 'parameter'
+    ])
+
+
+class PlaybackClock(object):
+    """
+    Paces a replay relative to the wall clock: the log timestamp t is
+    released at start + (t - t_first) / rate, where start is the wall clock
+    time of the first wait.
+    """
+
+    def __init__(self, rate=1.0, time_function=time.monotonic, sleep_function=time.sleep):
+        """
+        :param rate: playback rate (1 for real time, 2 for twice as fast)
+        :param time_function: wall clock [s]
+        :param sleep_function: function to wait for a number of seconds
+        """
+        if rate <= 0:
+            raise ValueError('rate must be positive')
+        self._rate = rate
+        self._time_function = time_function
+        self._sleep_function = sleep_function
+        self._start = None # (wall clock time, log timestamp)
+
+    def wait_until(self, timestamp):
+        """ wait until a log timestamp [us] is due """
+        if self._start is None:
+            self._start = (self._time_function(), timestamp)
+            return
+        start_time, start_timestamp = self._start
+        delay = start_time + (timestamp - start_timestamp) / (1e6 * self._rate) - \
+            self._time_function()
+        if delay > 0:
+            self._sleep_function(delay)
+
+
+class ULogReplay(object):
+    """
+    Iterates over the samples of the topics, the logged messages and the
+    parameter changes of a ULog in global timestamp order (records with the
+    same timestamp are ordered by source, and within a source by their log
+    order).
+
+    The sources are merged with numpy in windows of up to chunk_size records
+    per source, so the memory use is bounded by the number of sources times
+    chunk_size, and the per record overhead is small.
+
+    Usage:
+        replay = ULogReplay(ulog, ['vehicle_attitude', 'sensor_combined'])
+        for record in replay.iter_records():
+            if record.kind == 'data':
+                q = record.source.data['q[0]'][record.value]
+        for batch in replay.iter_batches(1000):
+            ... # batch.timestamps, batch.source_ids, batch.indexes
+    """
+
+    # default number of records per source merged at once
+    CHUNK_SIZE = 1 << 14
+
+    def __init__(self, ulog: ULog, topic_names=None, logged_messages=True,
+                 parameter_changes=True):
+        """
+        :param ulog: ULog object
+        :param topic_names: list of topic names to include (all instances), or
+                            None for all topics
+        :param logged_messages: include the (tagged) logged messages
+        :param parameter_changes: include the parameter changes
+        """
+        self.sources = [] # list of ReplaySource
+        for data in ulog.data_list:
+            if topic_names is None or data.name in topic_names:
+                self.sources.append(ReplaySource('data', data))
+        if logged_messages:
+            messages = list(ulog.logged_messages)
+            for tag in sorted(ulog.logged_messages_tagged):
+                messages.extend(ulog.logged_messages_tagged[tag])
+            messages.sort(key=lambda message: message.timestamp)
+            self.sources.append(ReplaySource('logging', messages))
+        if parameter_changes:
+            self.sources.append(ReplaySource('parameter', ulog.changed_parameters))
+
+        # sorted timestamps and sort order (None if already sorted) of each source
+        self._timestamps = []
+        self._orders = []
+        for source in self.sources:
+            if source.kind == 'data':
+                timestamps = source.items.data['timestamp']
+            else:
+                timestamps = np.array([item[0] if source.kind == 'parameter' else item.timestamp
+                                       for item in source.items], dtype=np.uint64)
+            order = None
+            if len(timestamps) > 1 and np.any(timestamps[1:] < timestamps[:-1]):
+                order = np.argsort(timestamps, kind='stable')
+                timestamps = timestamps[order]
+            self._timestamps.append(timestamps)
+            self._orders.append(order)
+
+    def iter_batches(self, batch_size=CHUNK_SIZE, time_s=None, time_e=None, clock=None,
+                     chunk_size=CHUNK_SIZE):
+        """
+        Iterate over the records in batches.
+
+        :param batch_size: number of records per batch (the last batch can be
+                           smaller)
+        :param time_s: only include records at or after this time (in seconds)
+        :param time_e: only include records before this time (in seconds), so
+                       that consecutive windows do not overlap
+        :param clock: optional PlaybackClock: each batch is yielded when its
+                      last timestamp is due
+        :param chunk_size: maximum number of records per source that are merged
+                           at once
+
+        :return: generator of ReplayBatch
+        """
+        pending = None
+        for merged in self._iter_merged(time_s, time_e, chunk_size):
+            if pending is not None:
+                merged = tuple(np.concatenate((p, m)) for p, m in zip(pending, merged))
+            num_batches = len(merged[0]) // batch_size
+            for i in range(num_batches):
+                batch = ReplayBatch(*(a[i * batch_size:(i + 1) * batch_size] for a in merged))
+                if clock is not None:
+                    clock.wait_until(int(batch.timestamps[-1]))
+                yield batch
+            pending = tuple(a[num_batches * batch_size:] for a in merged)
+        if pending is not None and len(pending[0]) > 0:
+            if clock is not None:
+                clock.wait_until(int(pending[0][-1]))
+            yield ReplayBatch(*pending)
+
+    def iter_records(self, time_s=None, time_e=None, clock=None, chunk_size=CHUNK_SIZE):
+        """
+        Iterate over the records one by one.
+
+        :param clock: optional PlaybackClock: each record is yielded when its
+                      timestamp is due
+        :param time_s, time_e, chunk_size: see iter_batches()
+
+        :return: generator of ReplayRecord
+        """
+        sources = self.sources
+        for timestamps, source_ids, indexes in self._iter_merged(time_s, time_e, chunk_size):
+            for timestamp, source_id, index in zip(timestamps.tolist(), source_ids.tolist(),
+                                                   indexes.tolist()):
+                if clock is not None:
+                    clock.wait_until(timestamp)
+                kind, items = sources[source_id]
+                if kind == 'data':
+                    yield ReplayRecord(timestamp, kind, items, index)
+                elif kind == 'logging':
+                    yield ReplayRecord(timestamp, kind, None, items[index])
+                else:
+                    _, name, value = items[index]
+                    yield ReplayRecord(timestamp, kind, name, value)
+
+    def _iter_merged(self, time_s, time_e, chunk_size):
+        """ merge the sources in windows: all records up to the smallest
+        timestamp at the end of the next chunk of each source are merged
+
+        :return: generator of (timestamps, source_ids, indexes) tuples
+        """
+        starts = []
+        ends = []
+        for timestamps in self._timestamps:
+            starts.append(0 if time_s is None else
+                          int(np.searchsorted(timestamps, time_s * 1e6, side='left')))
+            ends.append(len(timestamps) if time_e is None else
+                        int(np.searchsorted(timestamps, time_e * 1e6, side='left')))
+
+        while True:
+            active = [i for i in range(len(starts)) if starts[i] < ends[i]]
+            if not active:
+                break
+            # sources with fewer remaining records do not limit the window
+            horizon = min((int(self._timestamps[i][starts[i] + chunk_size - 1]) for i in active
+                           if ends[i] - starts[i] >= chunk_size), default=None)
+            parts = []
+            for i in active:
+                end = ends[i]
+                if horizon is not None:
+                    end = starts[i] + int(np.searchsorted(
+                        self._timestamps[i][starts[i]:end], horizon, side='right'))
+                indexes = np.arange(starts[i], end)
+                parts.append((self._timestamps[i][starts[i]:end],
+                              np.full(end - starts[i], i, dtype=np.int64),
+                              indexes if self._orders[i] is None else self._orders[i][indexes]))
+                starts[i] = end
+
+            timestamps = np.concatenate([part[0] for part in parts])
+            # stable: equal timestamps keep the source order
+            order = np.argsort(timestamps, kind='stable')
+            yield (timestamps[order], np.concatenate([part[1] for part in parts])[order],
+                   np.concatenate([part[2] for part in parts])[order])
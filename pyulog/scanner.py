@@ -0,0 +1,339 @@
+"""
+Scan the raw messages of a ULog file without parsing the logged data
+"""
+
+import collections
+import contextlib
+import struct
+
+import numpy as np
+
+from .core import ULog
+
+#pylint: disable=too-many-instance-attributes, protected-access
+
+_unpack_msg_size = struct.Struct('<H').unpack_from
+
+# key=message type, value=True if it can be larger than the corruption size
+# limit (see ULog._check_packet_corruption)
+_LONG_MSG_TYPES = np.zeros(256, dtype=np.bool_)
+_LONG_MSG_TYPES[list(ULog._LONG_MSG_TYPES)] = True
+
+ScannedChunk = collections.namedtuple('ScannedChunk', [
+    'file_offset', # file offset of buffer[0]
+    'buffer', # bytes containing the messages
+    'offsets', # np.array of the message offsets into buffer
+    'msg_types', # np.array of the message types
+    'msg_sizes', # np.array of the message sizes (without the 3 bytes header)
+    'msg_ids', # np.array of the msg_id of data, add and remove messages (0 otherwise)
+    'timestamps', # np.array of the message timestamps (see ULogScanner)
+    ])
+
+
+class ULogScanner(object):
+    """
+    Reads the definitions of a ULog file and iterates over the messages of
+    the data section in large chunks. For each chunk, the message boundaries
+    are found in a single pass over the message headers, and the message
+    types, msg_ids and timestamps are then extracted with numpy, so that
+    tools can select messages and copy them as raw bytes.
+
+    The timestamp of a data message is its logged timestamp, of a (tagged)
+    logging message the timestamp of the message, and of any other message the
+    largest data timestamp before it (as used by ULog for the parameter
+    changes and dropouts).
+
+    Corrupt message headers are skipped up to the next sync sequence, or
+    without one, by advancing a single byte and checking the header there
+    (the same recovery as ULog). The skipped byte ranges are collected in
+    corrupt_ranges.
+    """
+
+    # number of bytes read at once
+    READ_CHUNK_SIZE = 1 << 24
+
+    # message types that start the data section
+    _DATA_SECTION_START_TYPES = (ULog.MSG_TYPE_ADD_LOGGED_MSG, ULog.MSG_TYPE_LOGGING,
+                                 ULog.MSG_TYPE_LOGGING_TAGGED)
+
+    def __init__(self, log_file, read_chunk_size=READ_CHUNK_SIZE):
+        """
+        Read the file header and the definitions section.
+
+        :param log_file: file name or binary file handle (which must be
+                         seekable and is not closed)
+        :param read_chunk_size: number of bytes read at once
+        """
+        self._log_file = log_file
+        self._read_chunk_size = read_chunk_size
+        self.start_timestamp = 0
+        self.file_version = 0
+        self.compat_flags = [0] * 8
+        self.incompat_flags = [0] * 8
+        self.appended_offsets = []
+        self.message_formats = {} # key=format name, value=ULog.MessageFormat
+        self.subscriptions = {} # key=msg_id, value=ULog._MessageAddLogged (scanned so far)
+        self.corrupt_ranges = [] # list of (start, end) file offsets of skipped bytes
+        self.definitions_end = 0 # file offset of the data section
+
+        # key=msg_id, value=timestamp offset in the message data (-1 if not subscribed)
+        self._timestamp_offsets = np.full(1 << 16, -1, dtype=np.int64)
+        # key=msg_id, value=minimum message size containing the timestamp
+        self._min_data_sizes = np.zeros(1 << 16, dtype=np.int64)
+
+        with self._open() as file_handle:
+            file_handle.seek(0)
+            self._read_definitions(file_handle)
+
+    def _open(self):
+        if isinstance(self._log_file, str):
+            return open(self._log_file, 'rb')
+        return contextlib.nullcontext(self._log_file)
+
+    @property
+    def has_data_appended(self):
+        """ returns True if the log has data appended, False otherwise """
+        return self.incompat_flags[0] & 0x1
+
+    def _read_definitions(self, file_handle):
+        header_data = file_handle.read(16)
+        if len(header_data) != 16 or header_data[:7] != ULog.HEADER_BYTES:
+            raise TypeError("Invalid file format (Failed to parse header)")
+        self.file_version = header_data[7]
+        self.start_timestamp, = ULog._unpack_uint64(header_data[8:])
+
+        header = ULog._MessageHeader()
+        offset = 16
+        while True:
+            data = file_handle.read(3)
+            if len(data) < 3:
+                break
+            header.initialize(data)
+            if header.msg_type in self._DATA_SECTION_START_TYPES:
+                break
+            data = file_handle.read(header.msg_size)
+            if len(data) < header.msg_size:
+                break
+            if header.msg_type == ULog.MSG_TYPE_FORMAT:
+                msg_format = ULog.MessageFormat(data, header)
+                self.message_formats[msg_format.name] = msg_format
+            elif header.msg_type == ULog.MSG_TYPE_FLAG_BITS:
+                msg_flag_bits = ULog._MessageFlagBits(data, header)
+                self.compat_flags = msg_flag_bits.compat_flags
+                self.incompat_flags = msg_flag_bits.incompat_flags
+                self.appended_offsets = msg_flag_bits.appended_offsets
+            offset += 3 + header.msg_size
+        self.definitions_end = offset
+
+    def read_definitions_bytes(self):
+        """
+        Get the raw file header and definitions section, with the appended
+        data flag and offsets cleared (for writing a new log).
+
+        :return: bytearray
+        """
+        with self._open() as file_handle:
+            file_handle.seek(0)
+            data = bytearray(file_handle.read(self.definitions_end))
+        if data[16 + 2] == ULog.MSG_TYPE_FLAG_BITS:
+            data[16 + 3 + 8] &= 0xFE # incompat_flags[0]
+            data[16 + 3 + 16:16 + 3 + 16 + 3 * 8] = bytes(3 * 8) # appended offsets
+        return data
+
+    def _get_segments(self):
+        """ get the (start, end) file offsets of the data section parts (end
+        is None for the end of the file) """
+        if not self.has_data_appended or not self.appended_offsets:
+            return [(self.definitions_end, None)]
+        starts = [self.definitions_end] + self.appended_offsets
+        return list(zip(starts, self.appended_offsets + [None]))
+
+    def iter_chunks(self):
+        """
+        Iterate over the messages of the data section. Messages that are cut
+        at the end of the file (or of a data part before appended data) are
+        skipped.
+
+        :return: generator of ScannedChunk
+        """
+        last_timestamp = self.start_timestamp
+        with self._open() as file_handle:
+            for segment_start, segment_end in self._get_segments():
+                if segment_end is None:
+                    segment_end = 1 << 50 # make it larger than any possible log file
+                file_handle.seek(segment_start)
+                file_pos = segment_start # file offset of buffer[0]
+                buffer = b''
+                pos = 0
+                while True:
+                    chunk = file_handle.read(self._read_chunk_size)
+                    if not chunk:
+                        break
+                    buffer = buffer[pos:] + chunk
+                    file_pos += pos
+                    buffer_end = min(len(buffer), segment_end - file_pos)
+                    offsets, pos = self._scan_offsets(buffer, file_pos, buffer_end)
+                    if offsets:
+                        scanned_chunk, last_timestamp = self._make_chunk(
+                            file_pos, buffer, offsets, last_timestamp)
+                        yield scanned_chunk
+                    if buffer_end < len(buffer):
+                        break # reached the end of the segment
+
+    def _scan_offsets(self, buffer, file_pos, end):
+        """ find the offsets of the complete messages in buffer[:end]
+
+        :return: tuple of (list of offsets, offset after the last message)
+        """
+        offsets = []
+        pos = 0
+        # number of messages to follow before checking their headers: small
+        # after a corruption (it is then checked after every single byte),
+        # and growing while the headers are valid
+        max_count = 16
+        sync_pos = None # next sync sequence after a corruption (-1 if none)
+        while pos + 3 <= end:
+            # follow the message sizes, then check the headers with numpy
+            # (the message headers are rarely corrupt)
+            next_offsets, next_pos = _follow_message_sizes(buffer, pos, end, max_count)
+            corrupt_index = self._find_corrupt_header(buffer, next_offsets)
+            if corrupt_index is None:
+                if next_pos > end:
+                    # the last message is not complete
+                    offsets.extend(next_offsets[:-1])
+                    pos = next_offsets[-1]
+                    break
+                offsets.extend(next_offsets)
+                pos = next_pos
+                max_count *= 4
+                continue
+
+            # corrupt header (same condition as ULog._check_packet_corruption):
+            # skip to the next sync sequence, or advance by a single byte and
+            # check the header there (as ULog does)
+            offsets.extend(next_offsets[:corrupt_index])
+            pos = next_offsets[corrupt_index]
+            if sync_pos is None or 0 <= sync_pos <= pos:
+                # (otherwise the previous result is still the next one)
+                sync_pos = buffer.find(ULog.SYNC_BYTES, pos + 1, end)
+            next_pos = sync_pos + len(ULog.SYNC_BYTES) if sync_pos >= 0 else pos + 1
+            self._add_corrupt_range(file_pos + pos, file_pos + next_pos)
+            pos = next_pos
+            max_count = 16
+        return offsets, pos
+
+    @staticmethod
+    def _find_corrupt_header(buffer, offsets):
+        """ get the index of the first corrupt message header, or None (same
+        condition as ULog._check_packet_corruption) """
+        if not offsets:
+            return None
+        data = np.frombuffer(buffer, dtype=np.uint8)
+        offsets = np.array(offsets, dtype=np.int64)
+        msg_types = data[offsets + 2]
+        msg_sizes = _gather_uint16(data, offsets)
+        is_corrupt = (msg_types == 0) | (msg_sizes == 0) | \
+            ((msg_sizes > 10000) & ~_LONG_MSG_TYPES[msg_types])
+        corrupt_indexes = np.flatnonzero(is_corrupt)
+        if len(corrupt_indexes) == 0:
+            return None
+        return int(corrupt_indexes[0])
+
+    def _add_corrupt_range(self, start, end):
+        if self.corrupt_ranges and self.corrupt_ranges[-1][1] >= start:
+            self.corrupt_ranges[-1] = (self.corrupt_ranges[-1][0], end)
+        else:
+            self.corrupt_ranges.append((start, end))
+
+    def _make_chunk(self, file_pos, buffer, offsets, last_timestamp): #pylint: disable=too-many-locals
+        """ :return: tuple of (ScannedChunk, largest data timestamp so far) """
+        data = np.frombuffer(buffer, dtype=np.uint8)
+        offsets = np.array(offsets, dtype=np.int64)
+        msg_types = data[offsets + 2]
+        msg_sizes = _gather_uint16(data, offsets).astype(np.int64)
+
+        # the subscriptions need to be known for the timestamps of the data
+        header = ULog._MessageHeader()
+        for offset, msg_size in zip(offsets[msg_types == ULog.MSG_TYPE_ADD_LOGGED_MSG].tolist(),
+                                    msg_sizes[msg_types == ULog.MSG_TYPE_ADD_LOGGED_MSG].tolist()):
+            header.msg_size, header.msg_type = msg_size, ULog.MSG_TYPE_ADD_LOGGED_MSG
+            try:
+                msg_add_logged = ULog._MessageAddLogged(buffer[offset+3:offset+3+msg_size],
+                                                        header, self.message_formats)
+            except (IndexError, KeyError, UnicodeDecodeError, struct.error):
+                continue
+            self.subscriptions[msg_add_logged.msg_id] = msg_add_logged
+            self._timestamp_offsets[msg_add_logged.msg_id] = msg_add_logged.timestamp_offset
+            self._min_data_sizes[msg_add_logged.msg_id] = msg_add_logged.dtype.itemsize
+
+        msg_ids = np.zeros(len(offsets), dtype=np.uint16)
+        for msg_type, msg_id_offset in ((ULog.MSG_TYPE_DATA, 3),
+                                        (ULog.MSG_TYPE_REMOVE_LOGGED_MSG, 3),
+                                        (ULog.MSG_TYPE_ADD_LOGGED_MSG, 4)):
+            mask = (msg_types == msg_type) & (msg_sizes >= msg_id_offset - 1)
+            msg_ids[mask] = _gather_uint16(data, offsets[mask] + msg_id_offset)
+
+        # data messages: logged timestamp, others: running maximum
+        timestamp_offsets = self._timestamp_offsets[msg_ids]
+        is_data = ((msg_types == ULog.MSG_TYPE_DATA) & (timestamp_offsets >= 0) &
+                   (msg_sizes - 2 >= self._min_data_sizes[msg_ids]))
+        data_timestamps = np.zeros(len(offsets), dtype=np.uint64)
+        data_timestamps[is_data] = _gather_uint64(
+            data, offsets[is_data] + 5 + timestamp_offsets[is_data])
+        timestamps = np.maximum.accumulate(data_timestamps)
+        np.maximum(timestamps, np.uint64(last_timestamp), out=timestamps)
+        last_timestamp = int(timestamps[-1])
+        timestamps[is_data] = data_timestamps[is_data]
+        for msg_type, timestamp_offset in ((ULog.MSG_TYPE_LOGGING, 4),
+                                           (ULog.MSG_TYPE_LOGGING_TAGGED, 6)):
+            mask = (msg_types == msg_type) & (msg_sizes >= timestamp_offset + 5)
+            timestamps[mask] = _gather_uint64(data, offsets[mask] + timestamp_offset)
+
+        return (ScannedChunk(file_pos, buffer, offsets, msg_types, msg_sizes, msg_ids, timestamps),
+                last_timestamp)
+
+
+def _follow_message_sizes(buffer, pos, end, max_count):
+    """ get the offsets of up to max_count consecutive messages in
+    buffer[pos:end], without checking the message headers (the last message
+    can end after end)
+
+    :return: tuple of (list of offsets, offset after the last message)
+    """
+    unpack_msg_size = _unpack_msg_size
+    offsets = []
+    append = offsets.append
+    end -= 3
+    for _ in range(max_count):
+        if pos > end:
+            break
+        append(pos)
+        pos += 3 + unpack_msg_size(buffer, pos)[0]
+    return offsets, pos
+
+
+def _gather_uint16(data, positions):
+    """ read little-endian uint16 values at the given byte positions """
+    return data[positions].astype(np.uint16) | (data[positions + 1].astype(np.uint16) << 8)
+
+
+def _gather_uint64(data, positions):
+    """ read little-endian uint64 values at the given byte positions """
+    return data[positions[:, np.newaxis] + np.arange(8)].view('<u8')[:, 0]
+
+
+def gather_ranges(data, starts, lengths):
+    """
+    Concatenate byte ranges of a buffer.
+
+    :param data: np.array of dtype uint8
+    :param starts: np.array of the range starts
+    :param lengths: np.array of the range lengths
+    :return: np.array of dtype uint8
+    """
+    if len(starts) == 0:
+        return np.zeros(0, dtype=np.uint8)
+    output_starts = np.cumsum(lengths) - lengths
+    index = np.arange(output_starts[-1] + lengths[-1]) + \
+        np.repeat(starts - output_starts, lengths)
+    return data[index]
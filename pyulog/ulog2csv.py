@@ -5,16 +5,20 @@ Convert a ULog file into CSV file(s)
 """
 
 import argparse
+import gzip
+import lzma
 import os
 import re
-
-import numpy as np
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 from .core import ULog
+from .align import ALIGN_METHODS, get_align_timeline, iter_align_data
 
-#pylint: disable=too-many-locals, invalid-name, consider-using-enumerate
+#pylint: disable=too-many-locals, invalid-name, consider-using-enumerate, too-many-arguments
+#pylint: disable=too-many-instance-attributes, too-many-positional-arguments
 
-def main():
+def main(argv=None):
     """Command line interface"""
 
     parser = argparse.ArgumentParser(description='Convert ULog to CSV')
@@ -42,14 +46,135 @@ def main():
         '-te', '--time_e', dest='time_e', type=int,
         help="Only convert data upto this timestamp (in seconds)")
 
-    args = parser.parse_args()
+    parser.add_argument(
+        '-c', '--compress', dest='compress', choices=sorted(COMPRESSION_EXTENSIONS),
+        help="Compress the CSV files while writing them (zstd requires Python 3.14"
+        " or the 'zstandard' package)")
+    parser.add_argument(
+        '--compress-threads', dest='compress_threads', type=int,
+        help="Number of compression threads (default is the number of CPUs)")
+
+    parser.add_argument(
+        '--align', dest='align', metavar='REFERENCE',
+        help="Write a single CSV file with all topics aligned to the timestamps of"
+        " the given reference topic, or to a fixed rate if a number (in Hz) is given")
+    parser.add_argument(
+        '--align-method', dest='align_method', choices=ALIGN_METHODS, default='previous',
+        help="Alignment method: previous sample, nearest sample or linear interpolation"
+        " (default is previous)")
+
+    args = parser.parse_args(argv)
+
+    align = args.align
+    if align is not None:
+        try:
+            align = float(align)
+        except ValueError:
+            pass # topic name
 
     if args.output and not os.path.isdir(args.output):
         print('Creating output directory {:}'.format(args.output))
-        os.mkdir(args.output)
+        # exist_ok: parallel runs (e.g. ulog_batch) can create it at the same time
+        os.makedirs(args.output, exist_ok=True)
 
     convert_ulog2csv(args.filename, args.messages, args.output, args.delimiter,
-                     args.time_s, args.time_e, args.ignore)
+                     args.time_s, args.time_e, args.ignore, args.compress,
+                     args.compress_threads, align, args.align_method)
+
+
+# file name extension for each supported compression format
+COMPRESSION_EXTENSIONS = {'gzip': '.gz', 'xz': '.xz', 'zstd': '.zst'}
+
+
+def _get_compress_function(compress):
+    """ get a function that compresses a bytes object into a self-contained
+    gzip member, xz stream or zstd frame """
+    if compress == 'gzip':
+        return lambda data: gzip.compress(data, compresslevel=6)
+    if compress == 'xz':
+        return lzma.compress
+    if compress == 'zstd':
+        try:
+            from compression import zstd # pylint: disable=import-outside-toplevel
+            return zstd.compress
+        except ImportError:
+            pass
+        try:
+            import zstandard # pylint: disable=import-outside-toplevel, import-error
+        except ImportError as exc:
+            raise ImportError("zstd compression requires Python 3.14 or the "
+                              "'zstandard' package") from exc
+        return lambda data: zstandard.ZstdCompressor().compress(data)
+    raise ValueError('invalid compression format \'{}\''.format(compress))
+
+
+class CompressedWriter:
+    """
+    Text file writer that compresses on a thread pool while the caller keeps
+    formatting. The text is split into chunks that are compressed
+    independently and written in order as concatenated gzip members, xz
+    streams or zstd frames, which the standard tools decompress as a single
+    file.
+    """
+
+    def __init__(self, file_name, compress, num_threads=None, chunk_size=1 << 20):
+        self._compress = _get_compress_function(compress)
+        self._chunk_size = chunk_size
+        self._file = open(file_name, 'wb') # pylint: disable=consider-using-with
+        if num_threads is None:
+            num_threads = os.cpu_count() or 1
+        self._executor = ThreadPoolExecutor(max_workers=num_threads)
+        # limit the number of chunks in flight to bound the memory usage
+        self._max_pending = 2 * num_threads
+        self._pending = deque()
+        self._buffer = []
+        self._buffer_size = 0
+
+    def write(self, text):
+        """ write a string """
+        self._buffer.append(text)
+        self._buffer_size += len(text)
+        if self._buffer_size >= self._chunk_size:
+            self._submit_buffer()
+
+    def _submit_buffer(self):
+        data = ''.join(self._buffer).encode('utf-8')
+        self._buffer = []
+        self._buffer_size = 0
+        self._pending.append(self._executor.submit(self._compress, data))
+        while len(self._pending) > self._max_pending:
+            self._file.write(self._pending.popleft().result())
+
+    def close(self):
+        """ compress the remaining data and close the file """
+        if self._buffer_size > 0:
+            self._submit_buffer()
+        while self._pending:
+            self._file.write(self._pending.popleft().result())
+        self._executor.shutdown()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def open_output_file(file_name, compress=None, compress_threads=None):
+    """
+    Open a text file for writing, optionally compressed.
+
+    :param file_name: output file name, without the compression extension
+    :param compress: None, 'gzip', 'xz' or 'zstd'
+    :param compress_threads: number of compression threads (default: CPU count)
+
+    :return: (file object, file name including the compression extension)
+    """
+    if compress is None:
+        return open(file_name, 'w', encoding='utf-8'), file_name
+    file_name += COMPRESSION_EXTENSIONS[compress]
+    return CompressedWriter(file_name, compress, compress_threads), file_name
 
 
 def read_string_data(data: ULog.Data, field_name: str, array_size: int, data_index: int) -> str:
@@ -62,8 +187,49 @@ def read_string_data(data: ULog.Data, field_name: str, array_size: int, data_ind
         s += chr(character)
     return s
 
+def write_aligned_csv(csvfile, timestamps, columns, delimiter=',', write_header=True):
+    """
+    Write a wide table to a CSV file
+
+    :param csvfile: writable text file object
+    :param timestamps: np.array of timestamps (first column)
+    :param columns: dict of column name -> np.array (same length as timestamps)
+    :param write_header: write the column names (False to append rows)
+    """
+    if write_header:
+        csvfile.write(delimiter.join(['timestamp'] + list(columns)) + '\n')
+
+    # convert in chunks to Python lists, which is much faster to format than
+    # individual numpy scalars
+    chunk_size = 10000
+    for start in range(0, len(timestamps), chunk_size):
+        end = start + chunk_size
+        chunk_columns = [timestamps[start:end].tolist()] + \
+            [column[start:end].tolist() for column in columns.values()]
+        for row in zip(*chunk_columns):
+            csvfile.write(delimiter.join(map(str, row)) + '\n')
+
+
+def get_output_file_prefix(ulog_file_name, output):
+    """
+    Get the prefix for output files: the ULog file name without '.ulg',
+    placed in the output directory if given.
+    """
+    output_file_prefix = ulog_file_name
+    # strip '.ulg'
+    if output_file_prefix.lower().endswith('.ulg'):
+        output_file_prefix = output_file_prefix[:-4]
+
+    # write to different output path?
+    if output:
+        base_name = os.path.basename(output_file_prefix)
+        output_file_prefix = os.path.join(output, base_name)
+    return output_file_prefix
+
+
 def convert_ulog2csv(ulog_file_name, messages, output, delimiter, time_s, time_e,
-                     disable_str_exceptions=False):
+                     disable_str_exceptions=False, compress=None, compress_threads=None,
+                     align=None, align_method='previous'):
     """
     Coverts and ULog file to a CSV file.
 
@@ -73,6 +239,12 @@ def convert_ulog2csv(ulog_file_name, messages, output, delimiter, time_s, time_e
     :param delimiter: CSV delimiter
     :param time_s: Offset time for conversion in seconds
     :param time_e: Limit until time for conversion in seconds
+    :param compress: Compress the output files: None, 'gzip', 'xz' or 'zstd'
+    :param compress_threads: Number of compression threads
+    :param align: If set, write all topics into a single file, aligned to the
+                  timestamps of this reference topic name, or to a fixed rate
+                  if a number [Hz] is given
+    :param align_method: 'previous', 'nearest' or 'linear' (see align.get_align_index)
 
     :return: None
     """
@@ -82,15 +254,20 @@ def convert_ulog2csv(ulog_file_name, messages, output, delimiter, time_s, time_e
     ulog = ULog(ulog_file_name, msg_filter, disable_str_exceptions)
     data = ulog.data_list
 
-    output_file_prefix = ulog_file_name
-    # strip '.ulg'
-    if output_file_prefix.lower().endswith('.ulg'):
-        output_file_prefix = output_file_prefix[:-4]
-
-    # write to different output path?
-    if output:
-        base_name = os.path.basename(output_file_prefix)
-        output_file_prefix = os.path.join(output, base_name)
+    output_file_prefix = get_output_file_prefix(ulog_file_name, output)
+
+    if align is not None:
+        output_file_name = f'{output_file_prefix}_aligned.csv'
+        csvfile, output_file_name = open_output_file(output_file_name, compress,
+                                                     compress_threads)
+        timestamps, data_list = get_align_timeline(ulog, align, time_s=time_s, time_e=time_e)
+        print(f'Writing {output_file_name} ({len(timestamps)} data points)')
+        with csvfile:
+            for i, (chunk_timestamps, columns) in enumerate(
+                    iter_align_data(data_list, timestamps, align_method)):
+                write_aligned_csv(csvfile, chunk_timestamps, columns, delimiter,
+                                  write_header=i == 0)
+        return
 
     array_pattern = re.compile(r"(.*)\[(.*?)\]")
 
@@ -115,11 +292,15 @@ def convert_ulog2csv(ulog_file_name, messages, output, delimiter, time_s, time_e
         return data_keys, string_array_sizes
 
     for d in data:
+        # only the rows with time_s <= timestamp < time_e
+        d = d.slice(time_s * 1e6 if time_s else None, time_e * 1e6 if time_e else None)
         name_without_slash = d.name.replace('/', '_')
         output_file_name = f'{output_file_prefix}_{name_without_slash}_{d.multi_id}.csv'
+        csvfile, output_file_name = open_output_file(output_file_name, compress,
+                                                     compress_threads)
         num_data_points = len(d.data['timestamp'])
         print(f'Writing {output_file_name} ({num_data_points} data points)')
-        with open(output_file_name, 'w', encoding='utf-8') as csvfile:
+        with csvfile:
 
             data_keys, string_array_sizes = get_fields(d)
 
@@ -130,16 +311,9 @@ def convert_ulog2csv(ulog_file_name, messages, output, delimiter, time_s, time_e
             # write the header
             csvfile.write(delimiter.join(data_keys) + '\n')
 
-            #get the index for row where timestamp exceeds or equals the required value
-            time_s_i = np.where(d.data['timestamp'] >= time_s * 1e6)[0][0] \
-                    if time_s else 0
-            #get the index for row upto the timestamp of the required value
-            time_e_i = np.where(d.data['timestamp'] >= time_e * 1e6)[0][0] \
-                    if time_e else len(d.data['timestamp'])
-
             # write the data
             last_elem = len(data_keys)-1
-            for i in range(time_s_i, time_e_i):
+            for i in range(num_data_points):
                 for k in range(len(data_keys)):
                     if data_keys[k] in string_array_sizes: # string
                         s = read_string_data(d, data_keys[k], string_array_sizes[data_keys[k]], i)
@@ -4,7 +4,9 @@ Convert a ULog file into a KML file (positioning information)
 """
 
 import argparse
-import simplekml # pylint: disable=import-error
+from html import escape
+
+import numpy as np
 
 from .core import ULog
 
@@ -13,7 +15,7 @@ from .core import ULog
 #pylint: disable=unused-variable
 
 
-def main():
+def main(argv=None):
     """Command line interface"""
 
     parser = argparse.ArgumentParser(description='Convert ULog to KML')
@@ -30,7 +32,7 @@ def main():
     parser.add_argument('-i', '--ignore', dest='ignore', action='store_true',
                         help='Ignore string parsing exceptions', default=False)
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     convert_ulog2kml(args.filename, args.output_filename,
                      position_topic_name=args.topic_name,
@@ -39,20 +41,76 @@ def main():
 
     # alternative example call:
 #    convert_ulog2kml(args.filename, 'test.kml', ['vehicle_global_position',
-#        'vehicle_gps_position'], [_kml_default_colors, lambda x: simplekml.Color.green])
+#        'vehicle_gps_position'], [_kml_default_colors, lambda x: 'ff008000'])
+
 
+# colors in KML format (aabbggrr)
+_KML_COLORS = ['ff0000ff', 'ff008000', 'ffff0000', 'ffee82ee', 'ff00ffff', 'ff00a5ff',
+               'ff87b8de', 'fffffff0', 'ffe6d8ad', 'ff00fc7c', 'ff5c5ccd', 'ffb469ff',
+               'ffc4e4ff', 'ffffff00', 'ff7a96e9', 'ffffbf00', 'ff00ff00', 'ffd670da']
 
 def _kml_default_colors(x):
     """ flight mode to color conversion """
     x = max([x, 0])
-    colors_arr = [simplekml.Color.red, simplekml.Color.green, simplekml.Color.blue,
-                  simplekml.Color.violet, simplekml.Color.yellow, simplekml.Color.orange,
-                  simplekml.Color.burlywood, simplekml.Color.azure, simplekml.Color.lightblue,
-                  simplekml.Color.lawngreen, simplekml.Color.indianred, simplekml.Color.hotpink,
-                  simplekml.Color.bisque, simplekml.Color.cyan, simplekml.Color.darksalmon,
-                  simplekml.Color.deepskyblue, simplekml.Color.lime, simplekml.Color.orchid]
-    return colors_arr[x]
+    return _KML_COLORS[x]
+
+
+class KmlWriter(object):
+    """
+    Minimal streaming KML writer: placemarks are written to the file as they
+    are added, instead of building a document in memory.
+    """
 
+    # number of coordinates that are formatted at once
+    COORDINATES_CHUNK_SIZE = 1 << 16
+
+    def __init__(self, file_handle):
+        """
+        :param file_handle: text file object to write to
+        """
+        self._file = file_handle
+        self._file.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                         '<kml xmlns="http://www.opengis.net/kml/2.2">\n'
+                         '<Document>\n')
+
+    def add_linestring(self, name, lon, lat, alt, color, width, extrude=False):
+        """
+        Add a line with absolute altitude.
+
+        :param lon, lat, alt: np.array's of coordinates (degrees, meters)
+        :param color: color in KML format (aabbggrr, e.g. 'ff0000ff')
+        """
+        self._file.write('<Placemark>\n<name>{}</name>\n'
+                         '<Style><LineStyle><color>{}</color><width>{}</width>'
+                         '</LineStyle></Style>\n<LineString>\n'.format(
+                             escape(name, quote=False), escape(str(color), quote=False), width))
+        if extrude:
+            self._file.write('<extrude>1</extrude>\n')
+        self._file.write('<altitudeMode>absolute</altitudeMode>\n<coordinates>')
+        self._write_coordinates(lon, lat, alt)
+        self._file.write('</coordinates>\n</LineString>\n</Placemark>\n')
+
+    def add_point(self, name, lon, lat, alt):
+        """ Add a point """
+        self._file.write('<Placemark>\n<name>{}</name>\n<Point><coordinates>'.format(
+            escape(name, quote=False)))
+        self._write_coordinates(np.array([lon]), np.array([lat]), np.array([alt]))
+        self._file.write('</coordinates></Point>\n</Placemark>\n')
+
+    def _write_coordinates(self, lon, lat, alt):
+        """ write coordinates as 'lon,lat,alt' tuples, separated by spaces """
+        for start in range(0, len(lon), self.COORDINATES_CHUNK_SIZE):
+            end = start + self.COORDINATES_CHUNK_SIZE
+            # tolist() converts to Python floats, which are formatted the
+            # same way as numpy scalars
+            columns = [map(str, values[start:end].tolist()) for values in (lon, lat, alt)]
+            if start > 0:
+                self._file.write(' ')
+            self._file.write(' '.join(map(','.join, zip(*columns))))
+
+    def close(self):
+        """ finish the document """
+        self._file.write('</Document>\n</kml>\n')
 
 
 def convert_ulog2kml(ulog_file_name, output_file_name, position_topic_name=
@@ -96,7 +154,6 @@ def convert_ulog2kml(ulog_file_name, output_file_name, position_topic_name=
         position_topic_name = [position_topic_name]
         colors = [colors]
 
-    kml = simplekml.Kml()
     load_topic_names = position_topic_name + ['vehicle_status']
     if camera_trigger_topic_name is not None:
         load_topic_names.append(camera_trigger_topic_name)
@@ -110,15 +167,30 @@ def convert_ulog2kml(ulog_file_name, output_file_name, position_topic_name=
     except (KeyError, IndexError) as error:
         flight_mode_changes = []
 
-    # add the graphs
-    for topic, cur_colors in zip(position_topic_name, colors):
-        _kml_add_position_data(kml, ulog, topic, cur_colors, used_style,
-                               altitude_offset, minimum_interval_s, flight_mode_changes)
+    with open(output_file_name, 'w', encoding='utf-8') as output_file:
+        kml = KmlWriter(output_file)
 
-    # camera triggers
-    _kml_add_camera_triggers(kml, ulog, camera_trigger_topic_name, altitude_offset)
+        # add the graphs
+        for topic, cur_colors in zip(position_topic_name, colors):
+            _kml_add_position_data(kml, ulog, topic, cur_colors, used_style,
+                                   altitude_offset, minimum_interval_s, flight_mode_changes)
 
-    kml.save(output_file_name)
+        # camera triggers
+        _kml_add_camera_triggers(kml, ulog, camera_trigger_topic_name, altitude_offset)
+
+        kml.close()
+
+
+def _get_position_data(dataset):
+    """ get the (lon, lat, alt) arrays of a topic in degrees and meters """
+    # 'longitude_deg' is used in newer PX4 versions
+    pos_lon = (dataset.data['lon'] if 'lon' in dataset.data else
+               dataset.data['longitude_deg'])
+    pos_lat = (dataset.data['lat'] if 'lat' in dataset.data else
+               dataset.data['latitude_deg'])
+    pos_alt = (dataset.data['alt'] if 'alt' in dataset.data else
+               dataset.data['altitude_msl_m'])
+    return pos_lon, pos_lat, pos_alt
 
 
 def _kml_add_camera_triggers(kml, ulog, camera_trigger_topic_name, altitude_offset):
@@ -134,20 +206,34 @@ def _kml_add_camera_triggers(kml, ulog, camera_trigger_topic_name, altitude_offs
     if len(cur_dataset) > 0:
         cur_dataset = cur_dataset[0]
 
-        # 'longitude_deg' is used in newer PX4 versions
-        pos_lon = (cur_dataset.data['lon'] if 'lon' in cur_dataset.data else
-                   cur_dataset.data['longitude_deg'])
-        pos_lat = (cur_dataset.data['lat'] if 'lat' in cur_dataset.data else
-                   cur_dataset.data['latitude_deg'])
-        pos_alt = (cur_dataset.data['alt'] if 'alt' in cur_dataset.data else
-                   cur_dataset.data['altitude_msl_m'])
+        pos_lon, pos_lat, pos_alt = _get_position_data(cur_dataset)
         sequence = cur_dataset.data['seq']
 
         for i in range(len(pos_lon)):
-            pnt = kml.newpoint(name='Camera Trigger '+str(sequence[i]))
-            pnt.coords = [(pos_lon[i], pos_lat[i], pos_alt[i] + altitude_offset)]
-            # Balloons instead of text does not work
-            #pnt.style.balloonstyle.text = 'Camera Trigger '+str(sequence[i])
+            kml.add_point('Camera Trigger '+str(sequence[i]),
+                          pos_lon[i], pos_lat[i], pos_alt[i] + altitude_offset)
+
+
+def decimate_timestamps(timestamps, minimum_interval_s):
+    """
+    Get the indices of the samples to keep, so that the kept samples are more
+    than minimum_interval_s apart: each sample is followed by the first one
+    that is more than the interval later (greedy). The first kept sample must
+    be more than the interval after timestamp 0.
+
+    :param timestamps: sorted np.array of timestamps [us]
+    :return: np.array of indices
+    """
+    interval_us = minimum_interval_s * 1e6
+    num_samples = len(timestamps)
+    # for each sample the next one to keep, computed for all samples at once
+    next_indices = np.searchsorted(timestamps, timestamps + interval_us, side='right').tolist()
+    indices = []
+    i = int(np.searchsorted(timestamps, interval_us, side='right'))
+    while i < num_samples:
+        indices.append(i)
+        i = next_indices[i]
+    return np.array(indices, dtype=np.int64)
 
 
 def _kml_add_position_data(kml, ulog, position_topic_name, colors, style,
@@ -166,14 +252,7 @@ def _kml_add_position_data(kml, ulog, position_topic_name, colors, style,
 
     cur_dataset = cur_dataset[0]
 
-
-    # 'longitude_deg' is used in newer PX4 versions
-    pos_lon = (cur_dataset.data['lon'] if 'lon' in cur_dataset.data else
-               cur_dataset.data['longitude_deg'])
-    pos_lat = (cur_dataset.data['lat'] if 'lat' in cur_dataset.data else
-               cur_dataset.data['latitude_deg'])
-    pos_alt = (cur_dataset.data['alt'] if 'alt' in cur_dataset.data else
-               cur_dataset.data['altitude_msl_m'])
+    pos_lon, pos_lat, pos_alt = _get_position_data(cur_dataset)
     pos_t = cur_dataset.data['timestamp']
 
     if 'fix_type' in cur_dataset.data:
@@ -190,44 +269,30 @@ def _kml_add_position_data(kml, ulog, position_topic_name, colors, style,
         pos_lat = pos_lat / 1e7
         pos_alt = pos_alt / 1e3 # to meters
 
-
-    current_flight_mode = 0
-    current_flight_mode_idx = 0
+    # decimate (assume timestamp is in [us])
+    indices = decimate_timestamps(pos_t, minimum_interval_s)
+    pos_lon = pos_lon[indices]
+    pos_lat = pos_lat[indices]
+    pos_alt = pos_alt[indices] + altitude_offset
+    pos_t = pos_t[indices]
+
+    # split into one line per flight mode: a new line starts at the first
+    # point at or after each flight mode change, and the previous line ends
+    # with that same point
+    segment_modes = [0]
+    segment_starts = [0]
     if len(flight_mode_changes) > 0:
-        current_flight_mode = flight_mode_changes[0][1]
-
-
-    def create_linestring():
-        """ create a new kml linestring and set rendering options """
-        name = position_topic_name + ":" + str(current_flight_mode)
-        new_linestring = kml.newlinestring(name=name, altitudemode='absolute')
-
-        # set rendering options
-        if style['extrude']:
-            new_linestring.extrude = 1
-        new_linestring.style.linestyle.color = colors(current_flight_mode)
-
-        new_linestring.style.linestyle.width = style['line_width']
-        return new_linestring
-
-    current_kml_linestring = create_linestring()
-
-    last_t = 0
-    for i in range(len(pos_lon)):
-        cur_t = pos_t[i]
-
-        if (cur_t - last_t)/1e6 > minimum_interval_s: # assume timestamp is in [us]
-            pos_data = [pos_lon[i], pos_lat[i], pos_alt[i] + altitude_offset]
-            current_kml_linestring.coords.addcoordinates([pos_data])
-            last_t = cur_t
-
-            # flight mode change?
-            while current_flight_mode_idx < len(flight_mode_changes)-1 and \
-                flight_mode_changes[current_flight_mode_idx+1][0] <= cur_t:
-                current_flight_mode_idx += 1
-                current_flight_mode = flight_mode_changes[current_flight_mode_idx][1]
-                current_kml_linestring = create_linestring()
-
-                current_kml_linestring.coords.addcoordinates([pos_data])
-
-
+        segment_modes = [flight_mode_changes[0][1]]
+        change_times = np.array([t for t, _ in flight_mode_changes[1:]], dtype=np.float64)
+        change_indices = np.searchsorted(pos_t, change_times, side='left')
+        for change_index, (_, mode) in zip(change_indices.tolist(), flight_mode_changes[1:]):
+            if change_index >= len(pos_t):
+                break
+            segment_starts.append(change_index)
+            segment_modes.append(mode)
+    segment_ends = segment_starts[1:] + [len(pos_t) - 1]
+
+    for start, end, flight_mode in zip(segment_starts, segment_ends, segment_modes):
+        kml.add_linestring(position_topic_name + ":" + str(flight_mode),
+                           pos_lon[start:end+1], pos_lat[start:end+1], pos_alt[start:end+1],
+                           colors(flight_mode), style['line_width'], style['extrude'])
@@ -0,0 +1,106 @@
+#! /usr/bin/env python
+
+"""
+Convert a ULog file into Apache Parquet file(s)
+"""
+
+import argparse
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from .core import ULog
+from .ulog2csv import get_output_file_prefix
+
+#pylint: disable=too-many-arguments, too-many-positional-arguments
+
+def main(argv=None):
+    """Command line interface"""
+
+    parser = argparse.ArgumentParser(description='Convert ULog to Parquet')
+    parser.add_argument('filename', metavar='file.ulg', help='ULog input file')
+
+    parser.add_argument(
+        '-m', '--messages', dest='messages',
+        help=("Only consider given messages. Must be a comma-separated list of"
+              " names, like 'sensor_combined,vehicle_gps_position'"))
+    parser.add_argument('-o', '--output', dest='output', action='store',
+                        help='Output directory (default is same as input file)',
+                        metavar='DIR')
+    parser.add_argument('-i', '--ignore', dest='ignore', action='store_true',
+                        help='Ignore string parsing exceptions', default=False)
+    parser.add_argument('-c', '--compression', dest='compression', default='zstd',
+                        help="Parquet compression codec (default is zstd)")
+    parser.add_argument('-r', '--row-group-size', dest='row_group_size', type=int,
+                        default=DEFAULT_ROW_GROUP_SIZE,
+                        help="Maximum number of rows per row group (default is {})"
+                        .format(DEFAULT_ROW_GROUP_SIZE))
+    parser.add_argument('-j', '--jobs', dest='jobs', type=int, default=None,
+                        help="Number of topics written in parallel (default is the number"
+                        " of CPUs)")
+
+    args = parser.parse_args(argv)
+
+    if args.output and not os.path.isdir(args.output):
+        print('Creating output directory {:}'.format(args.output))
+        # exist_ok: parallel runs (e.g. ulog_batch) can create it at the same time
+        os.makedirs(args.output, exist_ok=True)
+
+    convert_ulog2parquet(args.filename, args.messages, args.output, args.compression,
+                         args.row_group_size, args.jobs, args.ignore)
+
+
+DEFAULT_ROW_GROUP_SIZE = 1 << 20
+
+
+def write_parquet(table, file_name, compression='zstd', row_group_size=DEFAULT_ROW_GROUP_SIZE):
+    """
+    Write a table as returned by ULog.Data.to_arrow() to a Parquet file.
+    String columns are dictionary-encoded, numeric columns use plain encoding.
+    """
+    import pyarrow as pa # pylint: disable=import-outside-toplevel, import-error
+    import pyarrow.parquet as pq # pylint: disable=import-outside-toplevel, import-error
+
+    dictionary_columns = [field.name for field in table.schema
+                          if pa.types.is_dictionary(field.type)]
+    pq.write_table(table, file_name, row_group_size=row_group_size,
+                   compression=compression, use_dictionary=dictionary_columns)
+
+
+def convert_ulog2parquet(ulog_file_name, messages, output=None, compression='zstd',
+                         row_group_size=DEFAULT_ROW_GROUP_SIZE, jobs=None,
+                         disable_str_exceptions=False):
+    """
+    Converts an ULog file to Parquet files, one per topic and instance.
+
+    :param ulog_file_name: The ULog filename to open and read
+    :param messages: A comma-separated string of message names (None for all)
+    :param output: Output directory (default is same as input file)
+    :param compression: Parquet compression codec
+    :param row_group_size: Maximum number of rows per row group
+    :param jobs: Number of topics that are written in parallel
+
+    :return: list of written file names
+    """
+
+    msg_filter = messages.split(',') if messages else None
+
+    ulog = ULog(ulog_file_name, msg_filter, disable_str_exceptions)
+
+    output_file_prefix = get_output_file_prefix(ulog_file_name, output)
+
+    def convert_topic(dataset):
+        name_without_slash = dataset.name.replace('/', '_')
+        output_file_name = \
+            f'{output_file_prefix}_{name_without_slash}_{dataset.multi_id}.parquet'
+        write_parquet(dataset.to_arrow(), output_file_name, compression, row_group_size)
+        return output_file_name
+
+    # pyarrow releases the GIL while encoding and compressing
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        output_file_names = list(executor.map(convert_topic, ulog.data_list))
+
+    for dataset, output_file_name in zip(ulog.data_list, output_file_names):
+        num_data_points = len(dataset.data['timestamp'])
+        print(f'Wrote {output_file_name} ({num_data_points} data points)')
+
+    return output_file_names
@@ -5,39 +5,63 @@ Convert a ULog file into a ROS2 bag.
 """
 
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 import argparse
 import re
 from os import environ
 from pathlib import Path
-from importlib.metadata import version
 import numpy as np
 
+from .cdr import CdrEncoder
 from .core import ULog
 
 # pylint: disable=too-many-locals, invalid-name, too-many-branches
 
-# Do not exit on failing to import ROS2 packages so they don't block the help message.
-ros2_available = True
-try:
-    from rclpy.serialization import serialize_message  # pylint: disable=import-error
-    import rosbag2_py  # pylint: disable=import-error
-except ImportError as e:
-    print(
-        "Error: Could not import ROS2 packages. Make sure you have sourced"
-        " your ROS2 installation."
-    )
-    print("Actual error:", e)
-    ros2_available = False
+# The ROS2 packages are imported on first use (import_ros2_packages()), so they
+# don't slow down or block the help message.
+serialize_message = None
+rosbag2_py = None
+px4_msgs = None
 
-try:
-    from px4_msgs import msg as px4_msgs  # pylint: disable=import-error
-except ImportError as e:
-    print(
-        "Error: Could not import px4_msgs. Make sure you have built and sourced"
-        " the correct version of px4_msgs."
-    )
-    print("Actual error:", e)
-    ros2_available = False
+
+def import_ros2_packages(print_errors=True):
+    """
+    Import the ROS2 packages needed for the conversion.
+
+    :param print_errors: print an error message if a package is missing
+    :return: True on success, False if a package could not be imported
+    """
+    global serialize_message, rosbag2_py, px4_msgs # pylint: disable=global-statement
+
+    if px4_msgs is not None:
+        return True
+
+    try:
+        # pylint: disable=import-outside-toplevel, import-error, redefined-outer-name
+        from rclpy.serialization import serialize_message
+        import rosbag2_py
+    except ImportError as e:
+        if print_errors:
+            print(
+                "Error: Could not import ROS2 packages. Make sure you have sourced"
+                " your ROS2 installation."
+            )
+            print("Actual error:", e)
+        return False
+
+    try:
+        # pylint: disable=import-outside-toplevel, import-error
+        from px4_msgs import msg as px4_msgs_module
+    except ImportError as e:
+        if print_errors:
+            print(
+                "Error: Could not import px4_msgs. Make sure you have built and sourced"
+                " the correct version of px4_msgs."
+            )
+            print("Actual error:", e)
+        return False
+    px4_msgs = px4_msgs_module
+    return True
 
 
 def main():
@@ -90,13 +114,28 @@ def main():
         default=False,
     )
 
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        dest="jobs",
+        type=int,
+        help="Number of processes serializing messages (default is the number of CPUs)",
+        default=None,
+    )
+
     args = parser.parse_args()
 
-    if not ros2_available:
-        return  # Error messages printed in 'except ImportError' blocks above
+    if not import_ros2_packages():
+        return  # Error messages printed in import_ros2_packages()
 
     convert_ulog2ros2bag(
-        args.filename, args.bag, args.mcap, args.messages, args.ignore, args.verbose
+        args.filename,
+        args.bag,
+        args.mcap,
+        args.messages,
+        args.ignore,
+        args.verbose,
+        args.jobs,
     )
 
 
@@ -107,6 +146,10 @@ def to_camel_case(snake_str):
     return "".join(x.title() for x in components)
 
 
+# number of messages that are converted and serialized at once
+SERIALIZATION_BATCH_SIZE = 4096
+
+
 def convert_ulog2ros2bag(
     ulog_file_name: str,
     rosbag_name: str | None,
@@ -114,6 +157,7 @@ def convert_ulog2ros2bag(
     messages: str,
     disable_str_exceptions=False,
     verbose=False,
+    jobs=None,
 ):
     """
     Coverts and ULog file to a CSV file.
@@ -121,10 +165,15 @@ def convert_ulog2ros2bag(
     :param ulog_file_name: The ULog filename to open and read
     :param rosbag_name: The rosbag filename to open and write
     :param messages: A list of message names
+    :param jobs: Number of processes that serialize the messages (1 to
+                 serialize in this process)
 
     :return: No
     """
 
+    if not import_ros2_packages(print_errors=False):
+        raise ImportError("ROS2 packages or px4_msgs not found")
+
     msg_filter = messages.split(",") if messages else None
 
     ulog = ULog(ulog_file_name, msg_filter, disable_str_exceptions)
@@ -198,6 +247,7 @@ def convert_ulog2ros2bag(
         print("")
 
     topic_count, message_count = 0, 0
+    executor = None
     for ulg_topic in ulog.data_list:
         topic_message_count = len(ulg_topic.data["timestamp"])
 
@@ -230,32 +280,20 @@ def convert_ulog2ros2bag(
         if verbose:
             print(f"D: Found ROS2 message type px4_msgs/msg/{MsgType.__name__}")
 
-        # Check if it is a composed message type
-        if any(
-            re.match(r"(.*?)\.(.*?)", field.field_name)
-            for field in ulg_topic.field_data
-        ):
+        # Compile the field mapping (and verify the message type)
+        plan = ConversionPlan(ulg_topic.field_data, MsgType.get_fields_and_field_types())
+        if plan.is_composed:
             # TODO: add support for composed message types
             print(f"W: Message type for {ulg_topic.name} is composed, skipping.")
             continue
 
-        # Verify message type
-        ros2_fields = MsgType.get_fields_and_field_types().keys()
-        px4_fields = [
-            re.sub(r"\[\d+\]$", "", data.field_name) for data in ulg_topic.field_data
-        ]  # strip array indices
-        px4_fields = list(set(px4_fields))  # remove duplicates
-        if not all(px4_field in ros2_fields for px4_field in px4_fields):
+        if plan.missing_fields:
             print(
                 f"W: Message type px4_msgs/msg/{MsgType.__name__} does not match topic"
                 f" '{ulg_topic.name}' in ulog, skipping. Please check your version of px4_msgs."
             )
             if verbose:
-                for px4_field in [
-                    px4_field
-                    for px4_field in px4_fields
-                    if px4_field not in ros2_fields
-                ]:
+                for px4_field in plan.missing_fields:
                     print(
                         f"D: field {px4_field} of {ulg_topic.name} not found in {MsgType.__name__}"
                     )
@@ -266,19 +304,38 @@ def convert_ulog2ros2bag(
             topic_metadata(ros2_topic, f"px4_msgs/msg/{MsgType.__name__}")
         )
 
-        # Write each message
-        for i in range(len(ulg_topic.data["timestamp"])):
-            msg = ros2_msg_from_ulg_topic(ulg_topic, i, MsgType)
-
-            ts = ulg_topic.data["timestamp"][i] * 1000  # us -> ns
-            rosbag_write(
-                ros2_topic,
-                serialize_message(msg),
-                int(ts),
-            )
+        # Write the messages, serialized in batches: directly from the columns
+        # if the message type has a fixed-size layout, otherwise via message
+        # objects (in parallel if there is more than one batch)
+        timestamps = (ulg_topic.data["timestamp"].astype(np.int64) * 1000).tolist()  # us -> ns
+        batches = [
+            (msg_type_name, plan,
+             plan.get_columns(ulg_topic.data, start, start + SERIALIZATION_BATCH_SIZE))
+            for start in range(0, topic_message_count, SERIALIZATION_BATCH_SIZE)
+        ]
+        encoder = create_cdr_encoder(MsgType, plan, batches[0][2]) if batches else None
+        if verbose:
+            print(f"D: Serializing with {'CDR encoder' if encoder else 'rclpy'}")
+        if encoder is not None:
+            serialized_batches = (plan.serialize_cdr(encoder, columns)
+                                  for _, _, columns in batches)
+        else:
+            if executor is None and jobs != 1 and len(batches) > 1:
+                executor = ProcessPoolExecutor(
+                    max_workers=jobs, initializer=import_ros2_packages, initargs=(False,)
+                )
+            map_function = map if executor is None else executor.map
+            serialized_batches = map_function(_serialize_batch, batches)
+        message_index = 0
+        for serialized_messages in serialized_batches:
+            for serialized_message in serialized_messages:
+                rosbag_write(ros2_topic, serialized_message, timestamps[message_index])
+                message_index += 1
         topic_count += 1
         message_count += topic_message_count
 
+    if executor is not None:
+        executor.shutdown()
     writer.close()
     print(
         f"\nWrote rosbag '{rosbag_name}' with {topic_count} topics and {message_count} messages."
@@ -290,6 +347,7 @@ def rosbag_topicmetadata_uses_id():
     rosbag2_py PR #1538 adds a parameter to TopicMetadata.__init__() for a topic ID,
     breaking the interface. This attempts to add compability with both versions.
     """
+    from importlib.metadata import version # pylint: disable=import-outside-toplevel
     return version("rosbag2_py") >= "0.25.0"
 
 
@@ -299,6 +357,7 @@ def rosbag_write_uses_seqnum():
     topic sequence number, breaking the interface. This attempts to add compatibility
     with both versions.
     """
+    from importlib.metadata import version # pylint: disable=import-outside-toplevel
     return version("rosbag2_py") >= "0.32.0"
 
 
@@ -345,44 +404,181 @@ def calc_msgtype(topic_name: str) -> str | None:
     return result
 
 
-def ros2ify_value(field_name: str, value, MsgType: object):
-    """Translate a pyulog numpy value to ros2 plain python value"""
-    value_type: np.signedinteger | np.unsignedinteger | np.floating = value.dtype
+class ConversionPlan:
+    """
+    Mapping of the fields of a ULog topic to the fields of a ROS2 message type,
+    compiled once per topic and then applied to whole columns. It only needs
+    the field types of the message type, not ROS2 itself.
+    """
 
-    # int8 could either be int8_t, bool, or char
-    # check the destination type
-    ros2_type: str = MsgType.get_fields_and_field_types()[field_name]  # type: ignore
+    # ULog types that are stored as int8, and can be a bool in ROS2
+    _INT8_TYPES = ("int8_t", "bool", "char")
+
+    def __init__(self, field_data: list, ros2_field_types: dict):
+        """
+        :param field_data: ULog.Data.field_data of the topic
+        :param ros2_field_types: dict of ROS2 field name to type string, as
+               returned by MsgType.get_fields_and_field_types()
+        """
+        self.is_composed = any("." in field.field_name for field in field_data)
+
+        # scalar fields: list of (ROS2 field name, ULog field name, convert to bool)
+        self.scalar_fields = []
+        # array fields: list of (ROS2 field name, list of ULog field names,
+        # list of array indices (None if the whole array is set), convert to bool)
+        self.array_fields = []
+        # ULog fields that don't exist in the ROS2 message type
+        self.missing_fields = []
+
+        arrays = {}  # key=ROS2 field name, value=list of (index, ULog field name, type)
+        for field in field_data:
+            array_match = re.match(r"(.*?)\[(\d+)\]$", field.field_name)
+            if array_match:
+                field_name, array_index = array_match.groups()
+                arrays.setdefault(field_name, []).append(
+                    (int(array_index), field.field_name, field.type_str)
+                )
+            elif field.field_name not in ros2_field_types:
+                self.missing_fields.append(field.field_name)
+            else:
+                self.scalar_fields.append(
+                    (field.field_name, field.field_name,
+                     self._to_bool(field.type_str, ros2_field_types[field.field_name]))
+                )
 
-    # startswith() accounts for array types
-    if value_type == np.int8 and ros2_type.startswith("bool"):
-        return bool(value)
+        for field_name, elements in arrays.items():
+            if field_name not in ros2_field_types:
+                self.missing_fields.append(field_name)
+                continue
+            ros2_type = ros2_field_types[field_name]
+            indices = [index for index, _, _ in elements]
+            # set the whole array if all elements are logged, otherwise the
+            # single elements
+            size_match = re.search(r"\[(\d+)\]$", ros2_type)
+            if indices == list(range(len(indices))) and (
+                size_match is None or int(size_match.group(1)) == len(indices)
+            ):
+                indices = None
+            self.array_fields.append(
+                (field_name, [name for _, name, _ in elements], indices,
+                 self._to_bool(elements[0][2], ros2_type))
+            )
+
+    @classmethod
+    def _to_bool(cls, ulog_type: str, ros2_type: str) -> bool:
+        """int8 could either be int8_t, bool, or char: check the destination type
+        (startswith() accounts for array types)"""
+        return ulog_type in cls._INT8_TYPES and ros2_type.startswith("bool")
+
+    def get_columns(self, data: dict, start=0, end=None) -> dict:
+        """
+        Get the used columns of a range of samples.
+
+        :param data: ULog.Data.data of the topic
+        :return: dict of ULog field name to np.array
+        """
+        columns = {name: data[name][start:end] for _, name, _ in self.scalar_fields}
+        for _, names, _, _ in self.array_fields:
+            for name in names:
+                columns[name] = data[name][start:end]
+        return columns
+
+    def get_field_values(self, columns: dict) -> list:
+        """
+        Convert columns to plain Python values.
+
+        :param columns: dict of ULog field name to np.array (see get_columns())
+        :return: list of (ROS2 field name, array indices or None, list of values
+                 with one entry per sample) tuples
+        """
+        field_values = []
+        for ros2_name, name, to_bool in self.scalar_fields:
+            column = columns[name]
+            field_values.append((ros2_name, None, (column != 0).tolist() if to_bool
+                                 else column.tolist()))
+        for ros2_name, names, indices, to_bool in self.array_fields:
+            matrix = np.column_stack([columns[name] for name in names])
+            field_values.append((ros2_name, indices, (matrix != 0).tolist() if to_bool
+                                 else matrix.tolist()))
+        return field_values
+
+    def create_messages(self, MsgType, columns: dict) -> list:
+        """
+        Create ROS2 message objects.
+
+        :param MsgType: ROS2 message type
+        :param columns: dict of ULog field name to np.array (see get_columns())
+        :return: list of MsgType objects
+        """
+        field_values = self.get_field_values(columns)
+        num_messages = len(field_values[0][2]) if field_values else 0
+        msgs = [MsgType() for _ in range(num_messages)]
+        for field_name, indices, values in field_values:
+            if indices is None:
+                for msg, value in zip(msgs, values):
+                    setattr(msg, field_name, value)
+            else:
+                for msg, value in zip(msgs, values):
+                    array = getattr(msg, field_name)
+                    for array_index, element in zip(indices, value):
+                        array[array_index] = element
+        return msgs
+
+    def serialize_cdr(self, encoder: CdrEncoder, columns: dict) -> list:
+        """
+        Serialize messages directly from the columns, without creating message
+        objects.
+
+        :param encoder: CdrEncoder of the ROS2 message type
+        :param columns: dict of ULog field name to np.array (see get_columns())
+        :return: list of bytes, one per message
+        """
+        num_messages = len(next(iter(columns.values()))) if columns else 0
+        records = encoder.encode_array(
+            {ros2_name: columns[name] for ros2_name, name, _ in self.scalar_fields},
+            num_messages)
+        for ros2_name, names, indices, to_bool in self.array_fields:
+            matrix = np.column_stack([columns[name] for name in names])
+            if to_bool:
+                matrix = matrix != 0
+            if indices is None:
+                records[ros2_name] = matrix
+            else:
+                records[ros2_name][:, indices] = matrix
+        return encoder.to_bytes(records)
+
+
+def create_cdr_encoder(MsgType, plan: ConversionPlan, columns: dict):
+    """
+    Create a CdrEncoder for a ROS2 message type, if the message type is
+    supported and the encoder serializes a sample exactly like rclpy.
+
+    :param columns: dict of ULog field name to np.array with at least one
+                    sample (see ConversionPlan.get_columns())
+    :return: CdrEncoder or None
+    """
+    try:
+        encoder = CdrEncoder(MsgType.get_fields_and_field_types())
+    except ValueError:
+        return None
+    sample = {name: column[:1] for name, column in columns.items()}
+    expected = serialize_message(plan.create_messages(MsgType, sample)[0])
+    if plan.serialize_cdr(encoder, sample) != [bytes(expected)]:
+        return None
+    return encoder
 
-    return value.item()
+
+def _serialize_batch(args):
+    """Create and serialize the messages of a batch (runs in a worker process)"""
+    msg_type_name, plan, columns = args
+    MsgType = getattr(px4_msgs, msg_type_name)
+    return [serialize_message(msg) for msg in plan.create_messages(MsgType, columns)]
 
 
 def ros2_msg_from_ulg_topic(ulg_topic: ULog.Data, i: int, MsgType):
     """Create a ROS2 message object from a ulg topic message"""
-    msg = MsgType()
-    for field in ulg_topic.field_data:
-        array_match = re.match(r"(.*?)\[(\d+)\]", field.field_name)
-        value = ulg_topic.data[field.field_name][i]
-        if array_match:
-            field_name, array_index = array_match.groups()
-            array_index = int(array_index)
-            value = ros2ify_value(field_name, value, MsgType)
-            getattr(msg, field_name)[array_index] = value
-        else:
-            try:
-                value = ros2ify_value(field.field_name, value, MsgType)
-                setattr(msg, field.field_name, value)
-            except Exception as e:
-                print(
-                    f"Exception when setting field '{field.field_name}' from"
-                    f" topic '{ulg_topic.name}' with type: {type(value)}"
-                )
-                raise e
-
-    return msg
+    plan = ConversionPlan(ulg_topic.field_data, MsgType.get_fields_and_field_types())
+    return plan.create_messages(MsgType, plan.get_columns(ulg_topic.data, i, i + 1))[0]
 
 
 if __name__ == "__main__":
@@ -0,0 +1,269 @@
+#! /usr/bin/env python
+
+"""
+Check the structure of ULog files without parsing the logged data
+"""
+
+import argparse
+import json
+import os
+import struct
+import sys
+
+import numpy as np
+
+from .core import ULog
+from .scanner import ULogScanner
+
+#pylint: disable=protected-access, too-many-instance-attributes
+
+# minimum payload size of the data section messages (data messages are
+# checked against the size of their format)
+_MIN_MESSAGE_SIZES = {
+    ULog.MSG_TYPE_ADD_LOGGED_MSG: 4,
+    ULog.MSG_TYPE_REMOVE_LOGGED_MSG: 2,
+    ULog.MSG_TYPE_LOGGING: 9,
+    ULog.MSG_TYPE_LOGGING_TAGGED: 11,
+    ULog.MSG_TYPE_PARAMETER: 2,
+    ULog.MSG_TYPE_PARAMETER_DEFAULT: 3,
+    ULog.MSG_TYPE_INFO: 2,
+    ULog.MSG_TYPE_INFO_MULTIPLE: 3,
+    ULog.MSG_TYPE_DROPOUT: 2,
+    ULog.MSG_TYPE_SYNC: len(ULog.SYNC_BYTES),
+    }
+
+
+def main(argv=None):
+    """Command line interface"""
+
+    parser = argparse.ArgumentParser(
+        description='Check the structure of ULog files. Prints one JSON record per file,'
+        ' and exits with 1 if any file is invalid')
+    parser.add_argument('filenames', metavar='file.ulg', nargs='+', help='ULog input files')
+
+    args = parser.parse_args(argv)
+
+    all_valid = True
+    for file_name in args.filenames:
+        verdict = validate_ulog(file_name)
+        all_valid = all_valid and verdict['valid']
+        print(json.dumps(verdict))
+    if not all_valid:
+        sys.exit(1)
+
+
+def validate_ulog(log_file):
+    """
+    Check the structure of a ULog file, by walking over the message headers
+    with ULogScanner (the logged data is not parsed). The checks are:
+    - the file header and the definitions can be read
+    - appended data offsets: increasing and inside the data section
+    - message sizes: no corrupt headers (see ULog._check_packet_corruption),
+      data messages match the size of their format, other messages are not
+      too small for their type
+    - message types: unknown types (only a warning, as newer logger versions
+      may add types)
+    - subscriptions: data messages have a subscription, subscriptions can be
+      parsed and msg_ids are not subscribed twice (unless the subscription got
+      removed before)
+    - timestamps: increasing per topic (data messages with the same msg_id)
+
+    :param log_file: file name or binary file handle (which must be seekable)
+
+    :return: dict (JSON serializable) with the keys:
+             'file': file name (None for a file handle),
+             'valid': True if there are no errors,
+             'errors', 'warnings': dict of check name to number of occurrences,
+             'corrupt_ranges': list of [start, end] file offsets of corrupt bytes,
+             'non_monotonic_topics': list of '<topic name>/<multi_id>',
+             'file_size', 'num_messages', 'last_timestamp'
+    """
+    verdict = {'file': log_file if isinstance(log_file, str) else None,
+               'valid': True, 'errors': {}, 'warnings': {}, 'corrupt_ranges': [],
+               'non_monotonic_topics': [], 'file_size': _get_file_size(log_file),
+               'num_messages': 0, 'last_timestamp': 0}
+    try:
+        scanner = ULogScanner(log_file)
+    except (TypeError, ValueError, IndexError, UnicodeDecodeError, struct.error):
+        verdict['errors']['definitions'] = 1
+        verdict['valid'] = False
+        return verdict
+
+    checker = _StructureChecker(scanner)
+    _check_appended_offsets(scanner, verdict)
+    for chunk in scanner.iter_chunks():
+        checker.check_chunk(chunk)
+        verdict['num_messages'] += len(chunk.offsets)
+
+    for name, count in checker.errors.items():
+        if count > 0:
+            verdict['errors'][name] = count
+    if checker.unknown_msg_types > 0:
+        verdict['warnings']['unknown_message_types'] = checker.unknown_msg_types
+    if scanner.corrupt_ranges:
+        verdict['errors']['corrupt_ranges'] = len(scanner.corrupt_ranges)
+        verdict['corrupt_ranges'] = [list(corrupt_range) for corrupt_range in
+                                     scanner.corrupt_ranges]
+    file_end = max([checker.last_message_end, scanner.definitions_end] +
+                   [end for _, end in scanner.corrupt_ranges])
+    if verdict['file_size'] > file_end:
+        # the logger stopped while writing a message
+        verdict['warnings']['truncated_bytes'] = verdict['file_size'] - file_end
+    verdict['non_monotonic_topics'] = checker.get_non_monotonic_topics()
+    verdict['last_timestamp'] = checker.last_timestamp
+    verdict['valid'] = not verdict['errors']
+    return verdict
+
+
+def _get_file_size(log_file):
+    if isinstance(log_file, str):
+        return os.path.getsize(log_file)
+    file_position = log_file.tell()
+    file_size = log_file.seek(0, os.SEEK_END)
+    log_file.seek(file_position)
+    return file_size
+
+
+def _check_appended_offsets(scanner, verdict):
+    """ check that the appended data offsets are increasing and inside the
+    data section """
+    offsets = [offset for offset in scanner.appended_offsets if offset > 0]
+    if not scanner.has_data_appended:
+        if offsets:
+            verdict['warnings']['appended_offsets_without_flag'] = len(offsets)
+        return
+    bounds = [scanner.definitions_end] + offsets + [verdict['file_size']]
+    num_invalid = sum(1 for start, end in zip(bounds[:-1], bounds[1:]) if start >= end)
+    if num_invalid > 0:
+        verdict['errors']['appended_offsets'] = num_invalid
+
+
+class _StructureChecker(object):
+    """ checks the messages of the scanned chunks, keeping the state per msg_id """
+
+    def __init__(self, scanner):
+        self._scanner = scanner
+        self.errors = {'message_size': 0, 'unsubscribed_msg_ids': 0,
+                       'invalid_subscriptions': 0, 'duplicate_msg_ids': 0,
+                       'non_monotonic_timestamps': 0}
+        self.unknown_msg_types = 0
+        self.last_message_end = 0
+        self.last_timestamp = 0
+
+        num_msg_ids = 1 << 16
+        # index in the current chunk where the msg_id got subscribed (-1 for
+        # a previous chunk, int64 max if not subscribed)
+        self._subscribed_at = np.full(num_msg_ids, np.iinfo(np.int64).max, dtype=np.int64)
+        self._min_sizes = np.zeros(num_msg_ids, dtype=np.int64)
+        self._max_sizes = np.zeros(num_msg_ids, dtype=np.int64)
+        self._last_timestamps = np.zeros(num_msg_ids, dtype=np.uint64)
+        self._non_monotonic = np.zeros(num_msg_ids, dtype=np.bool_)
+        self._non_monotonic_topics = [] # of removed subscriptions
+        self._topic_names = {} # key=msg_id, value='<topic name>/<multi_id>'
+
+        self._known_msg_types = np.zeros(256, dtype=np.bool_)
+        self._known_msg_types[list(ULog._DATA_SECTION_MSG_TYPES)] = True
+        self._min_msg_sizes = np.zeros(256, dtype=np.int64)
+        for msg_type, min_size in _MIN_MESSAGE_SIZES.items():
+            self._min_msg_sizes[msg_type] = min_size
+
+    def check_chunk(self, chunk):
+        """ check a ScannedChunk """
+        msg_types = chunk.msg_types
+        self.last_message_end = chunk.file_offset + int(chunk.offsets[-1] +
+                                                        3 + chunk.msg_sizes[-1])
+        self.unknown_msg_types += int(np.count_nonzero(~self._known_msg_types[msg_types]))
+        self.errors['message_size'] += int(np.count_nonzero(
+            chunk.msg_sizes < self._min_msg_sizes[msg_types]))
+        self.last_timestamp = max(self.last_timestamp, int(chunk.timestamps.max()))
+
+        # the messages between two removed subscriptions are checked at once
+        is_remove = (msg_types == ULog.MSG_TYPE_REMOVE_LOGGED_MSG) & (chunk.msg_sizes >= 2)
+        start = 0
+        for end in np.flatnonzero(is_remove).tolist() + [len(msg_types)]:
+            self._check_subscriptions(chunk, start, end)
+            self._check_data(chunk, start, end)
+            if end < len(msg_types):
+                self._remove_subscription(int(chunk.msg_ids[end]))
+            start = end + 1
+
+        self._subscribed_at[self._subscribed_at >= 0] = -1
+
+    def get_non_monotonic_topics(self):
+        """ get the topics with non-monotonic timestamps as list of
+        '<topic name>/<multi_id>' """
+        return self._non_monotonic_topics + [
+            self._topic_names[msg_id] for msg_id in np.flatnonzero(self._non_monotonic).tolist()]
+
+    def _check_subscriptions(self, chunk, start, end):
+        """ check the subscriptions of chunk messages [start, end) """
+        header = ULog._MessageHeader()
+        header.msg_type = ULog.MSG_TYPE_ADD_LOGGED_MSG
+        not_subscribed = np.iinfo(np.int64).max
+        for index in (start + np.flatnonzero(chunk.msg_types[start:end] ==
+                                             ULog.MSG_TYPE_ADD_LOGGED_MSG)).tolist():
+            # parsed here, as the scanner only keeps the last subscription of
+            # a msg_id in a chunk
+            offset = int(chunk.offsets[index])
+            header.msg_size = int(chunk.msg_sizes[index])
+            try:
+                subscription = ULog._MessageAddLogged(
+                    chunk.buffer[offset+3:offset+3+header.msg_size], header,
+                    self._scanner.message_formats)
+            except (IndexError, KeyError, UnicodeDecodeError, struct.error):
+                self.errors['invalid_subscriptions'] += 1
+                continue
+            msg_id = subscription.msg_id
+            if self._subscribed_at[msg_id] != not_subscribed:
+                self.errors['duplicate_msg_ids'] += 1
+            else:
+                self._subscribed_at[msg_id] = index
+                self._min_sizes[msg_id] = subscription.dtype.itemsize
+                self._max_sizes[msg_id] = subscription.max_data_size
+                self._topic_names[msg_id] = '{}/{}'.format(subscription.message_name,
+                                                           subscription.multi_id)
+
+    def _check_data(self, chunk, start, end):
+        """ check the data messages of chunk messages [start, end) """
+        indexes = start + np.flatnonzero(chunk.msg_types[start:end] == ULog.MSG_TYPE_DATA)
+        msg_ids = chunk.msg_ids[indexes]
+        is_subscribed = self._subscribed_at[msg_ids] < indexes
+        self.errors['unsubscribed_msg_ids'] += int(np.count_nonzero(~is_subscribed))
+        data_sizes = chunk.msg_sizes[indexes] - 2
+        is_valid = is_subscribed & (data_sizes >= self._min_sizes[msg_ids]) & \
+            (data_sizes <= self._max_sizes[msg_ids])
+        self.errors['message_size'] += int(np.count_nonzero(is_subscribed & ~is_valid))
+        self._check_timestamps(msg_ids[is_valid], chunk.timestamps[indexes][is_valid])
+
+    def _remove_subscription(self, msg_id):
+        """ clear the state of a msg_id, so that it can be subscribed again """
+        if self._non_monotonic[msg_id]:
+            self._non_monotonic_topics.append(self._topic_names[msg_id])
+            self._non_monotonic[msg_id] = False
+        self._subscribed_at[msg_id] = np.iinfo(np.int64).max
+        self._min_sizes[msg_id] = 0
+        self._max_sizes[msg_id] = 0
+        self._last_timestamps[msg_id] = 0
+
+    def _check_timestamps(self, msg_ids, timestamps):
+        """ check that the timestamps of the data messages are increasing
+        per msg_id (including the last timestamp of the previous chunks) """
+        if len(msg_ids) == 0:
+            return
+        order = np.argsort(msg_ids, kind='stable')
+        msg_ids = msg_ids[order]
+        timestamps = timestamps[order]
+        previous = np.empty_like(timestamps)
+        previous[1:] = timestamps[:-1]
+        group_starts = np.concatenate(([True], msg_ids[1:] != msg_ids[:-1]))
+        previous[group_starts] = self._last_timestamps[msg_ids[group_starts]]
+        is_decreasing = timestamps < previous
+        self.errors['non_monotonic_timestamps'] += int(np.count_nonzero(is_decreasing))
+        self._non_monotonic[msg_ids[is_decreasing]] = True
+
+        group_ends = np.concatenate((group_starts[1:], [True]))
+        self._last_timestamps[msg_ids[group_ends]] = timestamps[group_ends]
+
+
+if __name__ == "__main__":
+    main()
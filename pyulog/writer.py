@@ -0,0 +1,347 @@
+"""
+Write ULog files incrementally
+"""
+
+import struct
+
+import numpy as np
+
+from .core import ULog
+
+
+class ULogWriter(object):
+    """
+    Writes a ULog file message by message, without keeping the log in memory.
+
+    The definitions (formats, info messages and initial parameters) have to
+    be written first, and the data section starts with the first data section
+    message (e.g. add_subscription()). Data is written in the order of the
+    calls, so messages of different topics have to be written in time order
+    by the caller. A sync message is inserted after every sync_interval bytes
+    of the data section, so that readers can recover from corruption.
+
+    Usage:
+        with ULogWriter('out.ulg', start_timestamp) as writer:
+            writer.write_format('my_topic', [('uint64_t', 0, 'timestamp'),
+                                             ('float', 3, 'xyz')])
+            writer.write_info('sys_name', 'PX4', 'char[3]')
+            msg_id = writer.add_subscription('my_topic')
+            writer.write_data(msg_id, {'timestamp': timestamps, 'xyz[0]': x, ...})
+    """
+
+    # default number of data section bytes between sync messages
+    SYNC_INTERVAL = 1 << 20
+
+    def __init__(self, log_file, start_timestamp=0, file_version=1,
+                 compat_flags=None, incompat_flags=None, sync_interval=SYNC_INTERVAL):
+        """
+        Open the file and write the file header and flag bits.
+
+        :param log_file: file name or binary file handle (which is not closed)
+        :param start_timestamp: timestamp of the file header [us]
+        :param compat_flags: list of 8 compat flag bytes
+        :param incompat_flags: list of 8 incompat flag bytes
+        :param sync_interval: number of data section bytes between sync
+                              messages (None to disable sync messages)
+        """
+        if isinstance(log_file, str):
+            self._file = open(log_file, 'wb') # pylint: disable=consider-using-with
+            self._owns_file = True
+        else:
+            self._file = log_file
+            self._owns_file = False
+        self._sync_interval = sync_interval
+        self._bytes_since_sync = 0
+        self._in_data_section = False
+        self._message_formats = {} # key=format name, value=ULog.MessageFormat
+        self._subscriptions = {} # key=msg_id, value=(field_data, records dtype)
+
+        self._write_file_header(start_timestamp, file_version)
+        self._write_flags(compat_flags or [0] * 8, incompat_flags or [0] * 8)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """ close the file (if it was opened by the writer) """
+        if self._owns_file:
+            self._file.close()
+
+    def _write_file_header(self, start_timestamp, file_version):
+        header_data = bytearray()
+        header_data.extend(ULog.HEADER_BYTES)
+        header_data.extend(struct.pack('B', file_version))
+        header_data.extend(struct.pack('<Q', start_timestamp))
+        if len(header_data) != 16:
+            raise TypeError("Written header is too short")
+
+        self._file.write(header_data)
+
+    def _write_flags(self, compat_flags, incompat_flags):
+        data = bytearray()
+        data.extend(struct.pack('<' + 'B' * 8, *compat_flags))
+        data.extend(struct.pack('<' + 'B' * 8, *incompat_flags))
+
+        offsets = [0, 0, 0]
+        data.extend(struct.pack('<' + 'Q' * 3, *offsets))
+
+        self._write_message(ULog.MSG_TYPE_FLAG_BITS, data)
+
+    def _write_message(self, msg_type, data):
+        """ write a message with its header """
+        self._write(struct.pack('<HB', len(data), msg_type) + data)
+
+    def _write(self, buffer):
+        """ write serialized messages, preceded by a sync message if needed """
+        if self._in_data_section and self._sync_interval is not None:
+            if self._bytes_since_sync >= self._sync_interval:
+                self._bytes_since_sync = 0
+                self._file.write(struct.pack('<HB', len(ULog.SYNC_BYTES), ULog.MSG_TYPE_SYNC) +
+                                 ULog.SYNC_BYTES)
+            self._bytes_since_sync += len(buffer)
+        self._file.write(buffer)
+
+    def _start_data_section(self):
+        self._in_data_section = True
+
+    ## Definitions section ##
+
+    def write_format(self, name, fields):
+        """
+        Write a message format definition.
+
+        :param name: format name (e.g. the topic name)
+        :param fields: list of (type, array_size, field name) tuples, where
+                       type is a ULog type (e.g. 'float') or the name of an
+                       already written format, and array_size is 0 for
+                       non-array fields
+        """
+        if self._in_data_section:
+            raise ValueError('formats must be written before the data section')
+        message = self.make_format_message(name, fields)
+        self._message_formats[name] = ULog.MessageFormat(message[3:], None)
+        self._write(message)
+
+    @staticmethod
+    def make_format_message(name, fields):
+        """ serialize a format message (see write_format()) """
+        data = bytearray()
+
+        data.extend(bytes(name + ':', 'utf-8'))
+        for field_type, array_size, field_name in fields:
+            # Determine the field type (e.g. int16_t or float[8])
+            if array_size > 0:
+                encoded_field = '%s[%d] %s;' % (field_type, array_size, field_name)
+            else:
+                encoded_field = '%s %s;' % (field_type, field_name)
+            data.extend(bytes(encoded_field, 'utf-8'))
+
+        return struct.pack('<HB', len(data), ULog.MSG_TYPE_FORMAT) + data
+
+    def write_info(self, key, value, value_type):
+        """
+        Write an info message.
+
+        :param key: name of the info message (e.g. 'sys_name')
+        :param value: str for char arrays, bytes for uint8_t arrays, otherwise
+                      a number
+        :param value_type: ULog type (e.g. 'char[3]' or 'int32_t')
+        """
+        data = self._make_info_message_data(value_type + ' ' + key, value, value_type)
+        self._write_message(ULog.MSG_TYPE_INFO, data)
+
+    def write_info_multiple(self, key, values, value_type):
+        """
+        Write a multi info message, where values is split into continued
+        messages (e.g. the lines of a boot console output).
+
+        :param values: list of values (see write_info())
+        """
+        continued = False
+        for value in values:
+            data = self._make_info_message_data(value_type + ' ' + key, value, value_type,
+                                                continued)
+            self._write_message(ULog.MSG_TYPE_INFO_MULTIPLE, data)
+            continued = True
+
+    def write_parameter(self, name, value):
+        """
+        Write a parameter. In the data section, this is a parameter change.
+
+        :param value: int (stored as int32_t) or float
+        """
+        self._write(self.make_parameter_message(name, value))
+
+    def write_default_parameter(self, name, value, default_types):
+        """
+        Write a default parameter value.
+
+        :param default_types: bitfield of the default types (bit 0: system
+                              wide default, bit 1: default for the current
+                              configuration)
+        """
+        data = bytearray()
+        data.extend(struct.pack('<B', default_types))
+        data.extend(self.make_parameter_data(name, value))
+        self._write_message(ULog.MSG_TYPE_PARAMETER_DEFAULT, data)
+
+    @classmethod
+    def make_parameter_message(cls, name: str, value) -> bytes:
+        """ serialize a parameter message """
+        data = cls.make_parameter_data(name, value)
+        return struct.pack('<HB', len(data), ULog.MSG_TYPE_PARAMETER) + data
+
+    @classmethod
+    def make_parameter_data(cls, name: str, value) -> bytes:
+        """ get the payload of a parameter message """
+        if isinstance(value, int):
+            value_type = "int32_t"
+        elif isinstance(value, float):
+            value_type = "float"
+        else:
+            raise TypeError("Found unknown parameter value type")
+
+        key: str = value_type + ' ' + name
+
+        return cls._make_info_message_data(key, value, value_type)
+
+    @staticmethod
+    def _make_info_message_data(key: str, value, value_type: str, continued=None) -> bytes:
+        key_bytes = bytes(key, 'utf-8')
+        data = bytearray()
+
+        if continued is not None:
+            data.extend(struct.pack('<B', continued))
+
+        data.extend(struct.pack('<B', len(key_bytes)))
+        data.extend(key_bytes)
+
+        if value_type.startswith('char['):
+            value_bytes = bytes(value, 'utf-8')
+            data.extend(value_bytes)
+        elif value_type.startswith('uint8_t['):
+            data.extend(value)
+        else:
+            code = ULog._UNPACK_TYPES[value_type][0] # pylint: disable=protected-access
+            data.extend(struct.pack('<' + code, value))
+
+        return data
+
+    ## Data section ##
+
+    def add_subscription(self, message_name, multi_id=0, msg_id=None):
+        """
+        Write a subscription, which starts the data section.
+
+        :param message_name: name of a written format
+        :param msg_id: msg_id to use (the next free one if None)
+        :return: msg_id, to be used for write_data()
+        """
+        if msg_id is None:
+            msg_id = max(self._subscriptions, default=-1) + 1
+        if msg_id in self._subscriptions:
+            raise ValueError('msg_id {} is already used'.format(msg_id))
+        if message_name not in self._message_formats:
+            raise ValueError('no format for message {}'.format(message_name))
+
+        data = bytearray()
+        data.extend(struct.pack('<BH', multi_id, msg_id))
+        data.extend(bytes(message_name, 'utf-8'))
+
+        # pylint: disable=protected-access
+        subscription = ULog._MessageAddLogged(data, None, self._message_formats)
+        dtype_list = [('@msg_size', '<u2'), ('@msg_type', 'u1'), ('@msg_id', '<u2')]
+        for field in subscription.field_data:
+            dtype_list.append((field.field_name,
+                               np.dtype(ULog._UNPACK_TYPES[field.type_str][2]).newbyteorder('<')))
+        self._subscriptions[msg_id] = (subscription.field_data, np.dtype(dtype_list))
+
+        self._start_data_section()
+        self._write_message(ULog.MSG_TYPE_ADD_LOGGED_MSG, data)
+        return msg_id
+
+    def make_data_records(self, msg_id, records):
+        """
+        Serialize data messages into a structured array, one record per
+        message (including the message header).
+
+        :param msg_id: msg_id of the subscription
+        :param records: dict of field name to np.array (like ULog.Data.data)
+                        or structured np.array with the fields of the format
+        :return: np.array
+        """
+        field_data, dtype = self._subscriptions[msg_id]
+        num_messages = len(records[field_data[0].field_name])
+        serialized = np.empty(num_messages, dtype=dtype)
+        serialized['@msg_size'] = dtype.itemsize - 3
+        serialized['@msg_type'] = ULog.MSG_TYPE_DATA
+        serialized['@msg_id'] = msg_id
+        for field in field_data:
+            values = records[field.field_name][:num_messages]
+            if field.type_str == 'bool':
+                values = values != 0
+            serialized[field.field_name] = values
+        return serialized
+
+    def write_data(self, msg_id, records):
+        """
+        Write data messages of a subscription.
+
+        :param msg_id: msg_id of the subscription
+        :param records: see make_data_records()
+        """
+        serialized = self.make_data_records(msg_id, records)
+        chunk_size = len(serialized)
+        if self._sync_interval is not None:
+            chunk_size = max(1, self._sync_interval // serialized.dtype.itemsize)
+        for chunk_start in range(0, len(serialized), chunk_size):
+            self._write(serialized[chunk_start:chunk_start + chunk_size].tobytes())
+
+    @staticmethod
+    def make_logging_message(log_level, message, timestamp, tag=None):
+        """ serialize a logged string message (tagged if tag is not None) """
+        data = bytearray()
+        if tag is None:
+            msg_type = ULog.MSG_TYPE_LOGGING
+            data.extend(struct.pack('<BQ', log_level, timestamp))
+        else:
+            msg_type = ULog.MSG_TYPE_LOGGING_TAGGED
+            data.extend(struct.pack('<BHQ', log_level, tag, timestamp))
+        data.extend(bytes(message, 'utf-8'))
+        return struct.pack('<HB', len(data), msg_type) + data
+
+    def write_logging(self, log_level, message, timestamp, tag=None):
+        """
+        Write a logged string message.
+
+        :param log_level: log level as in ULog.MessageLogging (e.g. ord('6'))
+        :param timestamp: timestamp [us]
+        :param tag: tag of a tagged logged message (None for untagged)
+        """
+        self._start_data_section()
+        self._write(self.make_logging_message(log_level, message, timestamp, tag))
+
+    @staticmethod
+    def make_dropout_message(duration):
+        """ serialize a dropout message """
+        return struct.pack('<HBH', 2, ULog.MSG_TYPE_DROPOUT, duration)
+
+    def write_dropout(self, duration):
+        """
+        Write a dropout message.
+
+        :param duration: duration of the dropout [ms]
+        """
+        self._start_data_section()
+        self._write(self.make_dropout_message(duration))
+
+    def write_serialized(self, buffer):
+        """
+        Write already serialized data section messages (e.g. from the make_*
+        methods).
+        """
+        self._start_data_section()
+        self._write(buffer)
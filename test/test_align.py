@@ -0,0 +1,119 @@
+'''
+Test the align module
+'''
+
+import os
+import inspect
+import tempfile
+import unittest
+
+import numpy as np
+from ddt import ddt, data
+
+from pyulog import ULog
+from pyulog import ulog2csv
+from pyulog.align import align_values, align_topics, get_align_timeline, iter_align_data
+
+TEST_PATH = os.path.dirname(os.path.abspath(
+    inspect.getfile(inspect.currentframe())))
+
+@ddt
+class TestAlign(unittest.TestCase):
+    '''
+    Test aligning topics onto a common timeline
+    '''
+
+    def test_align_values(self):
+        '''
+        Test the alignment methods on a small example
+        '''
+        t = np.array([10, 20, 30], dtype=np.uint64)
+        x = np.array([1, 2, 4], dtype=np.int32)
+        timestamps = np.array([5, 10, 15, 30, 35], dtype=np.uint64)
+
+        values = align_values(t, x, timestamps, 'previous')
+        np.testing.assert_array_equal(values, [np.nan, 1, 1, 4, 4])
+
+        values = align_values(t, x, timestamps[1:], 'previous')
+        self.assertEqual(values.dtype, np.int32)
+        np.testing.assert_array_equal(values, [1, 1, 4, 4])
+
+        values = align_values(t, x, timestamps, 'linear')
+        np.testing.assert_array_equal(values, [np.nan, 1, 1.5, 4, np.nan])
+
+        values = align_values(t, x, timestamps, 'nearest')
+        self.assertEqual(values.dtype, np.int32)
+        np.testing.assert_array_equal(values, [1, 1, 1, 4, 4])
+        values = align_values(t, x, np.array([24, 25, 26], dtype=np.uint64), 'nearest')
+        np.testing.assert_array_equal(values, [2, 2, 4])
+
+        # as-of join with a tolerance
+        values = align_values(t, x, np.array([10, 12, 14, 45], dtype=np.uint64),
+                              'previous', tolerance=3)
+        np.testing.assert_array_equal(values, [1, 1, np.nan, np.nan])
+        values = align_values(t, x, timestamps, 'nearest', tolerance=5)
+        np.testing.assert_array_equal(values, [1, 1, 1, 4, 4])
+        values = align_values(t, x, np.array([11, 15, 19], dtype=np.uint64), 'linear',
+                              tolerance=2)
+        np.testing.assert_array_equal(values, [1.1, np.nan, 1.9])
+
+        for method in ['previous', 'nearest', 'linear']:
+            values = align_values(t[:0], x[:0], timestamps, method)
+            self.assertTrue(np.all(np.isnan(values)))
+        self.assertRaises(ValueError, align_values, t, x, timestamps, 'cubic')
+
+    @data('sample', 'sample_log_small')
+    def test_align_topics(self, base_name):
+        '''
+        Test that aligning to a reference topic reproduces the reference topic
+        '''
+        ulog = ULog(os.path.join(TEST_PATH, base_name + '.ulg'))
+        reference = ulog.get_dataset('vehicle_attitude')
+        for method in ['previous', 'linear']:
+            timestamps, columns = align_topics(ulog, 'vehicle_attitude',
+                                               ['vehicle_attitude', 'vehicle_status'],
+                                               method)
+            np.testing.assert_array_equal(timestamps, reference.data['timestamp'])
+            np.testing.assert_allclose(columns['vehicle_attitude_0.q[0]'],
+                                       reference.data['q[0]'], rtol=1e-6)
+            self.assertIn('vehicle_status_0.nav_state', columns)
+
+        timestamps, columns = align_topics(ulog, 10, ['vehicle_attitude'])
+        np.testing.assert_array_equal(np.diff(timestamps), 100000)
+        self.assertEqual(len(columns['vehicle_attitude_0.q[0]']), len(timestamps))
+
+    @data('sample')
+    def test_iter_align_data(self, base_name):
+        '''
+        Test that aligning in chunks gives the same result, and that fields
+        can be selected
+        '''
+        ulog = ULog(os.path.join(TEST_PATH, base_name + '.ulg'))
+        topic_names = ['vehicle_attitude', ('vehicle_local_position', ['x', 'vx'])]
+        for method in ['previous', 'nearest', 'linear']:
+            timestamps, columns = align_topics(ulog, 50, topic_names, method,
+                                               tolerance=100000)
+            self.assertEqual(sorted(c for c in columns if c.startswith('vehicle_local')),
+                             ['vehicle_local_position_0.vx', 'vehicle_local_position_0.x'])
+            self.assertIn('vehicle_attitude_0.q[0]', columns)
+
+            timeline, data_list = get_align_timeline(ulog, 50, topic_names)
+            np.testing.assert_array_equal(timeline, timestamps)
+            chunks = list(iter_align_data(data_list, timeline, method, 100000, 1000))
+            self.assertEqual(len(chunks), (len(timestamps) + 999) // 1000)
+            np.testing.assert_array_equal(np.concatenate([t for t, _ in chunks]), timestamps)
+            for name, values in columns.items():
+                np.testing.assert_array_equal(
+                    np.concatenate([chunk_columns[name] for _, chunk_columns in chunks]),
+                    values)
+
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            ulog2csv.main([os.path.join(TEST_PATH, base_name + '.ulg'), '-o', tmpdirname,
+                           '-m', 'vehicle_attitude,vehicle_status',
+                           '--align', 'vehicle_attitude', '--align-method', 'nearest'])
+            with open(os.path.join(tmpdirname, base_name + '_aligned.csv'),
+                      encoding='utf8') as csv_file:
+                lines = csv_file.read().splitlines()
+        self.assertEqual(len(lines), len(ulog.get_dataset('vehicle_attitude').data['timestamp'])
+                         + 1)
+        self.assertEqual(lines[0].split(',')[0], 'timestamp')
@@ -7,10 +7,22 @@ import os
 import inspect
 import unittest
 import tempfile
+import gzip
+import lzma
+import json
+import shutil
+import struct
+import xml.etree.ElementTree as ET
+from types import SimpleNamespace
 
 from ddt import ddt, data
 
-from pyulog import ulog2csv, info, params, messages, extract_gps_dump
+import numpy as np
+
+from pyulog import ULog, ulog2csv, ulog2parquet, info, params, messages, extract_gps_dump
+from pyulog import batch, ulog2kml, crop, merge, validate
+from pyulog.scanner import ULogScanner
+from pyulog.writer import ULogWriter
 
 try:
     from StringIO import StringIO
@@ -20,6 +32,25 @@ except ImportError:
 TEST_PATH = os.path.dirname(os.path.abspath(
     inspect.getfile(inspect.currentframe())))
 
+
+def write_corrupt_log(file_name, data_index=100, header=b'\xff\xff\xee'):
+    """
+    Write a copy of sample.ulg (which has no sync sequences) with a corrupt
+    header of a data message.
+
+    :return: file offset of the corrupt header
+    """
+    test_filename = os.path.join(TEST_PATH, 'sample.ulg')
+    with open(test_filename, 'rb') as file_handle:
+        log_data = bytearray(file_handle.read())
+    chunk = next(ULogScanner(test_filename).iter_chunks())
+    offset = chunk.file_offset + int(
+        chunk.offsets[chunk.msg_types == ULog.MSG_TYPE_DATA][data_index])
+    log_data[offset:offset+3] = header
+    with open(file_name, 'wb') as file_handle:
+        file_handle.write(log_data)
+    return offset
+
 @ddt
 class TestCommandLineTools(unittest.TestCase):
     """
@@ -69,6 +100,379 @@ class TestCommandLineTools(unittest.TestCase):
                                   time_s,
                                   time_e)
 
+    def test_ulog2csv_time_range(self):
+        """
+        Test that 'ulog2csv' writes the rows of the time range, also if the
+        range does not contain any data.
+        """
+        ulog_file_name = os.path.join(TEST_PATH, 'sample.ulg')
+        attitude = ULog(ulog_file_name, ['vehicle_attitude']).get_dataset('vehicle_attitude')
+        timestamps = attitude.data['timestamp']
+        time_s, time_e = timestamps[[10, -10]] / 1e6
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            for t_range, num_rows in [((time_s, time_e), len(timestamps) - 20),
+                                      ((10000, 20000), 0)]:
+                ulog2csv.convert_ulog2csv(ulog_file_name, 'vehicle_attitude', tmpdirname,
+                                          ',', *t_range)
+                with open(os.path.join(tmpdirname, 'sample_vehicle_attitude_0.csv'),
+                          encoding='utf-8') as csv_file:
+                    self.assertEqual(len(csv_file.readlines()), num_rows + 1)
+
+    @data('gzip', 'xz', 'zstd')
+    def test_ulog2csv_compress(self, compress):
+        """
+        Test that 'ulog2csv' writes compressed files with the same content.
+        """
+        decompress = {'gzip': gzip.decompress, 'xz': lzma.decompress}.get(compress)
+        if decompress is None:
+            try:
+                import zstandard # pylint: disable=import-outside-toplevel
+            except ImportError:
+                self.skipTest('zstandard not installed')
+
+            def decompress(buffer):
+                # the files contain multiple frames
+                return zstandard.ZstdDecompressor().decompressobj(
+                    read_across_frames=True).decompress(buffer)
+
+        ulog_file_name = os.path.join(TEST_PATH, 'sample.ulg')
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            ulog2csv.convert_ulog2csv(ulog_file_name, 'sensor_combined,vehicle_status',
+                                      tmpdirname, ',', 0, 0)
+            ulog2csv.convert_ulog2csv(ulog_file_name, 'sensor_combined,vehicle_status',
+                                      tmpdirname, ',', 0, 0, compress=compress,
+                                      compress_threads=2)
+            extension = ulog2csv.COMPRESSION_EXTENSIONS[compress]
+            for name in ['sample_sensor_combined_0.csv', 'sample_vehicle_status_0.csv']:
+                with open(os.path.join(tmpdirname, name), 'rb') as file_handle:
+                    expected = file_handle.read()
+                with open(os.path.join(tmpdirname, name + extension), 'rb') as file_handle:
+                    assert decompress(file_handle.read()) == expected
+
+    @data('sample_px4_events', 'sample_log_small')
+    def test_ulog2kml(self, test_case):
+        """
+        Test that 'ulog2kml' writes one line per flight mode.
+        """
+        test_filename = os.path.join(TEST_PATH, test_case + '.ulg')
+        ulog = ULog(test_filename, ['vehicle_status'])
+        flight_modes = [mode for _, mode in
+                        ulog.get_dataset('vehicle_status').list_value_changes('nav_state')]
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            output_filename = os.path.join(tmpdirname, 'track.kml')
+            ulog2kml.main([test_filename, '-o', output_filename])
+            root = ET.parse(output_filename).getroot()
+
+        namespace = {'kml': 'http://www.opengis.net/kml/2.2'}
+        placemarks = root.findall('.//kml:Placemark', namespace)
+        names = [placemark.find('kml:name', namespace).text for placemark in placemarks]
+        self.assertEqual(names, ['vehicle_gps_position:' + str(mode)
+                                 for mode in flight_modes + [-1]])
+        coordinates = [placemark.find('.//kml:coordinates', namespace).text.split(' ')
+                       for placemark in placemarks]
+        for previous, current in zip(coordinates[:-1], coordinates[1:]):
+            # consecutive lines are connected
+            self.assertEqual(previous[-1], current[0])
+        self.assertEqual(len(coordinates[0][0].split(',')), 3)
+
+    def test_ulog2kml_decimate(self):
+        """
+        Test that the decimation matches a sequential implementation.
+        """
+        timestamps = np.cumsum(np.random.default_rng(0).integers(0, 100000, 10000))
+        for minimum_interval_s in [0, 0.05, 0.1, 1]:
+            expected = []
+            last_t = 0
+            for i, cur_t in enumerate(timestamps):
+                if (cur_t - last_t) / 1e6 > minimum_interval_s:
+                    expected.append(i)
+                    last_t = cur_t
+            np.testing.assert_array_equal(
+                ulog2kml.decimate_timestamps(timestamps, minimum_interval_s), expected)
+
+    @data('sample_logging_tagged_and_default_params', 'sample_appended_multiple')
+    def test_ulog_crop(self, test_case):
+        """
+        Test that 'ulog_crop' keeps the data of the time window and topics.
+        """
+        test_filename = os.path.join(TEST_PATH, test_case + '.ulg')
+        ulog = ULog(test_filename)
+        attitude = ulog.get_dataset('vehicle_attitude')
+        time_s, time_e = attitude.data['timestamp'][[10, -10]] / 1e6
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            output_filename = os.path.join(tmpdirname, 'cropped.ulg')
+            crop.main([test_filename, '-o', output_filename, '-ts', str(time_s),
+                       '-te', str(time_e), '-m', 'vehicle_attitude,vehicle_status'])
+            cropped = ULog(output_filename)
+
+        self.assertFalse(cropped.file_corruption)
+        self.assertFalse(cropped.has_data_appended)
+        self.assertEqual(cropped.initial_parameters, ulog.initial_parameters)
+        self.assertEqual(sorted({d.name for d in cropped.data_list}),
+                         ['vehicle_attitude', 'vehicle_status'])
+        for dataset in cropped.data_list:
+            original = ulog.get_dataset(dataset.name, dataset.multi_id)
+            mask = ((original.data['timestamp'] >= time_s * 1e6) &
+                    (original.data['timestamp'] < time_e * 1e6))
+            for name, values in dataset.data.items():
+                np.testing.assert_array_equal(values, original.data[name][mask])
+        self.assertEqual([m.message for m in cropped.logged_messages],
+                         [m.message for m in ulog.logged_messages
+                          if time_s * 1e6 <= m.timestamp < time_e * 1e6])
+        self.assertEqual([(name, value) for _, name, value in cropped.changed_parameters],
+                         [(name, value) for timestamp, name, value in ulog.changed_parameters
+                          if timestamp < time_e * 1e6])
+        # same window as ULog.slice()
+        sliced = ulog.slice(attitude.data['timestamp'][10], attitude.data['timestamp'][-10])
+        np.testing.assert_array_equal(cropped.get_dataset('vehicle_attitude').data['timestamp'],
+                                      sliced.get_dataset('vehicle_attitude').data['timestamp'])
+
+    def test_ulog_crop_corrupt(self):
+        """
+        Test that 'ulog_crop' recovers from a corrupt header without sync
+        sequences the same way as ULog.
+        """
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            test_filename = os.path.join(tmpdirname, 'corrupt.ulg')
+            output_filename = os.path.join(tmpdirname, 'cropped.ulg')
+            write_corrupt_log(test_filename)
+            ulog = ULog(test_filename)
+            scanner = crop.crop_ulog(test_filename, output_filename)
+            cropped = ULog(output_filename)
+
+        self.assertTrue(scanner.corrupt_ranges)
+        self.assertGreater(sum(len(dataset.data['timestamp']) for dataset in ulog.data_list),
+                           60000)
+        self.assertEqual(len(cropped.data_list), len(ulog.data_list))
+        for dataset in ulog.data_list:
+            cropped_dataset = cropped.get_dataset(dataset.name, dataset.multi_id)
+            for name, values in dataset.data.items():
+                np.testing.assert_array_equal(cropped_dataset.data[name], values)
+        self.assertEqual(cropped.changed_parameters, ulog.changed_parameters)
+        self.assertEqual([m.message for m in cropped.logged_messages],
+                         [m.message for m in ulog.logged_messages])
+
+    def test_ulog_crop_unknown_message(self):
+        """
+        Test that 'ulog_crop' copies messages of unknown type.
+        """
+        with open(os.path.join(TEST_PATH, 'sample.ulg'), 'rb') as file_handle:
+            log_bytes = file_handle.read()
+        unknown_message = struct.pack('<HB', 4, ord('Z')) + b'abcd'
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            test_filename = os.path.join(tmpdirname, 'unknown.ulg')
+            output_filename = os.path.join(tmpdirname, 'cropped.ulg')
+            with open(test_filename, 'wb') as file_handle:
+                file_handle.write(log_bytes + unknown_message)
+            crop.crop_ulog(test_filename, output_filename, messages=['vehicle_status'])
+            with open(output_filename, 'rb') as file_handle:
+                self.assertTrue(file_handle.read().endswith(unknown_message))
+
+    @data('sample', 'sample_appended_multiple')
+    def test_ulog_merge(self, test_case):
+        """
+        Test that 'ulog_merge' restores a log that was split in two parts.
+        """
+        test_filename = os.path.join(TEST_PATH, test_case + '.ulg')
+        ulog = ULog(test_filename)
+        split_time = ulog.get_dataset('vehicle_attitude').data['timestamp'][100]
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            first_filename = os.path.join(tmpdirname, 'first.ulg')
+            second_filename = os.path.join(tmpdirname, 'second.ulg')
+            output_filename = os.path.join(tmpdirname, 'merged.ulg')
+            crop.crop_ulog(test_filename, first_filename, time_e=split_time / 1e6)
+            crop.crop_ulog(test_filename, second_filename, time_s=split_time / 1e6)
+            first_end = ULog(first_filename).last_timestamp
+            # use different msg_ids and a different parameter in the second part
+            second = ULog(second_filename)
+            msg_ids = sorted(dataset.msg_id for dataset in second.data_list)
+            for dataset, msg_id in zip(second.data_list, reversed(msg_ids)):
+                dataset.msg_id = msg_id
+            param_name = next(name for name, value in sorted(second.initial_parameters.items())
+                              if isinstance(value, int))
+            second.initial_parameters[param_name] += 1
+            second.write_ulog(second_filename)
+
+            merge.main([first_filename, second_filename, '-o', output_filename])
+            merged = ULog(output_filename)
+
+            second.message_formats['vehicle_attitude'].fields.pop()
+            second.write_ulog(second_filename)
+            with self.assertRaises(ValueError):
+                merge.merge_ulogs([first_filename, second_filename], output_filename)
+
+        self.assertFalse(merged.file_corruption)
+        self.assertEqual(merged.initial_parameters, ulog.initial_parameters)
+        self.assertEqual(merged.changed_parameters[0][1:], (param_name,
+                                                            second.initial_parameters[param_name]))
+        # the parameter change is after all the data of the first file
+        self.assertGreaterEqual(merged.changed_parameters[0][0], first_end)
+        self.assertEqual([m.message for m in merged.logged_messages],
+                         [m.message for m in ulog.logged_messages])
+        self.assertEqual(len(merged.data_list), len(ulog.data_list))
+        for dataset in ulog.data_list:
+            merged_dataset = merged.get_dataset(dataset.name, dataset.multi_id)
+            for name, values in dataset.data.items():
+                np.testing.assert_array_equal(merged_dataset.data[name], values)
+
+    def test_ulog_merge_corrupt(self):
+        """
+        Test that 'ulog_merge' recovers from a corrupt header in an input
+        without sync sequences, and returns the corrupt ranges.
+        """
+        test_filename = os.path.join(TEST_PATH, 'sample.ulg')
+        split_time = ULog(test_filename).get_dataset('vehicle_attitude').data['timestamp'][1000]
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            first_filename = os.path.join(tmpdirname, 'first.ulg')
+            second_filename = os.path.join(tmpdirname, 'second.ulg')
+            output_filename = os.path.join(tmpdirname, 'merged.ulg')
+            crop.crop_ulog(test_filename, first_filename, time_e=split_time / 1e6)
+            crop.crop_ulog(test_filename, second_filename, time_s=split_time / 1e6)
+            chunk = next(ULogScanner(first_filename).iter_chunks())
+            offset = chunk.file_offset + int(
+                chunk.offsets[chunk.msg_types == ULog.MSG_TYPE_DATA][100])
+            with open(first_filename, 'r+b') as file_handle:
+                file_handle.seek(offset)
+                file_handle.write(b'\xff\xff\xee')
+            first = ULog(first_filename)
+            second = ULog(second_filename)
+
+            corrupt_ranges = merge.merge_ulogs([first_filename, second_filename],
+                                               output_filename)
+            merged = ULog(output_filename)
+
+        self.assertEqual(corrupt_ranges[0][0][0], offset)
+        self.assertEqual(corrupt_ranges[1], [])
+        for dataset in merged.data_list:
+            expected = [ulog.get_dataset(dataset.name, dataset.multi_id).data['timestamp']
+                        for ulog in (first, second)
+                        if any(d.name == dataset.name and d.multi_id == dataset.multi_id
+                               for d in ulog.data_list)]
+            np.testing.assert_array_equal(dataset.data['timestamp'], np.concatenate(expected))
+        self.assertEqual(merged.get_dataset('vehicle_attitude').data['timestamp'][-1],
+                         second.get_dataset('vehicle_attitude').data['timestamp'][-1])
+
+    @data('sample', 'sample_appended_multiple', 'sample_logging_tagged_and_default_params')
+    def test_ulog_validate(self, test_case):
+        """
+        Test that 'ulog_validate' accepts the sample logs and reports
+        structural errors.
+        """
+        test_filename = os.path.join(TEST_PATH, test_case + '.ulg')
+        result = batch.run_command('validate', test_filename)
+        self.assertTrue(result['ok'])
+        verdict = json.loads(result['output'])
+        self.assertTrue(verdict['valid'])
+        self.assertEqual(verdict['errors'], {})
+        self.assertEqual(verdict['num_messages'], sum(
+            len(chunk.offsets) for chunk in ULogScanner(test_filename).iter_chunks()))
+
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            invalid_filename = os.path.join(tmpdirname, 'invalid.ulg')
+            with ULogWriter(invalid_filename) as writer:
+                writer.write_format('topic', [('uint64_t', 0, 'timestamp'), ('float', 0, 'x')])
+                msg_id = writer.add_subscription('topic')
+                writer.write_data(msg_id, {'timestamp': np.array([1, 3, 2, 4], dtype=np.uint64),
+                                           'x': np.zeros(4, dtype=np.float32)})
+                records = writer.make_data_records(msg_id, {
+                    'timestamp': np.array([5], dtype=np.uint64),
+                    'x': np.zeros(1, dtype=np.float32)})
+                records['@msg_id'] = msg_id + 1
+                writer.write_serialized(records.tobytes()) # not subscribed
+                records['@msg_id'] = msg_id
+                records['@msg_size'] -= 1
+                writer.write_serialized(records.tobytes()[:-1]) # too short
+                writer.write_serialized(bytes(3)) # corrupt header
+                writer.write_serialized(b'\x08\x00')
+            result = batch.run_command('validate', invalid_filename)
+        self.assertFalse(result['ok'])
+        verdict = json.loads(result['output'])
+        self.assertFalse(verdict['valid'])
+        self.assertEqual(verdict['errors'], {'non_monotonic_timestamps': 1,
+                                             'unsubscribed_msg_ids': 1,
+                                             'message_size': 1,
+                                             'corrupt_ranges': 1})
+        self.assertEqual(verdict['non_monotonic_topics'], ['topic/0'])
+        self.assertEqual(verdict['warnings'], {'truncated_bytes': 2})
+
+        with open(test_filename, 'rb') as file_handle:
+            self.assertTrue(validate.validate_ulog(file_handle)['valid'])
+        with open(os.path.join(TEST_PATH, 'sample_info.txt'), 'rb') as file_handle:
+            self.assertEqual(validate.validate_ulog(file_handle)['errors'], {'definitions': 1})
+
+    def test_ulog_validate_corrupt(self):
+        """
+        Test that 'ulog_validate' recovers from an oversized header of a known
+        message type.
+        """
+        num_messages = validate.validate_ulog(os.path.join(TEST_PATH, 'sample.ulg'))[
+            'num_messages']
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            test_filename = os.path.join(tmpdirname, 'corrupt.ulg')
+            offset = write_corrupt_log(test_filename, header=struct.pack(
+                '<HB', 0xffff, ULog.MSG_TYPE_DATA))
+            verdict = validate.validate_ulog(test_filename)
+        self.assertFalse(verdict['valid'])
+        self.assertEqual(verdict['corrupt_ranges'][0][0], offset)
+        self.assertLess(verdict['corrupt_ranges'][-1][1], offset + 10000)
+        self.assertGreater(verdict['num_messages'], num_messages - 100)
+
+    def test_ulog_validate_removed_subscription(self):
+        """
+        Test that 'ulog_validate' accepts a msg_id that is subscribed again
+        after a removal, and reports data after the removal.
+        """
+        def write_log(file_name, data_after_remove):
+            with ULogWriter(file_name) as writer:
+                writer.write_format('topic', [('uint64_t', 0, 'timestamp'), ('float', 0, 'x')])
+                writer.write_format('other', [('uint64_t', 0, 'timestamp'), ('double', 0, 'y')])
+                msg_id = writer.add_subscription('topic')
+                writer.write_data(msg_id, {'timestamp': np.array([10, 20], dtype=np.uint64),
+                                           'x': np.zeros(2, dtype=np.float32)})
+                writer.write_serialized(struct.pack('<HBH', 2, ULog.MSG_TYPE_REMOVE_LOGGED_MSG,
+                                                    msg_id))
+                if data_after_remove:
+                    writer.write_data(msg_id, {'timestamp': np.array([30], dtype=np.uint64),
+                                               'x': np.zeros(1, dtype=np.float32)})
+                    return
+                # same msg_id for another topic, with a larger size and
+                # smaller timestamps
+                writer.write_serialized(struct.pack('<HBBH', 3 + 5, ULog.MSG_TYPE_ADD_LOGGED_MSG,
+                                                    0, msg_id) + b'other')
+                writer.write_serialized(struct.pack('<HBHQd', 2 + 16, ULog.MSG_TYPE_DATA,
+                                                    msg_id, 5, 1.0))
+
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            test_filename = os.path.join(tmpdirname, 'removed.ulg')
+            write_log(test_filename, False)
+            verdict = validate.validate_ulog(test_filename)
+            self.assertTrue(verdict['valid'])
+            self.assertEqual(verdict['errors'], {})
+            write_log(test_filename, True)
+            verdict = validate.validate_ulog(test_filename)
+        self.assertEqual(verdict['errors'], {'unsubscribed_msg_ids': 1})
+
+    @data('sample', 'sample_log_small')
+    def test_ulog2parquet(self, test_case):
+        """
+        Test that 'ulog2parquet' writes all the data.
+        """
+        try:
+            import pyarrow.parquet as pq # pylint: disable=import-outside-toplevel
+        except ImportError:
+            self.skipTest('pyarrow not installed')
+
+        ulog_file_name = os.path.join(TEST_PATH, test_case+'.ulg')
+        ulog = ULog(ulog_file_name)
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            file_names = ulog2parquet.convert_ulog2parquet(ulog_file_name, None, tmpdirname,
+                                                           row_group_size=1000)
+            self.assertEqual(len(file_names), len(ulog.data_list))
+            for dataset, file_name in zip(ulog.data_list, file_names):
+                table = pq.read_table(file_name)
+                np.testing.assert_array_equal(table.column('timestamp').to_numpy(),
+                                              dataset.data['timestamp'])
+
     @data('sample', 'sample_appended', 'sample_appended_multiple')
     def test_pyulog_info_cli(self, test_case):
         """
@@ -82,6 +486,80 @@ class TestCommandLineTools(unittest.TestCase):
         self.run_against_file(
                 os.path.join(TEST_PATH, test_case+'_info.txt'), info.main)
 
+    def test_batch(self):
+        """
+        Test that 'ulog_batch' runs a command on all files and collects the output.
+        """
+        file_names = batch.find_log_files(TEST_PATH)
+        self.assertIn(os.path.join(TEST_PATH, 'sample.ulg'), file_names)
+        file_names.append(os.path.join(TEST_PATH, 'sample_info.txt')) # not a log
+
+        jsonl_file = StringIO()
+        summary = batch.run_batch('info', file_names, ['-v'], jsonl_file, jobs=2)
+        self.assertEqual(summary['total'], len(file_names))
+        self.assertEqual(summary['ok'], len(file_names) - 1)
+        self.assertEqual(summary['failed'], [os.path.join(TEST_PATH, 'sample_info.txt')])
+
+        results = [json.loads(line) for line in jsonl_file.getvalue().splitlines()]
+        results = {result['file']: result for result in results}
+        self.assertIn('TypeError', results[os.path.join(TEST_PATH, 'sample_info.txt')]['error'])
+        with open(os.path.join(TEST_PATH, 'sample_info.txt'), 'r', encoding='utf8') as file_handle:
+            self.assertEqual(results[os.path.join(TEST_PATH, 'sample.ulg')]['output'].strip(),
+                             file_handle.read().strip())
+
+    def test_batch_output_paths(self):
+        """
+        Test that files with the same name in different directories do not
+        overwrite each other's output.
+        """
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            file_names = []
+            for sub_directory in ['a', 'b']:
+                os.mkdir(os.path.join(tmpdirname, sub_directory))
+                file_names.append(os.path.join(tmpdirname, sub_directory, 'sample.ulg'))
+                shutil.copyfile(os.path.join(TEST_PATH, 'sample.ulg'), file_names[-1])
+            output_directory = os.path.join(tmpdirname, 'out')
+            summary = batch.run_batch('csv', file_names, ['-m', 'vehicle_attitude',
+                                                          '-o', output_directory],
+                                      jobs=2, output_directory=output_directory)
+            self.assertEqual(summary['ok'], 2)
+            for sub_directory in ['a', 'b']:
+                self.assertTrue(os.path.isfile(os.path.join(
+                    output_directory, sub_directory, 'sample_vehicle_attitude_0.csv')))
+                self.assertTrue(os.path.isfile(os.path.join(
+                    output_directory, sub_directory, 'sample.ulg.txt')))
+
+    def test_batch_output_files(self):
+        """
+        Test that commands writing a single output file write one file per log.
+        """
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            file_names = []
+            for sub_directory in ['a', 'b']:
+                os.mkdir(os.path.join(tmpdirname, sub_directory))
+                file_names.append(os.path.join(tmpdirname, sub_directory,
+                                               'sample_log_small.ulg'))
+                shutil.copyfile(os.path.join(TEST_PATH, 'sample_log_small.ulg'),
+                                file_names[-1])
+            kml_directory = os.path.join(tmpdirname, 'kml')
+            params_directory = os.path.join(tmpdirname, 'params')
+            summary = batch.run_batch('kml', file_names, ['-o', kml_directory], jobs=2)
+            self.assertEqual(summary['ok'], 2)
+            summary = batch.run_batch('params', file_names, [params_directory, '-f', 'csv'],
+                                      jobs=2)
+            self.assertEqual(summary['ok'], 2)
+            for sub_directory in ['a', 'b']:
+                self.assertTrue(os.path.isfile(os.path.join(
+                    kml_directory, sub_directory, 'sample_log_small.kml')))
+                self.assertTrue(os.path.isfile(os.path.join(
+                    params_directory, sub_directory, 'sample_log_small.txt')))
+
+            self.assertEqual(batch._get_command_args( # pylint: disable=protected-access
+                'kml', ['--output=kml'], os.path.join('a', 'sample.ulg')),
+                             ['--output', os.path.join('kml', 'a', 'sample.kml')])
+            self.assertEqual(batch._get_command_args( # pylint: disable=protected-access
+                'params', ['-i'], os.path.join('a', 'sample.ulg')), ['-i'])
+
     @unittest.skip("no gps data in log file")
     def test_extract_gps_dump_cli(self):
         """
@@ -94,6 +572,31 @@ class TestCommandLineTools(unittest.TestCase):
         ]
         extract_gps_dump.main()
 
+    def test_get_gps_dump_streams(self):
+        """
+        Test extracting the raw gps communication from a gps_dump topic.
+        """
+        fields = [('timestamp', 'uint64_t'), ('instance', 'uint8_t'), ('len', 'uint8_t')] + \
+            [('data[{}]'.format(i), 'uint8_t') for i in range(4)]
+        dtype = np.dtype([(name, '<u8' if name == 'timestamp' else 'u1') for name, _ in fields])
+        records = np.zeros(4, dtype=dtype)
+        records['timestamp'] = [1, 2, 3, 4]
+        records['instance'] = [0, 0, 1, 0]
+        records['len'] = [2, 0x80 | 3, 4, 4]
+        for i in range(4):
+            records['data[{}]'.format(i)] = [10 + i, 20 + i, 30 + i, 40 + i]
+        gps_dump_data = ULog.Data(SimpleNamespace(
+            multi_id=0, msg_id=1, message_name='gps_dump', timestamp_idx=0,
+            field_data=[ULog._FieldData(*field) for field in fields], # pylint: disable=protected-access
+            buffer=bytearray(records.tobytes()), dtype=dtype))
+
+        to_device, from_device = extract_gps_dump.get_gps_dump_streams(gps_dump_data)
+        self.assertEqual(to_device, bytes([20, 21, 22]))
+        self.assertEqual(from_device, bytes([10, 11, 40, 41, 42, 43]))
+        to_device, from_device = extract_gps_dump.get_gps_dump_streams(gps_dump_data, 1)
+        self.assertEqual(to_device, b'')
+        self.assertEqual(from_device, bytes([30, 31, 32, 33]))
+
     @data('sample', 'sample_appended', 'sample_px4_events')
     def test_messages_cli(self, test_case):
         """
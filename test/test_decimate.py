@@ -0,0 +1,118 @@
+'''
+Test the decimate module
+'''
+
+import os
+import inspect
+import tempfile
+import unittest
+
+import numpy as np
+from ddt import ddt, data
+
+from pyulog import ULog
+from pyulog.decimate import DecimationPyramid, ULogDecimation, lttb
+
+TEST_PATH = os.path.dirname(os.path.abspath(
+    inspect.getfile(inspect.currentframe())))
+
+@ddt
+class TestDecimate(unittest.TestCase):
+    '''
+    Test the min/max/mean decimation pyramids
+    '''
+
+    @data(1, 2, 1000, 1001, 1024)
+    def test_levels(self, num_samples):
+        '''
+        Test the levels against reductions over the raw samples
+        '''
+        timestamps = np.arange(num_samples, dtype=np.uint64) * 1000
+        values = np.random.default_rng(0).integers(-100, 100, num_samples).astype(np.int16)
+        pyramid = DecimationPyramid(timestamps, values)
+        self.assertEqual(len(pyramid.levels[-1].min), 1)
+        assert np.shares_memory(pyramid.levels[0].mean, values)
+        for k, level in enumerate(pyramid.levels):
+            self.assertEqual(level.bucket_size, 1 << k)
+            starts = np.arange(0, num_samples, level.bucket_size)
+            np.testing.assert_array_equal(level.timestamps, timestamps[starts])
+            np.testing.assert_array_equal(level.min, np.minimum.reduceat(values, starts))
+            np.testing.assert_array_equal(level.max, np.maximum.reduceat(values, starts))
+            np.testing.assert_allclose(level.mean, np.add.reduceat(values.astype(np.float64),
+                                                                   starts) /
+                                       np.diff(np.append(starts, num_samples)))
+
+    @data('minmax', 'mean', 'lttb')
+    def test_get_points(self, method):
+        '''
+        Test the number of points and the covered window of a query
+        '''
+        num_samples = 100000
+        timestamps = np.arange(num_samples, dtype=np.uint64) * 1000
+        values = np.sin(np.arange(num_samples) / 1000.)
+        values[54321] = 10
+        pyramid = DecimationPyramid(timestamps, values)
+
+        for t_start, t_end, max_points in [(None, None, 1000), (20000000, 60000000, 500),
+                                           (30000000, 30100000, 200), (0, 1, 100)]:
+            point_timestamps, point_values = pyramid.get_points(t_start, t_end, max_points,
+                                                                method)
+            self.assertLessEqual(len(point_timestamps), max_points)
+            self.assertEqual(len(point_timestamps), len(point_values))
+            self.assertTrue(np.all(np.diff(point_timestamps.astype(np.int64)) >= 0))
+            self.assertLessEqual(point_timestamps[-1], t_end or timestamps[-1])
+            if t_end == 30100000:
+                # few enough samples: the raw data
+                mask = (timestamps >= t_start) & (timestamps < t_end)
+                np.testing.assert_array_equal(point_timestamps, timestamps[mask])
+                np.testing.assert_array_equal(point_values, values[mask])
+        if method == 'minmax':
+            # spikes are kept
+            self.assertEqual(pyramid.get_points(max_points=10)[1].max(), 10)
+        self.assertEqual(len(pyramid.get_points(0, 0, 100, method)[0]), 0)
+        self.assertRaises(ValueError, pyramid.get_points, method='invalid')
+
+    def test_lttb(self):
+        '''
+        Test the points selected by lttb
+        '''
+        timestamps = np.arange(1000, dtype=np.uint64)
+        values = np.zeros(1000)
+        values[[100, 500, 900]] = [5, -5, 5]
+        point_timestamps, point_values = lttb(timestamps, values, 5)
+        np.testing.assert_array_equal(point_timestamps, [0, 100, 500, 900, 999])
+        np.testing.assert_array_equal(point_values, [0, 5, -5, 5, 0])
+        self.assertEqual(len(lttb(timestamps, values, 2000)[0]), 1000)
+        self.assertRaises(ValueError, lttb, timestamps, values, 2)
+
+    def test_ulog_decimation(self):
+        '''
+        Test building, storing and loading the pyramids of a ULog
+        '''
+        ulog = ULog(os.path.join(TEST_PATH, 'sample.ulg'))
+        decimation = ULogDecimation(ulog)
+        pyramid = decimation.get_pyramid('vehicle_attitude', 'q[0]')
+        self.assertIs(decimation.get_pyramid('vehicle_attitude', 'q[0]'), pyramid)
+        decimation.get_pyramid('sensor_combined', 'gyro_rad[0]')
+
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            cache_file_name = os.path.join(tmpdirname, 'sample.ulg.lod.npz')
+            decimation.save(cache_file_name)
+            loaded = ULogDecimation(ulog)
+            self.assertEqual(loaded.load(cache_file_name), 2)
+            for expected, level in zip(pyramid.levels,
+                                       loaded.get_pyramid('vehicle_attitude', 'q[0]').levels):
+                self.assertEqual(expected.bucket_size, level.bucket_size)
+                for expected_values, values in zip(expected[1:], level[1:]):
+                    np.testing.assert_array_equal(expected_values, values)
+
+            # the cache does not match a different log
+            other = ULogDecimation(ULog(os.path.join(TEST_PATH, 'sample_log_small.ulg')))
+            self.assertEqual(other.load(cache_file_name), 0)
+
+            # nor a log with the same number of samples, but other values
+            # or timestamps
+            changed = ULog(os.path.join(TEST_PATH, 'sample.ulg'))
+            changed.get_dataset('vehicle_attitude').data['q[0]'][10] += 1
+            changed.get_dataset('sensor_combined').data['timestamp'][1:] += 1
+            self.assertEqual(ULogDecimation(changed).load(cache_file_name), 0)
@@ -8,7 +8,9 @@ import unittest
 
 from ddt import ddt, data
 
-from pyulog.extract_message import extract_message
+import numpy as np
+
+from pyulog.extract_message import extract_message, iter_rows
 
 TEST_PATH = os.path.dirname(os.path.abspath(
     inspect.getfile(inspect.currentframe())))
@@ -34,4 +36,22 @@ class TestExtractMessage(unittest.TestCase):
                         time_s,
                         time_e)
 
+    @data('sample')
+    def test_extract_message_modes(self, test_case):
+        """
+        Test that the columnar and generator modes return the same values.
+        """
+        ulog_file_name = os.path.join(TEST_PATH, test_case+'.ulg')
+        message = "vehicle_attitude"
+        rows = extract_message(ulog_file_name, message, 130, 150)
+        columns = extract_message(ulog_file_name, message, 130, 150, columnar=True)
+        self.assertEqual(list(columns), list(rows[0]))
+        self.assertEqual(list(columns)[0], 'timestamp')
+        assert columns['timestamp'][0] >= 130e6
+        assert columns['timestamp'][-1] < 150e6
+        for key, values in columns.items():
+            np.testing.assert_array_equal(values, [row[key] for row in rows])
+        self.assertEqual(list(iter_rows(ulog_file_name, message, 130, 150)), rows)
+        self.assertEqual(extract_message(ulog_file_name, message, 1000), [])
+
 # vim: set et fenc=utf-8 ft=python ff=unix sts=4 sw=4 ts=4
@@ -0,0 +1,102 @@
+'''
+Guard the cold-start import time of the command line scripts
+'''
+
+import os
+import re
+import sys
+import json
+import subprocess
+import unittest
+
+from ddt import ddt, data
+
+TEST_PATH = os.path.dirname(os.path.abspath(__file__))
+
+# modules that are slow to import and only needed in specific cases, so they
+# must not be loaded when importing a script module
+DEFERRED_MODULES = ['urllib.request', 'pandas', 'pyarrow', 'zstandard',
+                    'rclpy', 'rosbag2_py', 'px4_msgs']
+
+# upper limit for the cumulative import time of a script module (this
+# includes numpy). It is generous to avoid flaky failures on slow machines.
+IMPORT_TIME_BUDGET_S = 2.0
+
+
+def get_script_modules():
+    '''
+    Get the modules of all console scripts from pyproject.toml
+    '''
+    with open(os.path.join(TEST_PATH, '..', 'pyproject.toml'), 'r', encoding='utf8') as file:
+        return sorted(set(re.findall(r'^\w+ = "(pyulog\.\w+):main"$', file.read(), re.MULTILINE)))
+
+
+def import_module(module_name):
+    '''
+    Import a module in a new interpreter.
+
+    :return: (list of loaded DEFERRED_MODULES, cumulative import time in [s]),
+             or None if a third-party dependency is missing
+    '''
+    code = ('import sys, json, {0}; print(json.dumps([m for m in {1} if m in sys.modules]))'
+            .format(module_name, DEFERRED_MODULES))
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                            capture_output=True, text=True, check=False,
+                            cwd=os.path.join(TEST_PATH, '..'))
+    if result.returncode != 0:
+        last_line = result.stderr.splitlines()[-1]
+        if 'ModuleNotFoundError' in last_line and 'pyulog' not in last_line:
+            return None
+        raise AssertionError(result.stderr)
+
+    import_time_us = None
+    for line in result.stderr.splitlines():
+        # format: 'import time: self [us] | cumulative | imported package'
+        fields = line.split('|')
+        if len(fields) == 3 and fields[2].strip() == module_name:
+            import_time_us = int(fields[1])
+    return json.loads(result.stdout), import_time_us / 1e6
+
+
+@ddt
+class TestImportTime(unittest.TestCase):
+    '''
+    Test that the command line scripts start quickly
+    '''
+
+    def test_package_import(self):
+        '''
+        Test that importing the package itself does not load numpy.
+        '''
+        code = 'import sys, pyulog; assert "numpy" not in sys.modules'
+        subprocess.run([sys.executable, '-c', code], check=True,
+                       cwd=os.path.join(TEST_PATH, '..'))
+
+    def test_submodule_access(self):
+        '''
+        Test that the submodules are available as attributes of the package
+        without importing them explicitly.
+        '''
+        code = ('import pyulog; assert pyulog.core.ULog is pyulog.ULog;'
+                ' assert callable(pyulog.ulog2csv.main);'
+                ' assert pyulog.px4_events.PX4Events;'
+                ' assert "core" in dir(pyulog)')
+        subprocess.run([sys.executable, '-c', code], check=True,
+                       cwd=os.path.join(TEST_PATH, '..'))
+        with self.assertRaises(subprocess.CalledProcessError):
+            subprocess.run([sys.executable, '-c', 'import pyulog; pyulog.no_such_module'],
+                           check=True, capture_output=True, cwd=os.path.join(TEST_PATH, '..'))
+
+    @data(*get_script_modules())
+    def test_script_import(self, module_name):
+        '''
+        Test that a script module does not load deferred modules and imports
+        within the time budget.
+        '''
+        result = import_module(module_name)
+        if result is None:
+            self.skipTest('missing dependency for ' + module_name)
+        loaded_modules, import_time_s = result
+        self.assertEqual(loaded_modules, [])
+        self.assertLess(import_time_s, IMPORT_TIME_BUDGET_S,
+                        '{} imports in {:.3f} s'.format(module_name, import_time_s))
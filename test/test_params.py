@@ -0,0 +1,72 @@
+'''
+Test the parameter timeline
+'''
+
+import os
+import inspect
+import unittest
+
+import numpy as np
+from ddt import ddt, data
+
+from pyulog import ULog
+from pyulog.parameters import ParameterTimeline
+
+TEST_PATH = os.path.dirname(os.path.abspath(
+    inspect.getfile(inspect.currentframe())))
+
+@ddt
+class TestParameterTimeline(unittest.TestCase):
+    '''
+    Test the ParameterTimeline class
+    '''
+
+    def test_value_at(self):
+        '''
+        Test looking up changed parameters at given times
+        '''
+        ulog = ULog(os.path.join(TEST_PATH, 'sample.ulg'), parameters_only=True)
+        timeline = ParameterTimeline(ulog)
+        self.assertEqual(timeline.names, sorted(ulog.initial_parameters))
+        np.testing.assert_array_equal(timeline.timestamps('COM_AUTOS_PAR'),
+                                      [0, 158196367, 162054776, 171616706, 176400452])
+        np.testing.assert_array_equal(timeline.values('COM_AUTOS_PAR'), [1, 0, 1, 0, 1])
+
+        timestamps = np.array([0, 158196366, 158196367, 170000000, 200000000], dtype=np.uint64)
+        np.testing.assert_array_equal(timeline.value_at('COM_AUTOS_PAR', timestamps),
+                                      [1, 1, 0, 1, 1])
+        np.testing.assert_array_equal(timeline.value_at('SYS_AUTOSTART', timestamps),
+                                      ulog.initial_parameters['SYS_AUTOSTART'])
+
+        snapshot = timeline.at(171616706)
+        self.assertEqual(snapshot['COM_AUTOS_PAR'], 0)
+        self.assertEqual(timeline.at(0), ulog.initial_parameters)
+
+    def test_unsorted_changes(self):
+        '''
+        Test that changes logged out of order are sorted by timestamp
+        '''
+        ulog = ULog(os.path.join(TEST_PATH, 'sample.ulg'), parameters_only=True)
+        ulog.changed_parameters.reverse()
+        ulog.changed_parameters.append((162054776, 'COM_AUTOS_PAR', 2))
+        timeline = ParameterTimeline(ulog)
+        np.testing.assert_array_equal(timeline.timestamps('COM_AUTOS_PAR'),
+                                      [0, 158196367, 162054776, 162054776, 171616706,
+                                       176400452])
+        np.testing.assert_array_equal(timeline.values('COM_AUTOS_PAR'), [1, 0, 1, 2, 0, 1])
+        np.testing.assert_array_equal(timeline.value_at('COM_AUTOS_PAR', [158196367, 170000000]),
+                                      [0, 2])
+
+    @data('sample_logging_tagged_and_default_params')
+    def test_defaults(self, base_name):
+        '''
+        Test that the default parameters are merged
+        '''
+        ulog = ULog(os.path.join(TEST_PATH, base_name + '.ulg'), parameters_only=True)
+        timeline = ParameterTimeline(ulog)
+        for default_type in [0, 1]:
+            defaults = ulog.get_default_parameters(default_type)
+            for name in timeline.names:
+                self.assertEqual(timeline.default(name, default_type),
+                                 defaults.get(name, ulog.initial_parameters[name]))
+        self.assertRaises(KeyError, timeline.default, 'NO_SUCH_PARAM', 0)
@@ -3,12 +3,18 @@ Tests the PX4Events class
 """
 
 import os
+import json
 import inspect
 import unittest
+import tempfile
+from collections import OrderedDict
+from io import StringIO
+from unittest import mock
 
 from ddt import ddt, data
 
 import pyulog
+from pyulog import messages as ulog_messages
 from pyulog.px4_events import PX4Events
 
 TEST_PATH = os.path.dirname(os.path.abspath(
@@ -45,3 +51,67 @@ class TestPX4Events(unittest.TestCase):
             (1710773380486000, 'INFO', 'Disarmed by landing')
         ]
         assert messages == expected_messages
+
+    @data('sample_px4_events')
+    def test_parser_cache(self, base_name):
+        """
+        Test that the event definitions are cached in memory and on disk.
+        """
+        # pylint: disable=protected-access
+        ulog_file_name = os.path.join(TEST_PATH, base_name + '.ulg')
+        ulog = pyulog.ULog(ulog_file_name, ['event'])
+        file_hash = ulog.msg_info_dict['metadata_events_sha256']
+
+        with tempfile.TemporaryDirectory() as cache_dir, \
+                mock.patch.object(PX4Events, '_parser_cache', OrderedDict()):
+            px4_events = PX4Events(cache_dir=cache_dir)
+            messages = px4_events.get_logged_events(ulog)
+            cache_file_name = os.path.join(cache_dir, file_hash + '.json')
+            assert os.path.isfile(cache_file_name)
+
+            # in-process cache: the same parser is reused
+            parser = px4_events._get_event_parser(ulog)
+            assert PX4Events(cache_dir=cache_dir)._get_event_parser(ulog) is parser
+
+            # a corrupt (e.g. truncated) cache file is replaced
+            with open(cache_file_name, 'r+b') as cache_file:
+                cache_file.truncate(10)
+            PX4Events._parser_cache.clear()
+            assert PX4Events(cache_dir=cache_dir).get_logged_events(ulog) == messages
+            with open(cache_file_name, 'rb') as cache_file:
+                json.loads(cache_file.read())
+
+            # disk cache: used by a new process (simulated by clearing the
+            # in-process cache), even without the embedded definitions
+            PX4Events._parser_cache.clear()
+            ulog.msg_info_multiple_dict['metadata_events'] = [[b'invalid']]
+            assert PX4Events(cache_dir=cache_dir).get_logged_events(ulog) == messages
+
+            # size limit: the least recently used files get removed
+            with mock.patch.object(PX4Events, 'DISK_CACHE_SIZE_LIMIT',
+                                   os.path.getsize(cache_file_name)):
+                os.utime(cache_file_name, (0, 0))
+                px4_events._write_cache_file('new.json', b'{}')
+            self.assertEqual(os.listdir(cache_dir), ['new.json'])
+
+    @data('sample_px4_events')
+    def test_messages_cache_option(self, base_name):
+        """
+        Test that ulog_messages only uses the disk cache if requested.
+        """
+        # pylint: disable=protected-access
+        ulog_file_name = os.path.join(TEST_PATH, base_name + '.ulg')
+        with tempfile.TemporaryDirectory() as cache_home, \
+                mock.patch.object(PX4Events, '_parser_cache', OrderedDict()), \
+                mock.patch.dict(os.environ, {'XDG_CACHE_HOME': cache_home}), \
+                mock.patch('sys.stdout', new_callable=StringIO):
+            os.environ.pop('PYULOG_CACHE_DIR', None)
+            ulog_messages.main([ulog_file_name])
+            self.assertEqual(os.listdir(cache_home), [])
+
+            PX4Events._parser_cache.clear()
+            ulog_messages.main([ulog_file_name, '--cache'])
+            file_hash = pyulog.ULog(ulog_file_name, ['event']).msg_info_dict[
+                'metadata_events_sha256']
+            self.assertEqual(os.listdir(os.path.join(cache_home, 'pyulog', 'events')),
+                             [file_hash + '.json'])
@@ -0,0 +1,106 @@
+'''
+Test the replay module
+'''
+
+import os
+import inspect
+import unittest
+
+import numpy as np
+from ddt import ddt, data
+
+from pyulog import ULog
+from pyulog.replay import ULogReplay, PlaybackClock
+
+TEST_PATH = os.path.dirname(os.path.abspath(
+    inspect.getfile(inspect.currentframe())))
+
+@ddt
+class TestReplay(unittest.TestCase):
+    '''
+    Test replaying the data of all topics in timestamp order
+    '''
+
+    @data('sample', 'sample_logging_tagged_and_default_params')
+    def test_iter_batches(self, base_name):
+        '''
+        Test that the batches are in timestamp order and contain all records
+        '''
+        ulog = ULog(os.path.join(TEST_PATH, base_name + '.ulg'))
+        # unsorted timestamps: the indexes refer to the original order
+        dataset = ulog.data_list[0]
+        dataset.data['timestamp'] = dataset.data['timestamp'][::-1].copy()
+        replay = ULogReplay(ulog)
+
+        expected = []
+        for source_id, source in enumerate(replay.sources):
+            if source.kind == 'data':
+                timestamps = source.items.data['timestamp']
+            elif source.kind == 'logging':
+                timestamps = [message.timestamp for message in source.items]
+            else:
+                timestamps = [timestamp for timestamp, _, _ in source.items]
+            expected.extend((int(timestamp), source_id, index)
+                            for index, timestamp in enumerate(timestamps))
+        expected.sort(key=lambda record: record[0])
+        self.assertEqual(sum(source.kind == 'data' for source in replay.sources),
+                         len(ulog.data_list))
+
+        for chunk_size in [ULogReplay.CHUNK_SIZE, 7]:
+            batches = list(replay.iter_batches(100, chunk_size=chunk_size))
+            self.assertTrue(all(len(batch.timestamps) == 100 for batch in batches[:-1]))
+            records = [record for batch in batches for record in
+                       zip(batch.timestamps.tolist(), batch.source_ids.tolist(),
+                           batch.indexes.tolist())]
+            self.assertEqual(records, expected)
+
+    def test_iter_records(self):
+        '''
+        Test the records of all kinds, and the time window
+        '''
+        ulog = ULog(os.path.join(TEST_PATH, 'sample_logging_tagged_and_default_params.ulg'))
+        replay = ULogReplay(ulog, ['vehicle_attitude'], parameter_changes=False)
+        attitude = ulog.get_dataset('vehicle_attitude')
+        time_s, time_e = attitude.data['timestamp'][[10, -10]] / 1e6
+
+        records = list(replay.iter_records(time_s, time_e, chunk_size=5))
+        timestamps = [record.timestamp for record in records]
+        self.assertEqual(timestamps, sorted(timestamps))
+        self.assertEqual(timestamps[0], attitude.data['timestamp'][10])
+        # the end of the window is exclusive
+        self.assertEqual(timestamps[-1], attitude.data['timestamp'][-11])
+        data_records = [record for record in records if record.kind == 'data']
+        self.assertTrue(all(record.source is attitude for record in data_records))
+        np.testing.assert_array_equal([record.value for record in data_records],
+                                      np.arange(10, len(attitude.data['timestamp']) - 10))
+        num_messages = sum(len(messages) for messages in ulog.logged_messages_tagged.values())
+        self.assertGreater(num_messages, 0)
+        self.assertEqual([record.value for record in records if record.kind == 'logging'],
+                         sorted([message for messages in ulog.logged_messages_tagged.values()
+                                 for message in messages if time_s * 1e6 <= message.timestamp
+                                 < time_e * 1e6], key=lambda message: message.timestamp))
+        # consecutive windows do not overlap
+        time_m = attitude.data['timestamp'][100] / 1e6
+        self.assertEqual(list(replay.iter_records(time_s, time_m)) +
+                         list(replay.iter_records(time_m, time_e)), records)
+
+        ulog = ULog(os.path.join(TEST_PATH, 'sample.ulg'))
+        records = [record for record in ULogReplay(ulog, []).iter_records()
+                   if record.kind == 'parameter']
+        self.assertEqual([(record.timestamp, record.source, record.value) for record in records],
+                         ulog.changed_parameters)
+
+    def test_playback_clock(self):
+        '''
+        Test that the records are released according to the playback rate
+        '''
+        wall_clock = [100.0]
+        sleeps = []
+        def sleep(delay):
+            sleeps.append(delay)
+            wall_clock[0] += delay
+        clock = PlaybackClock(2.0, lambda: wall_clock[0], sleep)
+        for timestamp in [1000000, 2000000, 2000000, 5000000]:
+            clock.wait_until(timestamp)
+        np.testing.assert_allclose(sleeps, [0.5, 1.5])
+        self.assertRaises(ValueError, PlaybackClock, 0)
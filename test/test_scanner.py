@@ -0,0 +1,70 @@
+'''
+Test the raw message scanner
+'''
+
+import os
+import inspect
+import unittest
+from io import BytesIO
+
+import numpy as np
+from ddt import ddt, data
+
+from pyulog import ULog
+from pyulog.scanner import ULogScanner
+
+TEST_PATH = os.path.dirname(os.path.abspath(
+    inspect.getfile(inspect.currentframe())))
+
+@ddt
+class TestULogScanner(unittest.TestCase):
+    '''
+    Test the ULogScanner class
+    '''
+
+    @data('sample', 'sample_appended_multiple', 'sample_logging_tagged_and_default_params')
+    def test_scan(self, base_name):
+        '''
+        Test that the data timestamps match the parsed log
+        '''
+        ulog_file_name = os.path.join(TEST_PATH, base_name + '.ulg')
+        ulog = ULog(ulog_file_name)
+        # small chunks to test messages across chunk boundaries
+        scanner = ULogScanner(ulog_file_name, read_chunk_size=1000)
+        self.assertEqual(scanner.start_timestamp, ulog.start_timestamp)
+        self.assertEqual(scanner.message_formats, ulog.message_formats)
+
+        timestamps = {}
+        logged_timestamps = []
+        for chunk in scanner.iter_chunks():
+            is_data = chunk.msg_types == ULog.MSG_TYPE_DATA
+            for msg_id in np.unique(chunk.msg_ids[is_data]).tolist():
+                timestamps.setdefault(msg_id, []).append(
+                    chunk.timestamps[is_data & (chunk.msg_ids == msg_id)])
+            logged_timestamps.extend(
+                chunk.timestamps[chunk.msg_types == ULog.MSG_TYPE_LOGGING].tolist())
+        self.assertEqual(scanner.corrupt_ranges, [])
+
+        for dataset in ulog.data_list:
+            np.testing.assert_array_equal(np.concatenate(timestamps[dataset.msg_id]),
+                                          dataset.data['timestamp'])
+        self.assertEqual(logged_timestamps, [m.timestamp for m in ulog.logged_messages])
+
+    def test_corruption(self):
+        '''
+        Test that corrupt bytes are skipped up to the next sync sequence
+        '''
+        with open(os.path.join(TEST_PATH, 'sample_log_small.ulg'), 'rb') as file_handle:
+            log_data = bytearray(file_handle.read())
+        scanner = ULogScanner(BytesIO(log_data))
+        sync_pos = log_data.find(ULog.SYNC_BYTES, scanner.definitions_end + 1000)
+        corrupt_start = sync_pos - 500
+        log_data[corrupt_start:corrupt_start + 10] = bytes(10)
+
+        scanner = ULogScanner(BytesIO(log_data))
+        num_messages = sum(len(chunk.offsets) for chunk in scanner.iter_chunks())
+        self.assertGreater(num_messages, 1000)
+        self.assertEqual(len(scanner.corrupt_ranges), 1)
+        start, end = scanner.corrupt_ranges[0]
+        self.assertLessEqual(start, corrupt_start)
+        self.assertEqual(end, sync_pos + len(ULog.SYNC_BYTES))
@@ -7,10 +7,15 @@ import inspect
 import unittest
 import tempfile
 from io import BytesIO
+from types import SimpleNamespace
+from unittest import mock
 
+import numpy as np
 from ddt import ddt, data
 
 import pyulog
+from pyulog.scanner import ULogScanner
+from pyulog.writer import ULogWriter
 
 TEST_PATH = os.path.dirname(os.path.abspath(
     inspect.getfile(inspect.currentframe())))
@@ -89,4 +94,262 @@ class TestULog(unittest.TestCase):
             else:
                 assert copied_value == original_value
 
+    @data('sample_logging_tagged_and_default_params')
+    def test_write_ulog_chunks(self, base_name):
+        '''
+        Test that the output does not depend on the number of messages that
+        are written at once, and that modified bool values are written as 0/1.
+        '''
+        original = pyulog.ULog(os.path.join(TEST_PATH, base_name + '.ulg'))
+        with BytesIO() as bytes_handle:
+            original.write_ulog(bytes_handle)
+            expected = bytes_handle.getvalue()
+        with mock.patch.object(pyulog.ULog, '_WRITE_CHUNK_SIZE', 7), BytesIO() as bytes_handle:
+            original.write_ulog(bytes_handle)
+            self.assertEqual(bytes_handle.getvalue(), expected)
+
+        dataset = next(d for d in original.data_list
+                       if any(f.type_str == 'bool' for f in d.field_data))
+        field_name = next(f.field_name for f in dataset.field_data if f.type_str == 'bool')
+        dataset.data[field_name] = np.full(len(dataset.data['timestamp']), 5, dtype=np.int8)
+        with BytesIO() as bytes_handle:
+            original.write_ulog(bytes_handle)
+            bytes_handle.seek(0)
+            copied = pyulog.ULog(bytes_handle)
+        np.testing.assert_array_equal(
+            copied.get_dataset(dataset.name, dataset.multi_id).data[field_name], 1)
+
+    def test_corrupt_ranges(self):
+        '''
+        Test that corrupt messages are skipped up to the next sync sequence,
+        and that the skipped byte ranges are reported.
+        '''
+        num_messages = 1000
+        with BytesIO() as bytes_handle:
+            with ULogWriter(bytes_handle, sync_interval=1000) as writer:
+                writer.write_format('topic', [('uint64_t', 0, 'timestamp'), ('float', 0, 'x')])
+                msg_id = writer.add_subscription('topic')
+                writer.write_data(msg_id, {
+                    'timestamp': np.arange(num_messages, dtype=np.uint64) + 1,
+                    'x': np.zeros(num_messages, dtype=np.float32)})
+            log_data = bytearray(bytes_handle.getvalue())
+
+        chunk = next(ULogScanner(BytesIO(log_data)).iter_chunks())
+        offsets = chunk.offsets + chunk.file_offset
+        data_offsets = offsets[chunk.msg_types == pyulog.ULog.MSG_TYPE_DATA]
+        sync_ends = offsets[chunk.msg_types == pyulog.ULog.MSG_TYPE_SYNC] + 3 + 8
+        expected_ranges = []
+        for offset in data_offsets[[100, 500, 501]]:
+            log_data[offset:offset+3] = bytes(3)
+            sync_end = int(sync_ends[np.searchsorted(sync_ends, offset)])
+            if expected_ranges and expected_ranges[-1][1] == sync_end:
+                continue
+            expected_ranges.append((int(offset), sync_end))
+        num_skipped = sum(np.count_nonzero((data_offsets >= start) & (data_offsets < end))
+                          for start, end in expected_ranges)
+
+        # small chunks to test sync sequences crossing chunk boundaries
+        for chunk_size in [1 << 24, 7]:
+            with mock.patch.object(pyulog.ULog, '_SYNC_SEARCH_CHUNK_SIZE', chunk_size):
+                ulog = pyulog.ULog(BytesIO(log_data))
+            self.assertTrue(ulog.file_corruption)
+            self.assertEqual(ulog.corrupt_ranges, expected_ranges)
+            self.assertEqual(len(ulog.data_list[0].data['timestamp']),
+                             num_messages - num_skipped)
+        scanner = ULogScanner(BytesIO(log_data))
+        for _ in scanner.iter_chunks():
+            pass
+        self.assertEqual(scanner.corrupt_ranges, expected_ranges)
+        self.assertEqual(pyulog.ULog(BytesIO(log_data), parameters_only=True).corrupt_ranges,
+                         expected_ranges)
+
+    @data(100, 6000, 40000)
+    def test_corrupt_ranges_no_sync(self, data_index):
+        '''
+        Test that without sync sequences, the corrupt range covers the bogus
+        messages read until the parsing is aligned again.
+        '''
+        with open(os.path.join(TEST_PATH, 'sample.ulg'), 'rb') as file_handle:
+            log_data = bytearray(file_handle.read())
+        offsets = []
+        msg_types = []
+        for chunk in ULogScanner(BytesIO(log_data)).iter_chunks():
+            offsets.append(chunk.offsets + chunk.file_offset)
+            msg_types.append(chunk.msg_types)
+        offsets = np.concatenate(offsets)
+        data_offsets = offsets[np.concatenate(msg_types) == pyulog.ULog.MSG_TYPE_DATA]
+        offset = int(data_offsets[data_index])
+        log_data[offset:offset+3] = b'\xff\xff\xee'
+
+        ulog = pyulog.ULog(BytesIO(log_data))
+        self.assertTrue(ulog.file_corruption)
+        self.assertEqual(len(ulog.corrupt_ranges), 1)
+        start, end = ulog.corrupt_ranges[0]
+        self.assertEqual(start, offset)
+        # the parsing is aligned again at a message of the original file
+        self.assertIn(end, offsets)
+        # all the data is recovered, except for the data messages in the range
+        num_lost = len(data_offsets) - sum(len(dataset.data['timestamp'])
+                                           for dataset in ulog.data_list)
+        self.assertEqual(num_lost, np.count_nonzero((data_offsets >= start) &
+                                                    (data_offsets < end)))
+        self.assertLess(num_lost, len(data_offsets) // 10)
+
+    @data(100, 6000, 40000, 55100)
+    def test_parameters_only_corrupt(self, data_index):
+        '''
+        Test that loading only the parameters of a corrupt log without sync
+        sequences gives the same parameters as loading the whole file.
+        '''
+        ulog_file_name = os.path.join(TEST_PATH, 'sample.ulg')
+        with open(ulog_file_name, 'rb') as file_handle:
+            log_data = bytearray(file_handle.read())
+        chunk = next(ULogScanner(ulog_file_name).iter_chunks())
+        offset = chunk.file_offset + int(
+            chunk.offsets[chunk.msg_types == pyulog.ULog.MSG_TYPE_DATA][data_index])
+        log_data[offset:offset+3] = b'\xff\xff\xee'
+
+        ulog = pyulog.ULog(BytesIO(log_data))
+        ulog_params = pyulog.ULog(BytesIO(log_data), parameters_only=True)
+        self.assertTrue(ulog_params.file_corruption)
+        self.assertGreater(len(ulog.changed_parameters), 0)
+        self.assertEqual(ulog_params.changed_parameters, ulog.changed_parameters)
+        self.assertEqual(ulog_params.initial_parameters, ulog.initial_parameters)
+        self.assertEqual(ulog_params.msg_info_dict, ulog.msg_info_dict)
+        self.assertEqual(ulog_params.msg_info_multiple_dict, ulog.msg_info_multiple_dict)
+
+    @data('sample',
+          'sample_appended_multiple',
+          'sample_logging_tagged_and_default_params')
+    def test_parameters_only(self, base_name):
+        '''
+        Test that loading only the parameters gives the same parameters as
+        loading the whole file.
+        '''
+        ulog_file_name = os.path.join(TEST_PATH, base_name + '.ulg')
+        ulog = pyulog.ULog(ulog_file_name)
+        # small chunks to test messages crossing chunk boundaries
+        for chunk_size in [1 << 22, 1000]:
+            with mock.patch.object(pyulog.ULog, '_PARAMETERS_READ_CHUNK_SIZE', chunk_size):
+                ulog_params = pyulog.ULog(ulog_file_name, parameters_only=True)
+            self.assertEqual(ulog_params.initial_parameters, ulog.initial_parameters)
+            self.assertEqual(ulog_params.changed_parameters, ulog.changed_parameters)
+            for default_type in [0, 1]:
+                self.assertEqual(ulog_params.get_default_parameters(default_type),
+                                 ulog.get_default_parameters(default_type))
+            self.assertEqual(ulog_params.last_timestamp, ulog.last_timestamp)
+            self.assertEqual(ulog_params.msg_info_dict, ulog.msg_info_dict)
+            self.assertEqual(ulog_params.msg_info_multiple_dict, ulog.msg_info_multiple_dict)
+            self.assertEqual(ulog_params.data_list, [])
+
+    @data('sample', 'sample_logging_tagged_and_default_params')
+    def test_slice(self, base_name):
+        '''
+        Test slicing the data and the ULog by time.
+        '''
+        ulog = pyulog.ULog(os.path.join(TEST_PATH, base_name + '.ulg'))
+        dataset = ulog.data_list[0]
+        timestamps = dataset.data['timestamp']
+        t_start, t_end = int(timestamps[3]), int(timestamps[-3]) + 1
+
+        sliced = dataset.slice(t_start, t_end)
+        mask = (timestamps >= t_start) & (timestamps < t_end)
+        for name, values in dataset.data.items():
+            np.testing.assert_array_equal(sliced.data[name], values[mask])
+            assert np.shares_memory(sliced.data[name], values)
+        self.assertEqual(dataset.get_index_range(t_start, t_end), (3, len(timestamps) - 2))
+        self.assertEqual(dataset.get_index_range(), (0, len(timestamps)))
+        for t_range in [(0, 1), (t_end, t_start), (ulog.last_timestamp + 1, None)]:
+            self.assertEqual(len(dataset.slice(*t_range).data['timestamp']), 0)
+
+        sliced_ulog = ulog.slice(t_start, t_end)
+        self.assertEqual(len(sliced_ulog.data_list), len(ulog.data_list))
+        for original, sliced in zip(ulog.data_list, sliced_ulog.data_list):
+            self.assertEqual(len(sliced.data['timestamp']),
+                             np.count_nonzero((original.data['timestamp'] >= t_start) &
+                                              (original.data['timestamp'] < t_end)))
+        self.assertEqual(sliced_ulog.logged_messages,
+                         [m for m in ulog.logged_messages if t_start <= m.timestamp < t_end])
+        for tag, messages in sliced_ulog.logged_messages_tagged.items():
+            self.assertEqual(messages, [m for m in ulog.logged_messages_tagged[tag]
+                                        if t_start <= m.timestamp < t_end])
+        self.assertEqual(sliced_ulog.changed_parameters,
+                         [p for p in ulog.changed_parameters if t_start <= p[0] < t_end])
+        expected_parameters = dict(ulog.initial_parameters)
+        expected_parameters.update((name, value) for timestamp, name, value
+                                   in ulog.changed_parameters if timestamp < t_start)
+        self.assertEqual(sliced_ulog.initial_parameters, expected_parameters)
+        self.assertLessEqual(sliced_ulog.last_timestamp, t_end)
+        # the original is unchanged
+        self.assertEqual(len(ulog.data_list[0].data['timestamp']), len(timestamps))
+
+    def test_data_field_groups(self):
+        '''
+        Test that array and string fields are combined.
+        '''
+        field_data = [pyulog.ULog._FieldData(name, type_str) # pylint: disable=protected-access
+                      for name, type_str in [('timestamp', 'uint64_t'),
+                                             ('q[0]', 'float'), ('q[1]', 'float'),
+                                             ('name[0]', 'char'), ('name[1]', 'char'),
+                                             ('name[2]', 'char'), ('flag', 'bool'),
+                                             ('_padding0[0]', 'uint8_t')]]
+        dtype = np.dtype([('timestamp', '<u8'), ('q[0]', '<f4'), ('q[1]', '<f4'),
+                          ('name[0]', 'i1'), ('name[1]', 'i1'), ('name[2]', 'i1'),
+                          ('flag', 'i1'), ('_padding0[0]', 'u1')])
+        records = np.zeros(3, dtype=dtype)
+        records['timestamp'] = [1, 2, 3]
+        records['q[0]'] = [0.5, 1.5, 2.5]
+        records['q[1]'] = [-1, -2, -3]
+        for i, string in enumerate([b'ab\x00', b'xyz', b'\x00yz']):
+            for k, char in enumerate(string):
+                records['name[{}]'.format(k)][i] = char
+        records['flag'] = [0, 1, 0]
+        dataset = pyulog.ULog.Data(SimpleNamespace(
+            multi_id=0, msg_id=1, message_name='test', field_data=field_data,
+            timestamp_idx=0, buffer=bytearray(records.tobytes()), dtype=dtype))
+
+        self.assertEqual(dataset.get_field_groups(),
+                         [('timestamp', 'uint64_t', 0), ('q', 'float', 2),
+                          ('name', 'char', 3), ('flag', 'bool', 0)])
+        q = dataset.get_array('q')
+        np.testing.assert_array_equal(q, [[0.5, -1], [1.5, -2], [2.5, -3]])
+        assert np.shares_memory(q, dataset.data['q[0]'])
+        self.assertEqual(dataset.get_string('name').tolist(), ['ab', 'xyz', ''])
+
+        try:
+            import pyarrow # pylint: disable=import-outside-toplevel, unused-import
+        except ImportError:
+            return
+        table = dataset.to_arrow()
+        self.assertEqual(table.column_names, ['timestamp', 'q', 'name', 'flag'])
+        self.assertEqual(table.column('name').to_pylist(), ['ab', 'xyz', ''])
+        self.assertEqual(table.column('q').to_pylist(), [[0.5, -1], [1.5, -2], [2.5, -3]])
+        self.assertEqual(table.column('flag').to_pylist(), [False, True, False])
+        self.assertEqual(table.schema.metadata[b'name'], b'test')
+
+    @data('sample_log_small')
+    def test_to_pandas(self, base_name):
+        '''
+        Test the conversion to pandas DataFrames.
+        '''
+        try:
+            import pandas # pylint: disable=import-outside-toplevel, unused-import
+        except ImportError:
+            self.skipTest('pandas not installed')
+        ulog = pyulog.ULog(os.path.join(TEST_PATH, base_name + '.ulg'))
+        dataset = ulog.get_dataset('vehicle_attitude')
+        data_frame = dataset.to_pandas()
+        self.assertEqual(data_frame.index.name, 'timestamp')
+        assert np.shares_memory(data_frame['q[0]'].to_numpy(), dataset.data['q[0]'])
+        np.testing.assert_array_equal(data_frame.index.to_numpy(), dataset.data['timestamp'])
+
+        data_frame = dataset.to_pandas(index=False, arrays='lists')
+        np.testing.assert_array_equal(data_frame['q'][5], dataset.get_array('q')[5])
+
+        data_frames = ulog.to_pandas(['vehicle_imu_status'], combine_multi_ids=True)
+        data_frame = data_frames['vehicle_imu_status']
+        self.assertEqual(list(data_frame.index.names), ['multi_id', 'timestamp'])
+        num_instances = len([d for d in ulog.data_list if d.name == 'vehicle_imu_status'])
+        self.assertEqual(len(data_frame.index.unique(level='multi_id')), num_instances)
+
 # vim: set et fenc=utf-8 ft=python ff=unix sts=4 sw=4 ts=4
@@ -0,0 +1,206 @@
+'''
+Test the ULog to ROS2 bag conversion plan (does not need ROS2)
+'''
+
+import os
+import inspect
+import struct
+import unittest
+
+import numpy as np
+from ddt import ddt, data
+
+from pyulog import ULog
+from pyulog.cdr import CdrEncoder, fields_from_msg_definition
+from pyulog.ulog2ros2bag import ConversionPlan
+
+TEST_PATH = os.path.dirname(os.path.abspath(
+    inspect.getfile(inspect.currentframe())))
+
+# ULog type -> ROS2 type
+ROS2_TYPES = {
+    'int8_t': 'int8', 'uint8_t': 'uint8', 'int16_t': 'int16', 'uint16_t': 'uint16',
+    'int32_t': 'int32', 'uint32_t': 'uint32', 'int64_t': 'int64', 'uint64_t': 'uint64',
+    'float': 'float', 'double': 'double', 'bool': 'boolean', 'char': 'uint8',
+}
+
+
+def create_message_type(ulog_data):
+    '''
+    Create a class that behaves like a generated ROS2 message type for a topic
+    '''
+    field_types = {}
+    for name, type_str, array_size in ulog_data.get_field_groups():
+        field_types[name] = ROS2_TYPES[type_str] + \
+            ('[{}]'.format(array_size) if array_size > 0 else '')
+
+    class MsgType: # pylint: disable=too-few-public-methods
+        ''' fake ROS2 message type '''
+        def __init__(self):
+            for name, _, array_size in ulog_data.get_field_groups():
+                setattr(self, name, [0] * array_size if array_size > 0 else 0)
+
+        @staticmethod
+        def get_fields_and_field_types():
+            ''' same as for a ROS2 message type '''
+            return field_types
+
+    return MsgType
+
+
+@ddt
+class TestConversionPlan(unittest.TestCase):
+    '''
+    Test the ConversionPlan class
+    '''
+
+    @data('vehicle_attitude', 'vehicle_status', 'sensor_combined')
+    def test_create_messages(self, topic_name):
+        '''
+        Test that the messages contain the values of each sample
+        '''
+        ulog = ULog(os.path.join(TEST_PATH, 'sample_log_small.ulg'), [topic_name])
+        dataset = ulog.get_dataset(topic_name)
+        msg_type = create_message_type(dataset)
+        plan = ConversionPlan(dataset.field_data, msg_type.get_fields_and_field_types())
+        self.assertFalse(plan.is_composed)
+        self.assertEqual(plan.missing_fields, [])
+
+        msgs = plan.create_messages(msg_type, plan.get_columns(dataset.data, 2, 7))
+        self.assertEqual(len(msgs), 5)
+        for i, msg in enumerate(msgs):
+            for field in dataset.field_data:
+                value = dataset.data[field.field_name][i + 2]
+                if '[' in field.field_name:
+                    name, index = field.field_name[:-1].split('[')
+                    actual = getattr(msg, name)[int(index)]
+                else:
+                    actual = getattr(msg, field.field_name)
+                if field.type_str == 'bool':
+                    self.assertIs(actual, bool(value))
+                else:
+                    self.assertEqual(actual, value.item())
+                    self.assertIs(type(actual), type(value.item()))
+
+    def test_plan(self):
+        '''
+        Test the field mapping for missing fields and partial arrays
+        '''
+        field_data = [ULog._FieldData(name, type_str) # pylint: disable=protected-access
+                      for name, type_str in [('timestamp', 'uint64_t'), ('armed', 'bool'),
+                                             ('q[0]', 'float'), ('q[1]', 'float'),
+                                             ('v[1]', 'float'), ('x', 'float')]]
+        ros2_field_types = {'timestamp': 'uint64', 'armed': 'boolean',
+                            'q[0]': 'float', 'q': 'float[2]', 'v': 'float[3]'}
+        plan = ConversionPlan(field_data, ros2_field_types)
+        self.assertEqual(plan.missing_fields, ['x'])
+        self.assertEqual(plan.scalar_fields, [('timestamp', 'timestamp', False),
+                                              ('armed', 'armed', True)])
+        self.assertEqual(plan.array_fields, [('q', ['q[0]', 'q[1]'], None, False),
+                                             ('v', ['v[1]'], [1], False)])
+
+        field_data.append(ULog._FieldData('pos.x', 'float')) # pylint: disable=protected-access
+        self.assertTrue(ConversionPlan(field_data, ros2_field_types).is_composed)
+
+
+@ddt
+class TestCdrEncoder(unittest.TestCase):
+    '''
+    Test the CDR serialization
+    '''
+
+    def test_layout(self):
+        '''
+        Test the alignment of the fields
+        '''
+        encoder = CdrEncoder({'flag': 'boolean', 'timestamp': 'uint64',
+                              'q': 'float[3]', 'count': 'uint16', 'x': 'double'})
+        self.assertEqual(encoder.dtype.fields['timestamp'][1], 4 + 8)
+        self.assertEqual(encoder.dtype.fields['q'][1], 4 + 16)
+        self.assertEqual(encoder.dtype.fields['count'][1], 4 + 28)
+        self.assertEqual(encoder.dtype.fields['x'][1], 4 + 32)
+        self.assertEqual(encoder.dtype.itemsize, 4 + 40)
+
+        serialized = encoder.encode({'flag': np.array([0, 3]), 'timestamp': np.array([1, 2]),
+                                     'x': np.array([0.5, 1.5])}, 2)
+        self.assertEqual(serialized[1], b'\x00\x01\x00\x00' + struct.pack(
+            '<?7xQ12x2x2xd', True, 2, 1.5))
+        self.assertRaises(ValueError, CdrEncoder, {'name': 'string'})
+
+    def test_msg_definition(self):
+        '''
+        Test parsing a .msg definition
+        '''
+        msg_definition = """
+# comment
+uint64 timestamp # time since system start (microseconds)
+float32[4] q
+bool armed
+uint8 ARMING_STATE_INIT = 0
+uint8 ARMING_STATE_ARMED=1
+char[10] name
+int16 offset -3
+"""
+        self.assertEqual(fields_from_msg_definition(msg_definition),
+                         {'timestamp': 'uint64', 'q': 'float[4]', 'armed': 'boolean',
+                          'name': 'uint8[10]', 'offset': 'int16'})
+        # types without a fixed-size layout
+        for field_definition in ['int32[<=5] x', 'string<=10 s', 'string s', 'float32[] v',
+                                 'geometry_msgs/Point p', 'Point p', 'int32']:
+            self.assertRaises(ValueError, fields_from_msg_definition, field_definition)
+
+    def test_serialize(self):
+        '''
+        Test the serialization against known CDR bytes (little-endian, each
+        value aligned to its size relative to the end of the header)
+        '''
+        encoder = CdrEncoder({'flag': 'boolean', 'timestamp': 'uint64', 'count': 'uint16',
+                              'q': 'float[3]', 'id': 'int8', 'x': 'double', 'v': 'int32[2]'})
+        serialized = encoder.encode({
+            'flag': np.array([1]), 'timestamp': np.array([0x0102030405060708], dtype=np.uint64),
+            'count': np.array([0x0a0b]), 'q': np.array([[1.0, -2.0, 0.5]]),
+            'id': np.array([-1]), 'x': np.array([1.0]), 'v': np.array([[1, -1]])}, 1)
+        self.assertEqual(serialized, [bytes.fromhex(
+            '00010000' # encapsulation header
+            '01' '00000000000000' # flag, padding to 8
+            '0807060504030201' # timestamp
+            '0b0a' '0000' # count, padding to 4
+            '0000803f' '000000c0' '0000003f' # q
+            'ff' '00000000000000' # id, padding to 8
+            '000000000000f03f' # x
+            '01000000' 'ffffffff' # v
+            )])
+
+    @data('vehicle_attitude', 'vehicle_status', 'sensor_combined', 'vehicle_gps_position')
+    def test_serialize_topic(self, topic_name):
+        '''
+        Test that the serialized messages contain the values of each sample
+        '''
+        ulog = ULog(os.path.join(TEST_PATH, 'sample_log_small.ulg'), [topic_name])
+        dataset = ulog.get_dataset(topic_name)
+        msg_type = create_message_type(dataset)
+        plan = ConversionPlan(dataset.field_data, msg_type.get_fields_and_field_types())
+        encoder = CdrEncoder(msg_type.get_fields_and_field_types())
+
+        num_samples = min(len(dataset.data['timestamp']), 20)
+        serialized = plan.serialize_cdr(encoder, plan.get_columns(dataset.data, 0, num_samples))
+        self.assertEqual(len(serialized), num_samples)
+        records = np.frombuffer(b''.join(serialized), dtype=encoder.dtype)
+        for name, _, array_size in dataset.get_field_groups():
+            values = dataset.get_array(name, array_size)[:num_samples] if array_size > 0 else \
+                dataset.data[name][:num_samples]
+            if msg_type.get_fields_and_field_types()[name].startswith('boolean'):
+                values = values != 0
+            np.testing.assert_array_equal(records[name], values)
+
+    def test_serialize_partial_array(self):
+        '''
+        Test that array elements that are not logged are 0
+        '''
+        field_data = [ULog._FieldData(name, type_str) # pylint: disable=protected-access
+                      for name, type_str in [('timestamp', 'uint64_t'), ('v[1]', 'float')]]
+        plan = ConversionPlan(field_data, {'timestamp': 'uint64', 'v': 'float[3]'})
+        encoder = CdrEncoder({'timestamp': 'uint64', 'v': 'float[3]'})
+        serialized = plan.serialize_cdr(encoder, {'timestamp': np.array([5], dtype=np.uint64),
+                                                  'v[1]': np.array([2], dtype=np.float32)})
+        self.assertEqual(serialized, [b'\x00\x01\x00\x00' + struct.pack('<Q3f', 5, 0, 2, 0)])
@@ -0,0 +1,101 @@
+'''
+Test the ULogWriter class
+'''
+
+import os
+import inspect
+import unittest
+from io import BytesIO
+
+import numpy as np
+
+import pyulog
+from pyulog import ULogWriter
+
+TEST_PATH = os.path.dirname(os.path.abspath(
+    inspect.getfile(inspect.currentframe())))
+
+
+class TestULogWriter(unittest.TestCase):
+    '''
+    Test writing a ULog file incrementally
+    '''
+
+    def test_write(self):
+        '''
+        Test that the written messages are read back
+        '''
+        num_samples = 1000
+        timestamps = np.arange(num_samples, dtype=np.uint64) * 1000 + 1000
+        with BytesIO() as bytes_handle:
+            writer = ULogWriter(bytes_handle, start_timestamp=500, sync_interval=4096)
+            writer.write_format('vector', [('float', 0, 'x'), ('float', 0, 'y')])
+            writer.write_format('my_topic', [('uint64_t', 0, 'timestamp'),
+                                             ('vector', 2, 'vectors'),
+                                             ('bool', 0, 'valid'),
+                                             ('uint8_t', 3, '_padding0')])
+            writer.write_info('sys_name', 'PX4', 'char[3]')
+            writer.write_info_multiple('boot_console_output', ['line 1\n', 'line 2\n'],
+                                       'char[7]')
+            writer.write_parameter('SYS_AUTOSTART', 4001)
+            writer.write_default_parameter('SYS_AUTOSTART', 0, 1)
+            msg_id = writer.add_subscription('my_topic', multi_id=1)
+            self.assertRaises(ValueError, writer.write_format, 'other', [])
+
+            for start in range(0, num_samples, 100):
+                end = start + 100
+                writer.write_data(msg_id, {
+                    'timestamp': timestamps[start:end],
+                    'vectors[0].x': np.full(100, 1.5), 'vectors[0].y': np.full(100, 2.5),
+                    'vectors[1].x': np.arange(start, end), 'vectors[1].y': np.zeros(100),
+                    'valid': np.arange(start, end) % 3})
+                if start == 500:
+                    writer.write_logging(ord('6'), 'halfway', int(timestamps[end - 1]))
+                    writer.write_logging(ord('4'), 'tagged', int(timestamps[end - 1]), tag=3)
+                    writer.write_dropout(20)
+                    writer.write_parameter('SYS_AUTOSTART', 4002)
+
+            bytes_handle.seek(0)
+            ulog = pyulog.ULog(bytes_handle)
+
+        self.assertEqual(ulog.start_timestamp, 500)
+        self.assertEqual(ulog.msg_info_dict['sys_name'], 'PX4')
+        self.assertEqual(ulog.msg_info_multiple_dict['boot_console_output'],
+                         [['line 1\n', 'line 2\n']])
+        self.assertEqual(ulog.initial_parameters['SYS_AUTOSTART'], 4001)
+        self.assertEqual(ulog.get_default_parameters(0), {'SYS_AUTOSTART': 0})
+        self.assertEqual(ulog.changed_parameters, [(600000, 'SYS_AUTOSTART', 4002)])
+        self.assertEqual([m.message for m in ulog.logged_messages], ['halfway'])
+        self.assertEqual(ulog.logged_messages_tagged[3][0].message, 'tagged')
+        self.assertEqual(ulog.dropouts[0].duration, 20)
+        self.assertFalse(ulog.file_corruption)
+        self.assertGreater(ulog._sync_seq_cnt, 0) # pylint: disable=protected-access
+
+        dataset = ulog.get_dataset('my_topic', 1)
+        np.testing.assert_array_equal(dataset.data['timestamp'], timestamps)
+        np.testing.assert_array_equal(dataset.data['vectors[1].x'], np.arange(num_samples))
+        np.testing.assert_array_equal(dataset.data['valid'], np.arange(num_samples) % 3 != 0)
+
+    def test_write_ulog(self):
+        '''
+        Test that write_ulog can be reproduced with the writer
+        '''
+        original = pyulog.ULog(os.path.join(TEST_PATH, 'sample_log_small.ulg'))
+        with BytesIO() as bytes_handle:
+            with ULogWriter(bytes_handle, original.start_timestamp) as writer:
+                for message_format in original.message_formats.values():
+                    writer.write_format(message_format.name, message_format.fields)
+                for key, value in original.initial_parameters.items():
+                    writer.write_parameter(key, value)
+                for data_set in sorted(original.data_list, key=lambda x: x.data['timestamp'][0]):
+                    msg_id = writer.add_subscription(data_set.name, data_set.multi_id)
+                    writer.write_data(msg_id, data_set.data)
+            bytes_handle.seek(0)
+            copied = pyulog.ULog(bytes_handle)
+
+        self.assertEqual(copied.initial_parameters, original.initial_parameters)
+        for data_set in original.data_list:
+            copied_data = copied.get_dataset(data_set.name, data_set.multi_id)
+            self.assertEqual(copied_data.field_data, data_set.field_data)
+            for name in data_set.data:
+                np.testing.assert_array_equal(copied_data.data[name], data_set.data[name])